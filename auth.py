@@ -7,6 +7,7 @@ from pathlib import Path
 import hashlib
 from datetime import datetime, timedelta
 import re
+from dados import obter_registro
 
 # Diretório para armazenar dados
 DATA_DIR = Path("data")
@@ -230,80 +231,9 @@ def list_users():
         users_list.append(user_info)
     return users_list
 
-def save_vendas_data(df_vendas, df_devolucoes, colunas_config):
-    """Salva dados de vendas e configurações"""
-    data = {
-        'df_vendas': df_vendas.to_dict('records'),
-        'df_devolucoes': df_devolucoes.to_dict('records') if df_devolucoes is not None else [],
-        'colunas': colunas_config
-    }
-    
-    # Salvar como parquet é mais eficiente
-    df_vendas.to_parquet(DATA_DIR / "vendas.parquet")
-    if df_devolucoes is not None and not df_devolucoes.empty:
-        df_devolucoes.to_parquet(DATA_DIR / "devolucoes.parquet")
-    
-    # Salvar configuração de colunas
-    with open(DATA_DIR / "config.json", 'w', encoding='utf-8') as f:
-        json.dump(colunas_config, f, indent=2, ensure_ascii=False)
-    
-    return True
-
-def load_vendas_data():
-    """Carrega dados de vendas e configurações"""
-    vendas_file = DATA_DIR / "vendas.parquet"
-    dev_file = DATA_DIR / "devolucoes.parquet"
-    config_file = DATA_DIR / "config.json"
-    
-    if not vendas_file.exists() or not config_file.exists():
-        return None, None, None
-    
-    df_vendas = pd.read_parquet(vendas_file)
-    df_devolucoes = pd.read_parquet(dev_file) if dev_file.exists() else pd.DataFrame()
-    
-    with open(config_file, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-    
-    return df_vendas, df_devolucoes, config
-
-def apply_hierarchy_filter(df, user_hierarchy, colunas):
-    """Aplica filtro de hierarquia baseado no usuário
-    
-    Args:
-        df: DataFrame com os dados
-        user_hierarchy: Dicionário com nível e valor(es) da hierarquia do usuário
-        colunas: Dicionário com mapeamento de colunas
-    
-    Returns:
-        DataFrame filtrado
-    """
-    if not user_hierarchy or not user_hierarchy.get('nivel'):
-        return df  # Admin ou sem hierarquia = vê tudo
-    
-    nivel = user_hierarchy['nivel']
-    valor = user_hierarchy['valor']
-    
-    # Mapear nível para coluna
-    nivel_coluna_map = {
-        'diretor': colunas.get('col_diretor'),
-        'gerente_regional': colunas.get('col_gerente_regional'),
-        'gerente': colunas.get('col_gerente'),
-        'supervisor': colunas.get('col_supervisor'),
-        'coordenador': colunas.get('col_coordenador'),
-        'consultor': colunas.get('col_consultor'),
-        'vendedor': colunas.get('col_vendedor')
-    }
-    
-    coluna = nivel_coluna_map.get(nivel)
-    
-    if coluna and coluna in df.columns and coluna != 'Nenhuma':
-        # Suportar múltiplos valores (lista) ou valor único (string)
-        if isinstance(valor, list):
-            return df[df[coluna].isin(valor)].copy()
-        else:
-            return df[df[coluna] == valor].copy()
-    
-    return df
+def load_vendas_data(compartilhado=False):
+    """Carrega dados de vendas e configurações (cache compartilhado entre sessões)"""
+    return obter_registro(DATA_DIR).obter(compartilhado)
 
 # Inicializar admin padrão
 create_default_admin()
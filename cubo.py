@@ -0,0 +1,425 @@
+"""
+Cubo de agregados do dataset de vendas: montado na gravação do snapshot e consultado pelas páginas sem varrer as linhas
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CUBO_PARQUET = "cubo.parquet"
+COLUNA_CHAVE_MES = 'Mes_Comercial_Chave'
+COLUNA_DIA = 'Dia'
+
+# Dimensões do grão (chaves do config), além do mês comercial e do dia
+CHAVES_GRAO = [
+    'col_linha', 'col_produto', 'col_vendedor',
+    'col_diretor', 'col_gerente_regional', 'col_gerente', 'col_supervisor', 'col_coordenador', 'col_consultor'
+]
+# Medidas somadas (chave do config -> nome curto no cubo); cada tabela ganha também a contagem de linhas
+MEDIDAS = {'col_valor': 'valor', 'col_quantidade': 'quantidade', 'col_toneladas': 'toneladas'}
+MEDIDA_LINHAS = 'linhas'
+TABELAS = ('vendas', 'devolucoes')
+# Atributo do cubo (gravado no Parquet): alguma data tem hora além do dia
+ATRIBUTO_DATAS_COM_HORA = 'datas_com_hora'
+
+# Contagens distintas por célula: nome -> coluna (chave do config ou coluna criada na preparação)
+DISTINTOS = {'clientes': 'col_codCliente', 'pedidos': 'Pedido_Unico'}
+# Precisão do HyperLogLog (2^12 registradores, erro padrão ~1,6%)
+BITS_HLL = 12
+# Células com pelo menos esta quantidade de ids distintos ganham também registradores HLL
+LIMIAR_CELULA_DENSA = 1 << BITS_HLL
+# Acima desta quantidade de ids a juntar, o modo automático passa da contagem exata para a aproximada
+LIMIAR_DISTINTOS_EXATO = 500_000
+
+# ==============================
+# MONTAGEM
+# ==============================
+def coluna_medida(tabela, medida):
+    """Nome da coluna do cubo para uma medida de uma tabela (ex: 'vendas_valor', 'devolucoes_linhas')"""
+    return f"{tabela}_{medida}"
+
+def colunas_grao(config, colunas_df):
+    """Nomes reais das colunas de dimensão do grão mapeadas no config e presentes no DataFrame"""
+    colunas = []
+    for chave in CHAVES_GRAO:
+        col = config.get(chave)
+        if col and col != 'Nenhuma' and col in colunas_df and col not in colunas:
+            colunas.append(col)
+    return colunas
+
+def _agregar_tabela(df, tabela, config, dimensoes):
+    """Agrega uma tabela no grão do cubo: somas das medidas mapeadas e contagem de linhas"""
+    from utils import calcular_meses_comerciais
+
+    col_data = config['col_data']
+    chaves_mes = df[COLUNA_CHAVE_MES] if COLUNA_CHAVE_MES in df.columns else calcular_meses_comerciais(df[col_data])[0]
+    base = {COLUNA_CHAVE_MES: chaves_mes.astype('Int32').array, COLUNA_DIA: df[col_data].dt.normalize().array}
+    for col in dimensoes:
+        base[col] = df[col].array
+    medidas = {}
+    for chave, nome in MEDIDAS.items():
+        col = config.get(chave)
+        if col and col != 'Nenhuma' and col in df.columns:
+            base[coluna_medida(tabela, nome)] = df[col].array
+            medidas[coluna_medida(tabela, nome)] = 'sum'
+    base[coluna_medida(tabela, MEDIDA_LINHAS)] = 1
+    medidas[coluna_medida(tabela, MEDIDA_LINHAS)] = 'sum'
+
+    grao = [COLUNA_CHAVE_MES, COLUNA_DIA] + dimensoes
+    return pd.DataFrame(base).groupby(grao, observed=True, dropna=False, sort=False).agg(medidas).reset_index()
+
+def _combinar(partes, dimensoes):
+    """Junta agregados (de tabelas ou meses diferentes) somando as células repetidas"""
+    partes = [p for p in partes if p is not None and not p.empty]
+    if not partes:
+        return pd.DataFrame()
+    combinado = pd.concat(partes, ignore_index=True)
+    medidas = [c for c in combinado.columns if c not in (COLUNA_CHAVE_MES, COLUNA_DIA) and c not in dimensoes]
+    combinado[medidas] = combinado[medidas].fillna(0)
+    if len(partes) > 1:
+        grao = [COLUNA_CHAVE_MES, COLUNA_DIA] + dimensoes
+        combinado = combinado.groupby(grao, observed=True, dropna=False, sort=False)[medidas].sum().reset_index()
+
+    for col in medidas:
+        if col.endswith(f"_{MEDIDA_LINHAS}"):
+            combinado[col] = combinado[col].astype('int64')
+    # Categóricas com categorias em ordem alfabética, como nas tabelas (concat de dicionários diferentes vira texto)
+    for col in dimensoes:
+        if not isinstance(combinado[col].dtype, pd.CategoricalDtype):
+            combinado[col] = combinado[col].astype('category')
+        elif not combinado[col].cat.categories.is_monotonic_increasing:
+            combinado[col] = combinado[col].cat.reorder_categories(sorted(combinado[col].cat.categories))
+    # Ordenado por dia: o cubo segue o mesmo contrato de datas das tabelas
+    return combinado.sort_values([COLUNA_CHAVE_MES, COLUNA_DIA], kind='stable', na_position='last', ignore_index=True)
+
+def montar_cubo(df_vendas, df_devolucoes, config, dimensoes=None):
+    """
+    Monta o cubo de agregados do dataset.
+
+    O grão é mês comercial × dia × linha × produto × vendedor × níveis da hierarquia (os que
+    estiverem mapeados); cada célula guarda, para vendas e devoluções, as somas de valor,
+    quantidade e toneladas e a quantidade de linhas.
+
+    Args:
+        df_vendas: DataFrame de vendas
+        df_devolucoes: DataFrame de devoluções (pode ser None ou vazio)
+        config: dicionário de configuração de colunas
+        dimensoes: colunas do grão; None = as mapeadas presentes nas duas tabelas
+
+    Returns:
+        DataFrame: células do cubo ordenadas por dia (vazio se não houver dados)
+    """
+    tabelas = {nome: df for nome, df in zip(TABELAS, (df_vendas, df_devolucoes)) if df is not None and not df.empty}
+    if not tabelas or not config.get('col_data'):
+        return pd.DataFrame()
+    if dimensoes is None:
+        # O grão é o mesmo nas duas tabelas, para que as células se somem
+        dimensoes = colunas_grao(config, set.intersection(*(set(df.columns) for df in tabelas.values())))
+    cubo = _combinar([_agregar_tabela(df, nome, config, dimensoes) for nome, df in tabelas.items()], dimensoes)
+    col_data = config['col_data']
+    cubo.attrs[ATRIBUTO_DATAS_COM_HORA] = any(
+        bool((df[col_data] != df[col_data].dt.normalize()).any()) for df in tabelas.values()
+    )
+    return cubo
+
+def atualizar_cubo(cubo_atual, df_vendas_meses, df_devolucoes_meses, config, meses):
+    """
+    Refaz só as células dos meses alterados por uma carga incremental.
+
+    Args:
+        cubo_atual: cubo do snapshot anterior
+        df_vendas_meses, df_devolucoes_meses: linhas (já mescladas) dos meses alterados
+        config: dicionário de configuração de colunas
+        meses: chaves dos meses alterados
+
+    Returns:
+        DataFrame: cubo atualizado
+    """
+    if cubo_atual is None or cubo_atual.empty:
+        return montar_cubo(df_vendas_meses, df_devolucoes_meses, config)
+    dimensoes = [c for c in cubo_atual.columns if isinstance(cubo_atual[c].dtype, pd.CategoricalDtype)]
+    for df in (df_vendas_meses, df_devolucoes_meses):
+        if df is not None and not df.empty and any(col not in df.columns for col in dimensoes):
+            raise ValueError("As dimensões da carga não batem com o cubo atual. Use a substituição completa.")
+    novo = montar_cubo(df_vendas_meses, df_devolucoes_meses, config, dimensoes)
+    mantido = cubo_atual[~cubo_atual[COLUNA_CHAVE_MES].isin(list(meses))]
+    cubo = _combinar([mantido, novo], dimensoes)
+    cubo.attrs[ATRIBUTO_DATAS_COM_HORA] = (cubo_atual.attrs.get(ATRIBUTO_DATAS_COM_HORA, True)
+                                           or novo.attrs.get(ATRIBUTO_DATAS_COM_HORA, False))
+    return cubo
+
+# ==============================
+# PERSISTÊNCIA
+# ==============================
+def gravar_cubo(cubo, pasta):
+    """Grava o cubo como Parquet dentro da pasta do snapshot (nada se estiver vazio)"""
+    if cubo is None or cubo.empty:
+        return
+    cubo.to_parquet(Path(pasta) / CUBO_PARQUET, index=False)
+
+def ler_cubo(pasta):
+    """Lê o cubo gravado no snapshot (None se o snapshot for anterior ao cubo)"""
+    caminho = Path(pasta) / CUBO_PARQUET
+    if not caminho.exists():
+        return None
+    return pd.read_parquet(caminho)
+
+# ==============================
+# CONSULTA
+# ==============================
+def pode_responder(cubo, dimensoes, selecoes=None, data_inicio=None, data_fim=None):
+    """
+    True se o cubo responde exatamente à consulta: tem todas as colunas de agrupamento e de
+    filtro pedidas e o período cai em dias inteiros (ou as datas não têm hora).
+    """
+    if cubo is None or cubo.empty:
+        return False
+    # 'Mes_Comercial' só existe como agrupamento (sai da chave); seleção nele volta às linhas
+    colunas = set(cubo.columns)
+    if not all(col in colunas or col == 'Mes_Comercial' for col in dimensoes):
+        return False
+    if not all(col in colunas for col in (selecoes or {})):
+        return False
+    if not cubo.attrs.get(ATRIBUTO_DATAS_COM_HORA, True):
+        return True
+    # Com hora nas datas, só limites na virada do dia (ex.: 16 00:00 a 15 23:59:59.999999999)
+    if data_inicio is not None and pd.Timestamp(data_inicio) != pd.Timestamp(data_inicio).normalize():
+        return False
+    if data_fim is not None:
+        seguinte = pd.Timestamp(data_fim) + pd.Timedelta(1, unit='ns')
+        if seguinte != seguinte.normalize():
+            return False
+    return True
+
+def consultar_cubo(cubo, dimensoes, selecoes=None, data_inicio=None, data_fim=None, tabela=None, medidas=None):
+    """
+    Agrupa e filtra o cubo (group-by/filtro respondido pelos agregados, sem tocar nas linhas).
+
+    Args:
+        cubo: cubo de montar_cubo
+        dimensoes: colunas de agrupamento ('Mes_Comercial' agrupa pelo rótulo do mês)
+        selecoes: dict {coluna: valores} de filtros por valor
+        data_inicio, data_fim: limites inclusivos do período
+        tabela: 'vendas' ou 'devolucoes' para considerar só células com linhas dessa tabela
+        medidas: colunas do cubo a somar; None = todas
+
+    Returns:
+        DataFrame: uma linha por combinação das dimensões, com as medidas somadas
+    """
+    from indices import filtrar
+    from utils import rotulo_mes_comercial
+
+    dimensoes = list(dimensoes)
+    if medidas is None:
+        medidas = [c for c in cubo.columns if c.startswith(TABELAS) and c not in dimensoes]
+    medidas = list(medidas)
+
+    recorte = filtrar(cubo, selecoes or {}, COLUNA_DIA, data_inicio, data_fim)
+    if tabela is not None:
+        recorte = recorte[recorte[coluna_medida(tabela, MEDIDA_LINHAS)] > 0]
+
+    grupos = [COLUNA_CHAVE_MES if d == 'Mes_Comercial' else d for d in dimensoes]
+    if not grupos:
+        return recorte[medidas].sum().to_frame().T
+    # Agrupado pela chave inteira, as linhas já saem em ordem cronológica; o rótulo vem depois
+    resultado = recorte.groupby(grupos, observed=True)[medidas].sum().reset_index()
+    if 'Mes_Comercial' in dimensoes:
+        resultado[COLUNA_CHAVE_MES] = resultado[COLUNA_CHAVE_MES].map(rotulo_mes_comercial).astype(str)
+        resultado = resultado.rename(columns={COLUNA_CHAVE_MES: 'Mes_Comercial'})
+    return resultado
+
+def ordenar_por_mes(resultado, dimensoes):
+    """
+    Reordena um agrupamento que tem 'Mes_Comercial' entre as dimensões pela ordem cronológica
+    dos meses (o rótulo em texto poria "Abr/2024" antes de "Jan/2024"), como consultar_cubo.
+
+    Returns:
+        DataFrame: mesmas linhas, na ordem das dimensões com o mês pela chave inteira
+    """
+    from utils import chave_de_rotulo_mes_comercial
+
+    if 'Mes_Comercial' not in dimensoes or resultado.empty:
+        return resultado
+    auxiliar = '__chave_mes'
+    chaves = {rotulo: chave_de_rotulo_mes_comercial(rotulo) for rotulo in resultado['Mes_Comercial'].unique()}
+    ordem = [auxiliar if d == 'Mes_Comercial' else d for d in dimensoes]
+    resultado = resultado.assign(**{auxiliar: resultado['Mes_Comercial'].map(chaves)})
+    return resultado.sort_values(ordem, kind='stable', ignore_index=True).drop(columns=auxiliar)
+
+def celulas_cubo(cubo, selecoes=None, data_inicio=None, data_fim=None, tabela=None):
+    """
+    Posições das células do cubo que atendem aos filtros (base das contagens distintas).
+
+    Returns:
+        np.ndarray: posições em ordem crescente
+    """
+    from indices import obter_indice
+
+    posicoes = obter_indice(cubo).posicoes(selecoes or {}, COLUNA_DIA, data_inicio, data_fim)
+    if posicoes is None:
+        posicoes = np.arange(len(cubo))
+    elif isinstance(posicoes, slice):
+        posicoes = np.arange(posicoes.start, posicoes.stop)
+    if tabela is not None:
+        posicoes = posicoes[cubo[coluna_medida(tabela, MEDIDA_LINHAS)].to_numpy()[posicoes] > 0]
+    return posicoes
+
+# ==============================
+# CONTAGEM DE DISTINTOS
+# ==============================
+def _comprimento_bits(valores):
+    """Quantidade de bits significativos de cada uint64 (0 para zero)"""
+    valores = valores.copy()
+    comprimento = np.zeros(len(valores), dtype=np.int64)
+    for deslocamento in (32, 16, 8, 4, 2, 1):
+        grandes = valores >= (np.uint64(1) << np.uint64(deslocamento))
+        comprimento[grandes] += deslocamento
+        valores[grandes] >>= np.uint64(deslocamento)
+    return comprimento + (valores > 0)
+
+def _posicoes_hll(valores):
+    """Registrador e posto (zeros à esquerda + 1) do HyperLogLog para cada id, pelo hash do valor"""
+    hashes = pd.util.hash_array(np.asarray(valores, dtype=object))
+    resto_bits = 64 - BITS_HLL
+    registrador = (hashes >> np.uint64(resto_bits)).astype(np.int64)
+    resto = hashes & np.uint64((1 << resto_bits) - 1)
+    posto = (resto_bits - _comprimento_bits(resto) + 1).astype(np.uint8)
+    return registrador, posto
+
+def _estimar_hll(registradores):
+    """Estimativa de cardinalidade de um conjunto de registradores (com correção para poucos ids)"""
+    m = len(registradores)
+    alfa = 0.7213 / (1 + 1.079 / m)
+    estimativa = alfa * m * m / np.sum(np.exp2(-registradores.astype(np.float64)))
+    vazios = int(np.count_nonzero(registradores == 0))
+    if estimativa <= 2.5 * m and vazios:
+        estimativa = m * np.log(m / vazios)
+    return int(round(estimativa))
+
+class EsbocoDistintos:
+    """
+    Ids distintos (clientes ou pedidos) por célula do cubo, combináveis entre células.
+
+    Cada célula guarda a lista exata dos códigos dos seus ids (em formato CSR: um vetor de
+    códigos e o início de cada célula), e as células densas guardam também registradores
+    HyperLogLog. Qualquer recorte do cubo soma as células sem voltar às linhas: exato juntando
+    os códigos, ou aproximado juntando os registradores (máximo) quando o volume é grande.
+    """
+
+    def __init__(self, celulas, codigos, valores, total_celulas):
+        """
+        Args:
+            celulas: célula do cubo de cada linha da tabela (-1 = fora do cubo)
+            codigos: código do id de cada linha (-1 = id vazio)
+            valores: valores distintos dos ids (o código indexa este vetor)
+            total_celulas: quantidade de células do cubo
+        """
+        validas = (celulas >= 0) & (codigos >= 0)
+        total_ids = max(len(valores), 1)
+        pares = np.unique(celulas[validas].astype(np.int64) * total_ids + codigos[validas])
+        celulas_pares = pares // total_ids
+        self.codigos = (pares % total_ids).astype(np.int32)
+        self.inicio = np.searchsorted(celulas_pares, np.arange(total_celulas + 1))
+        self.total_ids = len(valores)
+        self.registrador, self.posto = _posicoes_hll(valores)
+
+        tamanhos = np.diff(self.inicio)
+        self.densas = np.flatnonzero(tamanhos >= LIMIAR_CELULA_DENSA)
+        self.linha_densa = np.full(total_celulas, -1, dtype=np.int64)
+        self.linha_densa[self.densas] = np.arange(len(self.densas))
+        self.registradores = np.zeros((len(self.densas), 1 << BITS_HLL), dtype=np.uint8)
+        if len(self.densas):
+            em_densa = self.linha_densa[celulas_pares] >= 0
+            cods = self.codigos[em_densa]
+            np.maximum.at(self.registradores,
+                          (self.linha_densa[celulas_pares[em_densa]], self.registrador[cods]), self.posto[cods])
+
+    def _codigos_de(self, celulas):
+        """Códigos (com repetição entre células) das células informadas"""
+        inicios, fins = self.inicio[celulas], self.inicio[celulas + 1]
+        tamanhos = fins - inicios
+        if not tamanhos.sum():
+            return np.empty(0, dtype=np.int32)
+        deslocamentos = np.repeat(inicios - np.cumsum(tamanhos) + tamanhos, tamanhos)
+        return self.codigos[np.arange(tamanhos.sum()) + deslocamentos]
+
+    def volume(self, celulas):
+        """Quantidade de códigos (com repetição entre células) que a contagem exata juntaria"""
+        celulas = np.asarray(celulas, dtype=np.int64)
+        return int((self.inicio[celulas + 1] - self.inicio[celulas]).sum())
+
+    def aproxima(self, celulas, modo='auto', limiar=LIMIAR_DISTINTOS_EXATO):
+        """Se contar(celulas, modo, limiar) devolve a estimativa do HyperLogLog"""
+        return modo == 'aproximado' or (modo == 'auto' and self.volume(celulas) > limiar)
+
+    def contar(self, celulas, modo='auto', limiar=LIMIAR_DISTINTOS_EXATO):
+        """
+        Quantidade de ids distintos na união das células.
+
+        Args:
+            celulas: posições das células do cubo
+            modo: 'exato', 'aproximado' ou 'auto' (exato até `limiar` ids a juntar)
+            limiar: volume a partir do qual o modo automático usa o HyperLogLog
+
+        Returns:
+            int: ids distintos (estimativa no modo aproximado)
+        """
+        celulas = np.asarray(celulas, dtype=np.int64)
+        if not self.aproxima(celulas, modo, limiar):
+            vistos = np.zeros(self.total_ids, dtype=bool)
+            vistos[self._codigos_de(celulas)] = True
+            return int(np.count_nonzero(vistos))
+
+        # Aproximado: registradores das células densas + códigos das demais dobrados no HLL
+        densas = self.linha_densa[celulas]
+        registradores = np.zeros(1 << BITS_HLL, dtype=np.uint8)
+        if (densas >= 0).any():
+            registradores = self.registradores[densas[densas >= 0]].max(axis=0)
+        codigos = self._codigos_de(celulas[densas < 0])
+        np.maximum.at(registradores, self.registrador[codigos], self.posto[codigos])
+        return _estimar_hll(registradores)
+
+def montar_esbocos(cubo, df_vendas, df_devolucoes, config):
+    """
+    Monta os esboços de clientes e pedidos distintos por célula do cubo.
+
+    As linhas de cada tabela são ligadas às células pelo grão (mês, dia e dimensões do cubo).
+
+    Returns:
+        dict {(tabela, nome): EsbocoDistintos} para as colunas de DISTINTOS presentes
+    """
+    from utils import calcular_meses_comerciais
+
+    esbocos = {}
+    if cubo is None or cubo.empty:
+        return esbocos
+    dimensoes = [c for c in cubo.columns if isinstance(cubo[c].dtype, pd.CategoricalDtype)]
+    grao = [COLUNA_CHAVE_MES, COLUNA_DIA] + dimensoes
+    indice_celulas = pd.MultiIndex.from_frame(cubo[grao])
+    col_data = config['col_data']
+
+    for tabela, df in zip(TABELAS, (df_vendas, df_devolucoes)):
+        if df is None or df.empty or any(col not in df.columns for col in dimensoes):
+            continue
+        colunas_id = {nome: config.get(chave) if chave.startswith('col_') else chave for nome, chave in DISTINTOS.items()}
+        colunas_id = {nome: col for nome, col in colunas_id.items() if col and col in df.columns}
+        if not colunas_id:
+            continue
+
+        chaves_mes = df[COLUNA_CHAVE_MES] if COLUNA_CHAVE_MES in df.columns else calcular_meses_comerciais(df[col_data])[0]
+        chaves = pd.DataFrame({COLUNA_CHAVE_MES: chaves_mes.astype('Int32').array,
+                               COLUNA_DIA: df[col_data].dt.normalize().array,
+                               **{col: df[col].array for col in dimensoes}})
+        grupos = chaves.groupby(grao, observed=True, dropna=False, sort=False)
+        celula_do_grupo = indice_celulas.get_indexer(
+            pd.MultiIndex.from_frame(grupos.size().index.to_frame(index=False))
+        )
+        celulas = celula_do_grupo[grupos.ngroup().to_numpy()]
+
+        for nome, col in colunas_id.items():
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                codigos, valores = df[col].cat.codes.to_numpy(), df[col].cat.categories
+            else:
+                codigos, valores = pd.factorize(df[col])
+            esbocos[(tabela, nome)] = EsbocoDistintos(celulas, np.asarray(codigos), valores, len(cubo))
+    return esbocos
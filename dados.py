@@ -0,0 +1,1203 @@
+"""
+Camada de dados compartilhada: snapshots versionados em disco e registro em memória do dataset de vendas
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+VENDAS = "vendas"
+DEVOLUCOES = "devolucoes"
+FATOS = "fatos"
+COLUNA_MOVIMENTO = 'Tipo_Movimento'
+MOVIMENTO_VENDA = 'Venda'
+MOVIMENTO_DEVOLUCAO = 'Devolução'
+SUFIXO_LIQUIDO = '_Liquido'
+COLUNA_PARTICAO = 'Mes_Comercial_Chave'
+LINHAS_POR_GRUPO = 100_000
+CONFIG_JSON = "config.json"
+MANIFESTO_JSON = "manifest.json"
+SNAPSHOTS_DIR = "snapshots"
+PONTEIRO_ATUAL = "snapshot_atual.json"
+QUALIDADE_JSON = "qualidade.json"
+SNAPSHOTS_MANTIDOS = 3
+
+# Colunas de dimensão (chaves do config) guardadas como categóricas (dicionário no Parquet)
+CHAVES_DIMENSAO = [
+    'col_cliente', 'col_codCliente', 'col_produto', 'col_vendedor', 'col_codVendedor',
+    'col_linha', 'col_regiao',
+    'col_diretor', 'col_gerente_regional', 'col_gerente', 'col_supervisor', 'col_coordenador', 'col_consultor'
+]
+
+# ==============================
+# CODIFICAÇÃO DE DIMENSÕES
+# ==============================
+def colunas_dimensao(config, colunas_df):
+    """Nomes reais das colunas de dimensão mapeadas no config e presentes no DataFrame"""
+    colunas = []
+    for chave in CHAVES_DIMENSAO:
+        col = config.get(chave)
+        if col and col != 'Nenhuma' and col in colunas_df and col not in colunas:
+            colunas.append(col)
+    return colunas
+
+def codificar_dimensoes(df, config):
+    """
+    Converte as colunas de dimensão para category (in place).
+    
+    Cada valor distinto é guardado uma vez e as linhas passam a carregar só um código
+    inteiro, o que reduz a memória e acelera groupby/isin/nunique. As categorias
+    ficam em ordem alfabética, então ordenações continuam iguais às de texto.
+    
+    Returns:
+        DataFrame: o próprio df, para encadeamento
+    """
+    if df is None or df.empty:
+        return df
+    for col in colunas_dimensao(config, df.columns):
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+        elif not df[col].cat.categories.is_monotonic_increasing:
+            # Leitura de várias partições pode unificar os dicionários fora de ordem
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return df
+
+# ==============================
+# CONTRATO DA COLUNA DE DATA
+# ==============================
+def garantir_contrato_datas(df, col_data):
+    """
+    Garante o contrato da coluna de data: datetime64 e linhas em ordem crescente de data.
+    
+    Os snapshots já são gravados assim, então no caminho normal isto só confere; a
+    conversão e a ordenação acontecem uma vez, no carregamento de dados antigos.
+    Recortes por posição ou máscara preservam a ordem, então os DataFrames filtrados
+    continuam no contrato.
+    
+    Returns:
+        DataFrame: o próprio df (ou uma versão convertida/ordenada)
+    """
+    if df is None or df.empty or not col_data or col_data not in df.columns:
+        return df
+    if not pd.api.types.is_datetime64_any_dtype(df[col_data]):
+        df[col_data] = pd.to_datetime(df[col_data], errors='coerce')
+    if not df[col_data].is_monotonic_increasing:
+        df = df.sort_values(col_data, kind='stable', na_position='last', ignore_index=True)
+    return df
+
+def intervalo_datas(df, col_data):
+    """
+    Menor e maior data de um DataFrame no contrato (ordenado por data): leitura das pontas, O(1).
+    
+    Returns:
+        tuple: (data mínima, data máxima) como Timestamp, ou (None, None) se não houver datas
+    """
+    if df is None or df.empty or col_data not in df.columns:
+        return None, None
+    serie = df[col_data]
+    if not pd.api.types.is_datetime64_any_dtype(serie):
+        serie = pd.to_datetime(serie, errors='coerce')
+    primeiro, ultimo = serie.iloc[0], serie.iloc[-1]
+    if pd.isna(primeiro) or pd.isna(ultimo) or primeiro > ultimo:
+        # Fora do contrato (NaT nas pontas ou sem ordem): cai para a varredura
+        primeiro, ultimo = serie.min(), serie.max()
+    if pd.isna(primeiro):
+        return None, None
+    return pd.Timestamp(primeiro), pd.Timestamp(ultimo)
+
+# ==============================
+# PARTICIONAMENTO POR MÊS COMERCIAL
+# ==============================
+def _particionamento():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([(COLUNA_PARTICAO, pa.int32())]), flavor='hive')
+
+def caminho_tabela(pasta, nome):
+    """Dataset particionado (pasta) se existir; senão o Parquet único dos snapshots antigos"""
+    pasta = Path(pasta)
+    if (pasta / nome).is_dir():
+        return pasta / nome
+    return pasta / f"{nome}.parquet"
+
+def _abrir_dataset(caminho):
+    import pyarrow.dataset as ds
+    if Path(caminho).is_dir():
+        return ds.dataset(caminho, format='parquet', partitioning=_particionamento())
+    return ds.dataset(caminho, format='parquet')
+
+def _garantir_chave_particao(df, col_data):
+    """Calcula a chave do mês comercial para datasets gravados antes dela existir"""
+    if COLUNA_PARTICAO in df.columns or not col_data or col_data not in df.columns:
+        return df
+    from utils import calcular_meses_comerciais
+    df = df.copy(deep=False)
+    df[COLUNA_PARTICAO] = calcular_meses_comerciais(df[col_data])[0]
+    return df
+
+def _tabela_arrow(df, col_data, esquema=None):
+    """
+    Converte o DataFrame para tabela Arrow no formato gravado nas partições.
+    
+    Dicionários usam sempre índice int32, para que partições gravadas em momentos
+    diferentes tenham o mesmo schema. Com esquema, a tabela é ajustada ao schema
+    do dataset existente (atualização incremental).
+    """
+    import pyarrow as pa
+    
+    df = _garantir_chave_particao(df, col_data)
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    campos = []
+    for campo in tabela.schema:
+        if campo.name == COLUNA_PARTICAO:
+            campo = campo.with_type(pa.int32())
+        elif pa.types.is_dictionary(campo.type):
+            campo = campo.with_type(pa.dictionary(pa.int32(), campo.type.value_type))
+        campos.append(campo)
+    tabela = tabela.cast(pa.schema(campos))
+    
+    if esquema is not None:
+        faltando = set(esquema.names) - set(tabela.column_names)
+        sobrando = set(tabela.column_names) - set(esquema.names)
+        if faltando or sobrando:
+            raise ValueError(
+                "As colunas da planilha não batem com os dados atuais "
+                f"(faltando: {sorted(faltando)}, novas: {sorted(sobrando)}). Use a substituição completa."
+            )
+        try:
+            tabela = tabela.select(esquema.names).cast(esquema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Tipos de coluna incompatíveis com os dados atuais: {e}") from e
+    return tabela
+
+def _gravar_tabela_particionada(df, destino, col_data, esquema=None):
+    """
+    Grava o DataFrame como dataset Parquet particionado por mês comercial.
+    
+    Dentro de cada partição as linhas ficam ordenadas por data e divididas em
+    row groups, então filtros de data também descartam row groups pelas estatísticas.
+    Partições já existentes em destino (reaproveitadas de outro snapshot) são mantidas.
+    """
+    import pyarrow.dataset as ds
+    
+    tabela = _tabela_arrow(df, col_data, esquema)
+    ordem = [(COLUNA_PARTICAO, 'ascending')]
+    if col_data in tabela.column_names:
+        ordem.append((col_data, 'ascending'))
+    tabela = tabela.sort_by(ordem)
+    
+    ds.write_dataset(
+        tabela, destino, format='parquet', partitioning=_particionamento(),
+        basename_template='part-{i}.parquet', max_rows_per_group=LINHAS_POR_GRUPO,
+        min_rows_per_group=min(LINHAS_POR_GRUPO, max(len(df), 1)),
+        existing_data_behavior='overwrite_or_ignore' if esquema is not None else 'error'
+    )
+
+def _ler_tabela(caminho, colunas=None, filtro=None):
+    """Lê um dataset (particionado ou não) para pandas, com projeção e filtro opcionais"""
+    dataset = _abrir_dataset(caminho)
+    if colunas is not None:
+        colunas = [c for c in colunas if c in dataset.schema.names]
+    return dataset.to_table(columns=colunas, filter=filtro).to_pandas()
+
+def carregar_particoes(diretorio, tabela=VENDAS, meses=None, colunas=None,
+                       col_data=None, data_inicio=None, data_fim=None):
+    """
+    Lê do snapshot atual apenas as partições (meses comerciais) pedidas.
+    
+    Para quem precisa de um mês sem o registro do processo carregado (scripts, exportações
+    agendadas); dentro do app as visões saem do registro, já em memória.
+    
+    Args:
+        diretorio: diretório base de dados (ex: data/)
+        tabela: 'vendas' ou 'devolucoes'
+        meses: lista de meses comerciais ("Set/2024") ou chaves inteiras; None = todos
+        colunas: lista de colunas a ler (projeção); None = todas
+        col_data: coluna de data, necessária para data_inicio/data_fim
+        data_inicio, data_fim: recorte opcional por data (poda row groups pelas estatísticas)
+    
+    Returns:
+        DataFrame: linhas dos meses pedidos, com as dimensões categóricas
+    """
+    import pyarrow.dataset as ds
+    
+    pasta = diretorio_snapshot_atual(diretorio)
+    caminho = caminho_tabela(pasta, tabela)
+    if not caminho.exists():
+        return pd.DataFrame()
+    
+    config = ler_config(diretorio)
+    col_data = col_data or config.get('col_data')
+    
+    nomes = _abrir_dataset(caminho).schema.names
+    filtro = None
+    if meses is not None:
+        from utils import chave_de_rotulo_mes_comercial
+        chaves = [m if isinstance(m, int) else chave_de_rotulo_mes_comercial(m) for m in meses]
+        if COLUNA_PARTICAO in nomes:
+            filtro = ds.field(COLUNA_PARTICAO).isin(chaves)
+        elif 'Mes_Comercial' in nomes:
+            from utils import rotulo_mes_comercial
+            filtro = ds.field('Mes_Comercial').isin([rotulo_mes_comercial(c) for c in chaves])
+        elif col_data and col_data in nomes:
+            # Dataset antigo sem coluna de mês: recorta pelas datas de cada mês comercial
+            from utils import rotulo_mes_comercial, obter_periodo_mes_comercial
+            for chave in chaves:
+                inicio, fim = obter_periodo_mes_comercial(rotulo_mes_comercial(chave))
+                condicao = ((ds.field(col_data) >= inicio.to_pydatetime()) &
+                            (ds.field(col_data) <= fim.to_pydatetime()))
+                filtro = condicao if filtro is None else filtro | condicao
+    if col_data and col_data in nomes:
+        if data_inicio is not None:
+            condicao = ds.field(col_data) >= pd.Timestamp(data_inicio).to_pydatetime()
+            filtro = condicao if filtro is None else filtro & condicao
+        if data_fim is not None:
+            condicao = ds.field(col_data) <= pd.Timestamp(data_fim).to_pydatetime()
+            filtro = condicao if filtro is None else filtro & condicao
+    
+    df = _ler_tabela(caminho, colunas=colunas, filtro=filtro)
+    codificar_dimensoes(df, config)
+    return garantir_contrato_datas(df, col_data)
+
+# ==============================
+# SNAPSHOTS ATÔMICOS
+# ==============================
+def _fsync_arquivo(caminho):
+    with open(caminho, 'rb') as f:
+        os.fsync(f.fileno())
+
+def _fsync_diretorio(caminho):
+    """Garante que renomeações dentro do diretório foram persistidas (no-op onde não suportado)"""
+    try:
+        fd = os.open(caminho, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _sha256_arquivo(caminho, tamanho_bloco=1024 * 1024):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _escrever_json_atomico(caminho, conteudo):
+    """Escreve um JSON em arquivo temporário e troca pelo definitivo com os.replace"""
+    caminho = Path(caminho)
+    temporario = caminho.with_name(f".{caminho.name}.{uuid.uuid4().hex}.tmp")
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(conteudo, f, indent=2, ensure_ascii=False, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+    _fsync_diretorio(caminho.parent)
+
+def _hash_schema(*schemas):
+    """Hash estável dos nomes e tipos das colunas (schemas Arrow)"""
+    partes = [[(campo.name, str(campo.type)) for campo in schema] for schema in schemas if schema is not None]
+    return hashlib.sha1(json.dumps(partes).encode()).hexdigest()[:16]
+
+def _chave_da_pasta(pasta):
+    """Extrai a chave do mês de uma pasta 'Mes_Comercial_Chave=24297' (None se não for partição)"""
+    nome, _, valor = pasta.name.partition('=')
+    return int(valor) if nome == COLUNA_PARTICAO and valor else None
+
+def resumo_tabela(caminho, col_data):
+    """
+    Resume uma tabela só pelos rodapés dos arquivos Parquet, sem ler os dados:
+    linhas totais, linhas por partição, menor/maior data (estatísticas dos row groups) e schema.
+    
+    Returns:
+        dict com 'linhas', 'particoes', 'data_min', 'data_max' e 'schema' (Arrow) — ou None se não existir
+    """
+    import pyarrow.parquet as pq
+    
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return None
+    arquivos = sorted(caminho.rglob('*.parquet')) if caminho.is_dir() else [caminho]
+    
+    resumo = {'linhas': 0, 'particoes': {}, 'data_min': None, 'data_max': None, 'schema': None}
+    for arquivo in arquivos:
+        metadados = pq.ParquetFile(arquivo).metadata
+        if resumo['schema'] is None:
+            resumo['schema'] = metadados.schema.to_arrow_schema()
+        resumo['linhas'] += metadados.num_rows
+        
+        chave = _chave_da_pasta(arquivo.parent)
+        if chave is not None:
+            resumo['particoes'][str(chave)] = resumo['particoes'].get(str(chave), 0) + metadados.num_rows
+        
+        nomes = metadados.schema.to_arrow_schema().names
+        if col_data not in nomes:
+            continue
+        indice = nomes.index(col_data)
+        for rg in range(metadados.num_row_groups):
+            estatisticas = metadados.row_group(rg).column(indice).statistics
+            if estatisticas is None or not estatisticas.has_min_max:
+                continue
+            minimo, maximo = pd.Timestamp(estatisticas.min), pd.Timestamp(estatisticas.max)
+            if resumo['data_min'] is None or minimo < resumo['data_min']:
+                resumo['data_min'] = minimo
+            if resumo['data_max'] is None or maximo > resumo['data_max']:
+                resumo['data_max'] = maximo
+    
+    resumo['particoes'] = dict(sorted(resumo['particoes'].items()))
+    return resumo
+
+def somas_por_particao(caminho, coluna):
+    """
+    Soma de uma coluna numérica por partição, lendo só essa coluna (projeção Arrow, sem pandas).
+    
+    Returns:
+        dict: {chave do mês: soma} ({'': soma} em tabela não particionada); vazio se a coluna não existir
+    """
+    import pyarrow.compute as pc
+    
+    caminho = Path(caminho)
+    if not coluna or not caminho.exists():
+        return {}
+    dataset = _abrir_dataset(caminho)
+    if coluna not in dataset.schema.names:
+        return {}
+    if COLUNA_PARTICAO not in dataset.schema.names:
+        return {'': float(pc.sum(dataset.to_table(columns=[coluna])[coluna]).as_py() or 0)}
+    tabela = dataset.to_table(columns=[COLUNA_PARTICAO, coluna]).group_by(COLUNA_PARTICAO).aggregate([(coluna, 'sum')])
+    return {str(chave): float(soma or 0) for chave, soma in
+            sorted(zip(tabela[COLUNA_PARTICAO].to_pylist(), tabela[f'{coluna}_sum'].to_pylist()))}
+
+def ler_ponteiro(diretorio):
+    """Retorna o conteúdo do ponteiro do snapshot atual (ou None se ainda não houver snapshot)"""
+    try:
+        with open(Path(diretorio) / PONTEIRO_ATUAL, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def diretorio_snapshot_atual(diretorio):
+    """Pasta do snapshot publicado; cai no layout antigo (arquivos soltos em data/) se não houver"""
+    ponteiro = ler_ponteiro(diretorio)
+    if ponteiro:
+        pasta = Path(diretorio) / SNAPSHOTS_DIR / ponteiro['versao']
+        if pasta.exists():
+            return pasta
+    return Path(diretorio)
+
+def ler_manifesto(diretorio):
+    """Lê o manifesto do snapshot atual (None no layout antigo)"""
+    try:
+        with open(diretorio_snapshot_atual(diretorio) / MANIFESTO_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def ler_config(diretorio):
+    """Lê o config.json do snapshot atual ({} se não existir)"""
+    try:
+        with open(diretorio_snapshot_atual(diretorio) / CONFIG_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def resumo_dataset(diretorio):
+    """
+    Números gerais do dataset atual sem carregar as linhas: vem do manifesto e, para
+    snapshots antigos sem esses campos, dos rodapés Parquet e de uma leitura só da coluna de valor.
+    
+    Returns:
+        dict com 'versao', 'criado_em', 'linhas', 'periodo', 'valor_total', 'particoes' e 'config';
+        None se não houver dados
+    """
+    pasta = diretorio_snapshot_atual(diretorio)
+    if not caminho_tabela(pasta, VENDAS).exists():
+        return None
+    config = ler_config(diretorio)
+    manifesto = ler_manifesto(diretorio) or {}
+    
+    resumo = {
+        'versao': manifesto.get('versao'),
+        'criado_em': manifesto.get('criado_em'),
+        'linhas': manifesto.get('linhas'),
+        'periodo': manifesto.get('periodo'),
+        'valor_total': manifesto.get('valor_total'),
+        'particoes': manifesto.get('particoes'),
+        'config': config
+    }
+    if resumo['linhas'] is None or resumo['periodo'] is None or resumo['particoes'] is None:
+        col_data = config.get('col_data')
+        tabelas = {nome: resumo_tabela(caminho_tabela(pasta, nome), col_data) for nome in (VENDAS, DEVOLUCOES)}
+        resumo['linhas'] = {nome: t['linhas'] if t else 0 for nome, t in tabelas.items()}
+        resumo['particoes'] = {nome: t['particoes'] if t else {} for nome, t in tabelas.items()}
+        vendas = tabelas[VENDAS]
+        resumo['periodo'] = {
+            'data_min': vendas['data_min'].isoformat() if vendas['data_min'] is not None else None,
+            'data_max': vendas['data_max'].isoformat() if vendas['data_max'] is not None else None
+        }
+    if resumo['valor_total'] is None:
+        resumo['valor_total'] = {nome: sum(somas_por_particao(caminho_tabela(pasta, nome), config.get('col_valor')).values())
+                                 for nome in (VENDAS, DEVOLUCOES)}
+    return resumo
+
+def _limpar_snapshots_antigos(diretorio, versao_atual, manter=SNAPSHOTS_MANTIDOS):
+    """Remove snapshots antigos, mantendo alguns para leitores que ainda estejam no meio de uma leitura"""
+    base = Path(diretorio) / SNAPSHOTS_DIR
+    pastas = sorted((p for p in base.iterdir() if p.is_dir() and not p.name.startswith('.')),
+                    key=lambda p: p.name, reverse=True)
+    for pasta in pastas[manter:]:
+        if pasta.name != versao_atual:
+            shutil.rmtree(pasta, ignore_errors=True)
+    # Restos de gravações interrompidas (só os antigos, para não atrapalhar uma gravação em andamento)
+    limite = datetime.now().timestamp() - 3600
+    for pasta in base.glob('.tmp-*'):
+        if pasta.stat().st_mtime < limite:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+def _gravar_jsons(temporaria, config, anexos=None):
+    """Grava o config.json e os anexos (ex: qualidade.json) dentro do snapshot"""
+    with open(temporaria / CONFIG_JSON, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+    for nome, conteudo in (anexos or {}).items():
+        with open(temporaria / nome, 'w', encoding='utf-8') as f:
+            json.dump(conteudo, f, indent=2, ensure_ascii=False, default=str)
+
+def ler_anexo(diretorio, nome):
+    """Lê um anexo JSON do snapshot atual (None se não existir)"""
+    try:
+        with open(diretorio_snapshot_atual(diretorio) / nome, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _criar_pasta_temporaria(diretorio):
+    base = Path(diretorio) / SNAPSHOTS_DIR
+    base.mkdir(parents=True, exist_ok=True)
+    temporaria = base / f".tmp-{uuid.uuid4().hex}"
+    temporaria.mkdir()
+    return temporaria
+
+def _publicar_snapshot(diretorio, temporaria, config, extras=None, hashes_conhecidos=None):
+    """
+    Sincroniza a pasta temporária em disco, grava o manifesto, renomeia para a versão
+    definitiva e troca o ponteiro snapshot_atual.json (o único passo visível para os leitores).
+    
+    Args:
+        hashes_conhecidos: dict {arquivo relativo: {'sha256', 'bytes'}} de arquivos reaproveitados
+                           de outro snapshot, para não recalcular o hash
+    
+    Returns:
+        dict: manifesto do snapshot publicado
+    """
+    diretorio = Path(diretorio)
+    base = diretorio / SNAPSHOTS_DIR
+    hashes_conhecidos = hashes_conhecidos or {}
+    
+    try:
+        arquivos = {}
+        for arquivo in sorted(p for p in temporaria.rglob('*') if p.is_file()):
+            nome = arquivo.relative_to(temporaria).as_posix()
+            if nome in hashes_conhecidos:
+                arquivos[nome] = hashes_conhecidos[nome]
+                continue
+            _fsync_arquivo(arquivo)
+            arquivos[nome] = {'sha256': _sha256_arquivo(arquivo), 'bytes': arquivo.stat().st_size}
+        for subpasta in sorted((p for p in temporaria.rglob('*') if p.is_dir()), reverse=True):
+            _fsync_diretorio(subpasta)
+        
+        checksum = hashlib.sha256(
+            "".join(arquivos[nome]['sha256'] for nome in sorted(arquivos)).encode()
+        ).hexdigest()
+        agora = datetime.now()
+        versao = f"{agora.strftime('%Y%m%dT%H%M%S%f')}-{checksum[:8]}"
+        
+        col_data = config.get('col_data')
+        resumo_vendas = resumo_tabela(caminho_tabela(temporaria, VENDAS), col_data)
+        resumo_dev = resumo_tabela(caminho_tabela(temporaria, DEVOLUCOES), col_data)
+        resumos = [r for r in (resumo_vendas, resumo_dev) if r is not None]
+        somas = {nome: somas_por_particao(caminho_tabela(temporaria, nome), config.get('col_valor'))
+                 for nome in (VENDAS, DEVOLUCOES)}
+        minimos = [r['data_min'] for r in resumos if r['data_min'] is not None]
+        maximos = [r['data_max'] for r in resumos if r['data_max'] is not None]
+        
+        manifesto = {
+            'versao': versao,
+            'criado_em': agora.isoformat(),
+            'linhas': {
+                VENDAS: resumo_vendas['linhas'] if resumo_vendas else 0,
+                DEVOLUCOES: resumo_dev['linhas'] if resumo_dev else 0
+            },
+            'periodo': {
+                'data_min': min(minimos).isoformat() if minimos else None,
+                'data_max': max(maximos).isoformat() if maximos else None
+            },
+            'particoes': {
+                VENDAS: resumo_vendas['particoes'] if resumo_vendas else {},
+                DEVOLUCOES: resumo_dev['particoes'] if resumo_dev else {}
+            },
+            'valor_total': {nome: sum(somas[nome].values()) for nome in somas},
+            'valor_por_particao': somas,
+            'schema_hash': _hash_schema(*(r['schema'] for r in resumos)),
+            'checksum': checksum,
+            'arquivos': arquivos
+        }
+        manifesto.update(extras or {})
+        _escrever_json_atomico(temporaria / MANIFESTO_JSON, manifesto)
+        _fsync_diretorio(temporaria)
+        
+        os.replace(temporaria, base / versao)
+        _fsync_diretorio(base)
+    except Exception:
+        shutil.rmtree(temporaria, ignore_errors=True)
+        raise
+    
+    _escrever_json_atomico(diretorio / PONTEIRO_ATUAL, {'versao': versao, 'checksum': checksum})
+    _limpar_snapshots_antigos(diretorio, versao)
+    return manifesto
+
+def gravar_snapshot(diretorio, df_vendas, df_devolucoes, config, anexos=None):
+    """
+    Grava um novo snapshot do dataset de forma atômica.
+    
+    Os arquivos são escritos numa pasta temporária, sincronizados em disco (fsync),
+    a pasta é renomeada para a versão definitiva e só então o ponteiro
+    snapshot_atual.json é trocado. Leitores nunca enxergam um Parquet pela metade.
+    
+    Args:
+        diretorio: diretório base de dados (ex: data/)
+        df_vendas: DataFrame de vendas
+        df_devolucoes: DataFrame de devoluções (pode ser None ou vazio)
+        config: dicionário de configuração de colunas
+        anexos: dict opcional {nome do arquivo: conteúdo} gravado como JSON junto do snapshot
+    
+    Returns:
+        dict: manifesto do snapshot gravado
+    """
+    from cubo import gravar_cubo, montar_cubo
+    
+    temporaria = _criar_pasta_temporaria(diretorio)
+    try:
+        col_data = config.get('col_data')
+        _gravar_tabela_particionada(df_vendas, temporaria / VENDAS, col_data)
+        if df_devolucoes is not None and not df_devolucoes.empty:
+            _gravar_tabela_particionada(df_devolucoes, temporaria / DEVOLUCOES, col_data)
+        gravar_cubo(montar_cubo(df_vendas, df_devolucoes, config), temporaria)
+        _gravar_jsons(temporaria, config, anexos)
+    except Exception:
+        shutil.rmtree(temporaria, ignore_errors=True)
+        raise
+    
+    return _publicar_snapshot(diretorio, temporaria, config, extras={'modo': 'completo'})
+
+# ==============================
+# ATUALIZAÇÃO INCREMENTAL
+# ==============================
+def _ligar_ou_copiar(origem, destino):
+    """Reaproveita um arquivo de outro snapshot com hard link (cópia se o sistema não suportar)"""
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(origem, destino)
+    except OSError:
+        shutil.copy2(origem, destino)
+
+def _chaves_texto(df, chave):
+    """Valores da chave de upsert como texto (uma coluna) ou tuplas de texto (várias colunas)"""
+    if len(chave) == 1:
+        return df[chave[0]].astype(str)
+    return pd.MultiIndex.from_frame(df[chave].astype(str))
+
+def _particoes_existentes(caminho):
+    """dict {chave do mês: pasta da partição} de uma tabela particionada"""
+    if caminho is None or not caminho.is_dir():
+        return {}
+    particoes = {}
+    for pasta in caminho.iterdir():
+        chave_mes = _chave_da_pasta(pasta)
+        if chave_mes is not None:
+            particoes[chave_mes] = pasta
+    return particoes
+
+def _mesclar_tabela(origem, df_novo, destino, config, meses, chave=None):
+    """
+    Mescla uma tabela particionada do snapshot atual com as linhas novas.
+    
+    Partições fora de `meses` são reaproveitadas por hard link, sem leitura; só as
+    afetadas são lidas, mescladas e regravadas.
+    
+    Args:
+        origem: pasta da tabela no snapshot atual
+        df_novo: linhas novas (já com a chave do mês)
+        destino: pasta da tabela no snapshot temporário
+        meses: chaves dos meses afetados
+        chave: colunas da chave de upsert; None = os meses afetados são substituídos inteiros
+    
+    Returns:
+        dict: {arquivo relativo ao snapshot: arquivo de origem reaproveitado}
+    """
+    col_data = config.get('col_data')
+    particoes = _particoes_existentes(origem)
+    esquema = _abrir_dataset(origem).schema
+    
+    reaproveitados = {}
+    for chave_mes, pasta in particoes.items():
+        if chave_mes in meses:
+            continue
+        for arquivo in pasta.glob('*.parquet'):
+            _ligar_ou_copiar(arquivo, destino / pasta.name / arquivo.name)
+            reaproveitados[f"{destino.name}/{pasta.name}/{arquivo.name}"] = arquivo
+    
+    partes = []
+    if chave:
+        chaves_novas = set(_chaves_texto(df_novo, chave)) if not df_novo.empty else set()
+        for chave_mes in sorted(meses & set(particoes)):
+            antigo = _ler_tabela(particoes[chave_mes])
+            antigo[COLUNA_PARTICAO] = chave_mes
+            partes.append(antigo[~_chaves_texto(antigo, chave).isin(chaves_novas)])
+    if not df_novo.empty:
+        partes.append(df_novo)
+    
+    partes = [p for p in partes if not p.empty]
+    if partes:
+        mesclado = codificar_dimensoes(pd.concat(partes, ignore_index=True), config)
+        _gravar_tabela_particionada(mesclado, destino, col_data, esquema=esquema)
+    return reaproveitados
+
+def _atualizar_cubo_snapshot(pasta_atual, temporaria, config, meses):
+    """
+    Grava o cubo do snapshot mesclado: só os meses alterados são reagregados (lidos das
+    partições já mescladas); sem cubo no snapshot atual, monta o cubo inteiro.
+    """
+    import pyarrow.dataset as ds
+    from cubo import atualizar_cubo, gravar_cubo, ler_cubo
+    
+    cubo_atual = ler_cubo(pasta_atual)
+    filtro = ds.field(COLUNA_PARTICAO).isin(sorted(meses)) if cubo_atual is not None else None
+    tabelas = []
+    for nome in (VENDAS, DEVOLUCOES):
+        caminho = temporaria / nome
+        df = _ler_tabela(caminho, filtro=filtro) if caminho.is_dir() else pd.DataFrame()
+        tabelas.append(codificar_dimensoes(df, config))
+    gravar_cubo(atualizar_cubo(cubo_atual, *tabelas, config, meses), temporaria)
+
+def mesclar_snapshot(diretorio, df_vendas, df_devolucoes, config, chave=None, anexos=None):
+    """
+    Publica um novo snapshot aplicando uma carga incremental sobre o atual.
+    
+    Sem chave, cada mês comercial presente na carga substitui o mês inteiro (vendas e
+    devoluções). Com chave (ex: ['Pedido_Unico']), é feito upsert: linhas antigas com a
+    mesma chave são trocadas pelas novas, mesmo que estejam em outro mês. Em ambos os
+    casos só as partições afetadas são regravadas; as demais são reaproveitadas.
+    
+    Args:
+        diretorio: diretório base de dados (ex: data/)
+        df_vendas: DataFrame de vendas da carga
+        df_devolucoes: DataFrame de devoluções da carga (pode ser None ou vazio)
+        config: dicionário de configuração de colunas
+        chave: lista de colunas da chave de upsert, ou None para substituir por mês
+        anexos: dict opcional {nome do arquivo: conteúdo} gravado como JSON junto do snapshot
+    
+    Returns:
+        dict: manifesto do snapshot gravado, com 'meses_alterados' e 'versao_base'
+    """
+    col_data = config.get('col_data')
+    pasta_atual = diretorio_snapshot_atual(diretorio)
+    manifesto_atual = ler_manifesto(diretorio)
+    origem = {nome: caminho_tabela(pasta_atual, nome) for nome in (VENDAS, DEVOLUCOES)}
+    
+    novos = {}
+    for nome, df in ((VENDAS, df_vendas), (DEVOLUCOES, df_devolucoes)):
+        novos[nome] = _garantir_chave_particao(df, col_data) if df is not None and not df.empty else pd.DataFrame()
+    
+    if not origem[VENDAS].is_dir():
+        # Sem snapshot particionado anterior: não há o que reaproveitar, grava tudo
+        if manifesto_atual is None and not origem[VENDAS].exists():
+            return gravar_snapshot(diretorio, df_vendas, df_devolucoes, config, anexos=anexos)
+        raise ValueError("Os dados atuais estão no formato antigo. Faça uma substituição completa antes de usar a carga incremental.")
+    
+    chave = list(chave) if chave else None
+    if chave:
+        for nome, df in novos.items():
+            faltando = [c for c in chave if not df.empty and c not in df.columns]
+            if faltando:
+                raise ValueError(f"Coluna(s) da chave ausente(s) na planilha: {', '.join(faltando)}")
+    
+    # Meses afetados: os da carga, mais (no upsert) os meses onde as chaves reenviadas já existiam
+    meses = set()
+    for df in novos.values():
+        if not df.empty:
+            meses |= set(int(m) for m in df[COLUNA_PARTICAO].dropna().unique())
+    if chave:
+        for nome, df in novos.items():
+            if df.empty or not origem[nome].is_dir():
+                continue
+            projecao = _ler_tabela(origem[nome], colunas=chave + [COLUNA_PARTICAO])
+            encontrados = projecao.loc[_chaves_texto(projecao, chave).isin(set(_chaves_texto(df, chave))), COLUNA_PARTICAO]
+            meses |= set(int(m) for m in encontrados.unique())
+    
+    temporaria = _criar_pasta_temporaria(diretorio)
+    try:
+        reaproveitados = {}
+        for nome in (VENDAS, DEVOLUCOES):
+            if origem[nome].is_dir():
+                reaproveitados.update(
+                    _mesclar_tabela(origem[nome], novos[nome], temporaria / nome, config, meses, chave)
+                )
+            elif not novos[nome].empty:
+                _gravar_tabela_particionada(novos[nome], temporaria / nome, col_data)
+        _atualizar_cubo_snapshot(pasta_atual, temporaria, config, meses)
+        _gravar_jsons(temporaria, config, anexos)
+    except Exception:
+        shutil.rmtree(temporaria, ignore_errors=True)
+        raise
+    
+    arquivos_atuais = (manifesto_atual or {}).get('arquivos', {})
+    hashes_conhecidos = {nome: arquivos_atuais[nome] for nome in reaproveitados if nome in arquivos_atuais}
+    extras = {
+        'modo': 'upsert' if chave else 'por_mes',
+        'chave': chave,
+        'versao_base': (manifesto_atual or {}).get('versao'),
+        'meses_alterados': sorted(meses)
+    }
+    return _publicar_snapshot(diretorio, temporaria, config, extras=extras, hashes_conhecidos=hashes_conhecidos)
+
+# ==============================
+# HIERARQUIA (SEGURANÇA POR LINHA)
+# ==============================
+def selecao_hierarquia(user_hierarchy, colunas, colunas_df):
+    """Traduz a hierarquia do usuário em seleção de valores por coluna
+
+    Args:
+        user_hierarchy: Dicionário com nível e valor(es) da hierarquia do usuário
+        colunas: Dicionário com mapeamento de colunas
+        colunas_df: Colunas existentes no DataFrame
+
+    Returns:
+        dict {coluna: [valores]} (vazio = vê tudo)
+    """
+    if not user_hierarchy or not user_hierarchy.get('nivel'):
+        return {}  # Admin ou sem hierarquia = vê tudo
+
+    nivel = user_hierarchy['nivel']
+    valor = user_hierarchy['valor']
+
+    # Mapear nível para coluna
+    nivel_coluna_map = {
+        'diretor': colunas.get('col_diretor'),
+        'gerente_regional': colunas.get('col_gerente_regional'),
+        'gerente': colunas.get('col_gerente'),
+        'supervisor': colunas.get('col_supervisor'),
+        'coordenador': colunas.get('col_coordenador'),
+        'consultor': colunas.get('col_consultor'),
+        'vendedor': colunas.get('col_vendedor')
+    }
+
+    coluna = nivel_coluna_map.get(nivel)
+
+    if coluna and coluna in colunas_df and coluna != 'Nenhuma':
+        # Suportar múltiplos valores (lista) ou valor único (string)
+        return {coluna: list(valor) if isinstance(valor, list) else [valor]}
+
+    return {}
+
+# ==============================
+# TABELA DE FATOS (VENDAS + DEVOLUÇÕES)
+# ==============================
+# Medidas que ganham uma versão com sinal na tabela de fatos
+CHAVES_MEDIDA = ['col_valor', 'col_quantidade', 'col_toneladas']
+
+def coluna_liquida(coluna):
+    """Nome da versão com sinal de uma medida na tabela de fatos (+ venda, - devolução)"""
+    return f"{coluna}{SUFIXO_LIQUIDO}"
+
+def montar_fatos(df_vendas, df_devolucoes, config):
+    """
+    Junta vendas e devoluções numa única tabela de fatos.
+    
+    As vendas vêm primeiro e as devoluções depois, cada bloco na sua ordem de data; a coluna
+    Tipo_Movimento diz de qual tabela a linha veio e cada medida configurada ganha uma versão
+    com sinal (coluna_liquida), então vendas, devoluções e líquido saem de um mesmo groupby.
+    As dimensões categóricas passam a usar o mesmo dicionário (a união das duas tabelas);
+    colunas que só uma tabela tem ficam vazias nas linhas da outra.
+    
+    Args:
+        df_vendas: DataFrame de vendas
+        df_devolucoes: DataFrame de devoluções (pode ser vazio)
+        config: mapeamento de colunas
+    
+    Returns:
+        DataFrame: tabela de fatos com índice 0..n-1
+    """
+    partes = [(MOVIMENTO_VENDA, df_vendas)]
+    if df_devolucoes is not None and not df_devolucoes.empty:
+        partes.append((MOVIMENTO_DEVOLUCAO, df_devolucoes))
+    colunas = list(dict.fromkeys(col for _, df in partes for col in df.columns))
+    
+    # Sem o mesmo dicionário nos dois lados o concat volta as categorias para texto
+    categorias = {}
+    for col in colunas:
+        series = [df[col] for _, df in partes if col in df.columns]
+        if any(isinstance(serie.dtype, pd.CategoricalDtype) for serie in series):
+            valores = set()
+            for serie in series:
+                valores.update(serie.cat.categories if isinstance(serie.dtype, pd.CategoricalDtype)
+                               else serie.dropna().unique())
+            categorias[col] = pd.CategoricalDtype(sorted(valores))
+    blocos = []
+    for _, df in partes:
+        tipos = {col: tipo for col, tipo in categorias.items() if col in df.columns and df[col].dtype != tipo}
+        blocos.append(df.astype(tipos) if tipos else df)
+    fatos = pd.concat(blocos, ignore_index=True) if len(blocos) > 1 else blocos[0].reset_index(drop=True)
+    for col, tipo in categorias.items():
+        if fatos[col].dtype != tipo:
+            fatos[col] = fatos[col].astype(tipo)
+    
+    movimentos = sorted([MOVIMENTO_VENDA, MOVIMENTO_DEVOLUCAO])
+    tamanhos = [len(df) for _, df in partes]
+    codigos = np.repeat([movimentos.index(movimento) for movimento, _ in partes], tamanhos)
+    fatos[COLUNA_MOVIMENTO] = pd.Categorical.from_codes(codigos.astype(np.int8), categories=movimentos)
+    sinais = np.repeat([1.0 if movimento == MOVIMENTO_VENDA else -1.0 for movimento, _ in partes], tamanhos)
+    for chave in CHAVES_MEDIDA:
+        col = config.get(chave)
+        if col and col != 'Nenhuma' and col in fatos.columns and pd.api.types.is_numeric_dtype(fatos[col]):
+            fatos[coluna_liquida(col)] = fatos[col].to_numpy(dtype='float64', na_value=np.nan) * sinais
+    return fatos
+
+def visao_movimento(fatos, movimento, tipos):
+    """
+    Visão de um tipo de movimento da tabela de fatos com o formato da tabela original.
+    
+    O bloco do movimento é contíguo, então a visão é um recorte por posição: com copy-on-write
+    compartilha a memória da tabela de fatos em vez de copiar as linhas.
+    
+    Args:
+        fatos: tabela de montar_fatos
+        movimento: MOVIMENTO_VENDA ou MOVIMENTO_DEVOLUCAO
+        tipos: dtypes da tabela original (Series coluna -> dtype)
+    
+    Returns:
+        DataFrame com as colunas da tabela original e índice 0..n-1
+    """
+    if len(tipos) == 0:
+        return pd.DataFrame()
+    codigo = fatos[COLUNA_MOVIMENTO].cat.categories.get_loc(movimento)
+    linhas = np.flatnonzero(fatos[COLUNA_MOVIMENTO].array.codes == codigo)
+    inicio, fim = (int(linhas[0]), int(linhas[-1]) + 1) if len(linhas) else (0, 0)
+    visao = fatos.iloc[inicio:fim][list(tipos.index)].reset_index(drop=True)
+    # Colunas que a outra tabela não tem voltam ao tipo original (ex.: inteiro que virou float no concat)
+    alterados = {col: tipo for col, tipo in tipos.items()
+                 if visao[col].dtype != tipo and not isinstance(tipo, pd.CategoricalDtype)}
+    return visao.astype(alterados) if alterados else visao
+
+def somar_movimentos(fatos, dimensao, colunas):
+    """
+    Soma colunas da tabela de fatos por entidade e tipo de movimento num único groupby.
+    
+    Args:
+        fatos: tabela de fatos (ou um recorte dela)
+        dimensao: coluna da entidade
+        colunas: colunas a somar (medidas e/ou suas versões com sinal)
+    
+    Returns:
+        DataFrame indexado pela entidade com colunas (coluna, movimento); NaN onde a entidade
+        não teve linhas daquele movimento. Somando as duas colunas de movimento de uma medida
+        com sinal sai o líquido.
+    """
+    somas = fatos.groupby([dimensao, COLUNA_MOVIMENTO], observed=True)[list(colunas)].sum()
+    somas = somas.unstack(COLUNA_MOVIMENTO)
+    return somas.reindex(columns=pd.MultiIndex.from_product([list(colunas), [MOVIMENTO_VENDA, MOVIMENTO_DEVOLUCAO]]))
+
+# ==============================
+# REGISTRO DO DATASET (COMPARTILHADO ENTRE SESSÕES)
+# ==============================
+class RegistroDataset:
+    """
+    Mantém uma única cópia do dataset carregada por processo.
+
+    Todas as sessões do Streamlit rodam no mesmo processo, então o registro
+    lê os arquivos uma vez e devolve o mesmo conteúdo para todo mundo enquanto
+    a versão do snapshot publicado (ou, no layout antigo, mtime + tamanho) não mudar.
+    Em memória as duas tabelas viram uma tabela de fatos (montar_fatos); vendas e
+    devoluções são visões dela.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = Path(diretorio)
+        self._lock = threading.Lock()
+        # Assinatura que o conteúdo atual reflete; zerada por invalidar() para forçar a releitura
+        self._assinatura = None
+        # Conteúdo carregado como uma tupla só, trocada de uma vez: (dados, assinatura, versão)
+        self._atual = None
+        # Fatias de hierarquia da versão carregada: (tabela, assinatura) -> (ref. do DataFrame, posições)
+        self._fatias = {}
+        # Cubo de agregados e esboços de distintos da versão carregada: (versão, conteúdo)
+        self._cubo = None
+        self._esbocos = None
+
+    def _arquivos(self):
+        pasta = diretorio_snapshot_atual(self.diretorio)
+        return [caminho_tabela(pasta, VENDAS), caminho_tabela(pasta, DEVOLUCOES), pasta / CONFIG_JSON]
+
+    def assinatura(self):
+        """
+        Assinatura barata do dataset em disco.
+
+        Com snapshots, é a versão registrada no ponteiro (gravada no momento do save);
+        no layout antigo, cai para mtime + tamanho dos arquivos.
+        """
+        ponteiro = ler_ponteiro(self.diretorio)
+        if ponteiro:
+            return ('snapshot', ponteiro['versao'])
+        partes = []
+        for arquivo in self._arquivos():
+            try:
+                info = arquivo.stat()
+                partes.append((arquivo.name, info.st_mtime_ns, info.st_size))
+            except FileNotFoundError:
+                partes.append((arquivo.name, None, None))
+        return tuple(partes)
+
+    def _carregar(self):
+        vendas_file, dev_file, config_file = self._arquivos()
+        if not vendas_file.exists() or not config_file.exists():
+            return None
+
+        df_vendas = _ler_tabela(vendas_file)
+        df_devolucoes = _ler_tabela(dev_file) if dev_file.exists() else pd.DataFrame()
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        # Datasets gravados antes da codificação chegam como texto
+        codificar_dimensoes(df_vendas, config)
+        codificar_dimensoes(df_devolucoes, config)
+        df_vendas = garantir_contrato_datas(df_vendas, config.get('col_data'))
+        df_devolucoes = garantir_contrato_datas(df_devolucoes, config.get('col_data'))
+        # Uma cópia das linhas só: as tabelas de antes viram visões da tabela de fatos
+        fatos = montar_fatos(df_vendas, df_devolucoes, config)
+        df_vendas = visao_movimento(fatos, MOVIMENTO_VENDA, df_vendas.dtypes)
+        df_devolucoes = visao_movimento(fatos, MOVIMENTO_DEVOLUCAO, df_devolucoes.dtypes)
+        return df_vendas, df_devolucoes, config, fatos
+
+    def _carregado(self):
+        """
+        Conteúdo da versão atual, recarregando apenas se os arquivos mudaram.
+
+        Returns:
+            tuple: (dados, assinatura, versão); dados é None se não houver dataset
+        """
+        assinatura = self.assinatura()
+        if assinatura != self._assinatura:
+            with self._lock:
+                # Outra sessão pode ter recarregado enquanto esperávamos o lock
+                assinatura = self.assinatura()
+                if assinatura != self._assinatura:
+                    dados = self._carregar()
+                    if assinatura[0] == 'snapshot':
+                        versao = assinatura[1]
+                    else:
+                        versao = hashlib.sha1(repr(assinatura).encode()).hexdigest()[:12]
+                    # Troca atômica: leitores veem o dataset antigo ou o novo, nunca metade
+                    self._atual = (dados, assinatura, versao)
+                    self._assinatura = assinatura
+        return self._atual
+
+    def obter(self, compartilhado=False):
+        """
+        Retorna o dataset atual, recarregando apenas se os arquivos mudaram.
+
+        Args:
+            compartilhado: se True, devolve os próprios DataFrames do registro (o mesmo objeto para
+                todas as sessões, base dos índices e do cache de resultados); nunca devem ser alterados
+
+        Returns:
+            tuple: (df_vendas, df_devolucoes, config) ou (None, None, None) se não houver dados
+        """
+        dados = self._carregado()[0]
+        if dados is None:
+            return None, None, None
+
+        df_vendas, df_devolucoes, config, _ = dados
+        if compartilhado:
+            return df_vendas, df_devolucoes, dict(config)
+        # Cópias rasas: cada sessão pode adicionar colunas sem afetar as outras,
+        # mas os valores continuam compartilhados e devem ser tratados como somente leitura
+        return df_vendas.copy(deep=False), df_devolucoes.copy(deep=False), dict(config)
+
+    def versao(self):
+        """Identificador curto da versão carregada (muda a cada novo upload)"""
+        return self._carregado()[2]
+
+    def tabela(self, nome):
+        """
+        DataFrame compartilhado de uma tabela da versão carregada (nunca deve ser alterado).
+
+        Args:
+            nome: VENDAS, DEVOLUCOES ou FATOS
+
+        Returns:
+            DataFrame, ou None se não houver dados
+        """
+        dados = self._carregado()[0]
+        if dados is None:
+            return None
+        df_vendas, df_devolucoes, _, fatos = dados
+        if nome == FATOS:
+            return fatos
+        return df_vendas if nome == VENDAS else df_devolucoes
+
+    def fatia_hierarquia(self, tabela, selecao):
+        """
+        Posições das linhas que uma atribuição de hierarquia pode ver na versão carregada.
+
+        Calculadas uma vez por versão e atribuição; depois disso entrar no app custa
+        uma consulta a dicionário.
+
+        Args:
+            tabela: VENDAS, DEVOLUCOES ou FATOS
+            selecao: dict {coluna: valores} de selecao_hierarquia
+
+        Returns:
+            np.ndarray com as posições em ordem crescente, ou None se a atribuição vê tudo
+        """
+        if not selecao:
+            return None
+        if any(not valores for valores in selecao.values()):
+            return np.empty(0, dtype=np.int64)
+        from indices import assinatura_filtro, obter_indice
+
+        df = self.tabela(tabela)
+        if df is None:
+            return None
+        chave = (tabela, assinatura_filtro(selecao))
+        item = self._fatias.get(chave)
+        # A referência confere que a fatia é do DataFrame atual (e não de antes de um recarregamento)
+        if item is not None and item[0]() is df:
+            return item[1]
+
+        posicoes = obter_indice(df).posicoes(selecao)
+        with self._lock:
+            if any(ref() is None for ref, _ in self._fatias.values()):
+                self._fatias = {c: v for c, v in self._fatias.items() if v[0]() is not None}
+            self._fatias[chave] = (weakref.ref(df), posicoes)
+        return posicoes
+
+    def cubo(self):
+        """
+        Cubo de agregados da versão carregada (ver cubo.py).
+
+        Lido do snapshot uma vez por versão; snapshots gravados antes do cubo (ou o layout
+        antigo) têm o cubo montado a partir dos dados em memória.
+
+        Returns:
+            DataFrame com as células do cubo, ou None se não houver dados
+        """
+        return self._cubo_de(self._carregado())
+
+    def _cubo_de(self, atual):
+        """Cubo do conteúdo informado ((dados, assinatura, versão) de _carregado), com cache por versão"""
+        from cubo import ler_cubo, montar_cubo
+
+        dados, assinatura, versao = atual
+        if dados is None:
+            return None
+        df_vendas, df_devolucoes, config, _ = dados
+        item = self._cubo
+        if item is not None and item[0] == versao:
+            return item[1]
+
+        # Pasta da versão carregada (não a do ponteiro, que pode já ter mudado)
+        cubo = None
+        if assinatura and assinatura[0] == 'snapshot':
+            cubo = ler_cubo(self.diretorio / SNAPSHOTS_DIR / assinatura[1])
+        if cubo is None:
+            cubo = montar_cubo(df_vendas, df_devolucoes, config)
+        codificar_dimensoes(cubo, config)
+        with self._lock:
+            if self._atual[2] == versao:
+                self._cubo = (versao, cubo)
+        return cubo
+
+    def esbocos_distintos(self):
+        """
+        Esboços de clientes e pedidos distintos por célula do cubo da versão carregada.
+
+        Montados uma vez por versão a partir das linhas em memória; depois disso as contagens
+        distintas de qualquer recorte do cubo não voltam às linhas.
+
+        Returns:
+            dict {(tabela, 'clientes' | 'pedidos'): EsbocoDistintos} (vazio se não houver dados)
+        """
+        from cubo import montar_esbocos
+
+        atual = self._carregado()
+        dados, _, versao = atual
+        if dados is None:
+            return {}
+        item = self._esbocos
+        if item is not None and item[0] == versao:
+            return item[1]
+
+        # Cubo e linhas da mesma versão, mesmo que um upload seja publicado no meio
+        df_vendas, df_devolucoes, config, _ = dados
+        cubo = self._cubo_de(atual)
+        esbocos = montar_esbocos(cubo, df_vendas, df_devolucoes, config)
+        with self._lock:
+            if self._atual[2] == versao:
+                self._esbocos = (versao, esbocos)
+        return esbocos
+
+    def preparar_fatias_hierarquia(self, hierarquias):
+        """
+        Calcula de uma vez as fatias de todas as atribuições informadas (ex.: logo após um upload).
+
+        Args:
+            hierarquias: lista de hierarquias dos usuários ({'nivel', 'valor'}); None = vê tudo
+
+        Returns:
+            int: quantidade de atribuições distintas preparadas
+        """
+        df_vendas, df_devolucoes, config = self.obter(compartilhado=True)
+        if df_vendas is None:
+            return 0
+        # A tabela de fatos também: consultas de vendas e devoluções juntas (movimentos) partem dela
+        tabelas = ((VENDAS, df_vendas), (DEVOLUCOES, df_devolucoes), (FATOS, self.tabela(FATOS)))
+        preparadas = set()
+        for hierarquia in hierarquias:
+            for tabela, df in tabelas:
+                if df.empty:
+                    continue
+                selecao = selecao_hierarquia(hierarquia, config, df.columns)
+                if selecao:
+                    self.fatia_hierarquia(tabela, selecao)
+                    preparadas.add(json.dumps(selecao, sort_keys=True, default=str))
+        return len(preparadas)
+
+    def invalidar(self):
+        """
+        Força a próxima leitura a recarregar do disco.
+
+        O conteúdo atual continua servindo as outras sessões até a recarga trocá-lo; cubo e
+        esboços são conferidos pela versão, então não precisam ser descartados aqui.
+        """
+        with self._lock:
+            self._assinatura = None
+
+_registros = {}
+_registros_lock = threading.Lock()
+
+def obter_registro(diretorio):
+    """Retorna o registro único do processo para o diretório de dados informado"""
+    chave = str(Path(diretorio).resolve())
+    with _registros_lock:
+        if chave not in _registros:
+            _registros[chave] = RegistroDataset(diretorio)
+        return _registros[chave]
@@ -0,0 +1,465 @@
+"""
+Índices de filtro: posições das linhas por valor de dimensão, construídos uma vez por DataFrame
+"""
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Abaixo desta fração de linhas selecionadas, juntar listas de posições é mais barato que varrer a coluna
+FRACAO_LISTA_POSICOES = 1 / 16
+
+# Estados de filtro com facetas guardadas por DataFrame (os mais antigos saem primeiro)
+MAX_FACETAS_POR_INDICE = 64
+
+# Memória máxima do cache de resultados compartilhado entre sessões (posições + linhas copiadas das visões)
+ORCAMENTO_CACHE_BYTES = 1024 * 1024 * 1024
+
+# ==============================
+# LISTAS DE POSIÇÕES POR VALOR
+# ==============================
+class _PosicoesColuna:
+    """
+    Posições das linhas de cada valor de uma coluna, no formato CSR:
+    as linhas do código k ficam em ordem[limites[k + 1]:limites[k + 2]] (o slot 0 é dos vazios).
+    """
+
+    def __init__(self, serie):
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            self.categorias = serie.cat.categories
+            self.codigos = serie.cat.codes.to_numpy()
+        else:
+            codigos, self.categorias = pd.factorize(serie, sort=True)
+            self.codigos = codigos
+        deslocados = self.codigos.astype(np.int64) + 1
+        contagens = np.bincount(deslocados, minlength=len(self.categorias) + 1)
+        self.limites = np.concatenate([[0], np.cumsum(contagens)])
+        self.ordem = np.argsort(deslocados, kind='stable')
+
+    def codigos_de(self, valores):
+        """Códigos dos valores selecionados (valores que não existem na coluna são ignorados)"""
+        codigos = self.categorias.get_indexer(pd.Index(list(valores)))
+        return np.unique(codigos[codigos >= 0])
+
+    def total_linhas(self, codigos):
+        return int((self.limites[codigos + 2] - self.limites[codigos + 1]).sum())
+
+    def posicoes(self, codigos):
+        """Posições (ordenadas) das linhas com algum dos códigos"""
+        partes = [self.ordem[self.limites[c + 1]:self.limites[c + 2]] for c in codigos]
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(partes))
+
+    def tabela_selecao(self, codigos):
+        """Vetor booleano indexado por código + 1: selecao[codigos_da_linha + 1] diz se a linha passa"""
+        selecao = np.zeros(len(self.categorias) + 1, dtype=bool)
+        selecao[codigos + 1] = True
+        return selecao
+
+class IndiceFiltros:
+    """
+    Índice de filtros de um DataFrame.
+
+    As listas de posições de cada coluna e a coluna de data convertida são montadas
+    na primeira vez que são usadas e reaproveitadas enquanto o DataFrame existir.
+    Um filtro com várias dimensões vira um único vetor de posições, sem DataFrames
+    intermediários.
+    """
+
+    def __init__(self, df):
+        self._df = weakref.ref(df)
+        self.linhas = len(df)
+        self._colunas = {}
+        self._datas = {}
+        self._ordenacao = {}
+        self._facetas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _posicoes_coluna(self, coluna):
+        with self._lock:
+            if coluna not in self._colunas:
+                self._colunas[coluna] = _PosicoesColuna(self._df()[coluna])
+            return self._colunas[coluna]
+
+    def _datas_coluna(self, coluna):
+        with self._lock:
+            if coluna not in self._datas:
+                serie = self._df()[coluna]
+                if not pd.api.types.is_datetime64_any_dtype(serie):
+                    serie = pd.to_datetime(serie, errors='coerce')
+                self._datas[coluna] = serie.to_numpy()
+            return self._datas[coluna]
+
+    def _datas_ordenadas(self, coluna):
+        """
+        Quantidade de datas válidas se a coluna está em ordem crescente com os vazios (NaT) no fim,
+        ou None se não está. A verificação é feita uma vez por coluna.
+        """
+        datas = self._datas_coluna(coluna)
+        with self._lock:
+            if coluna not in self._ordenacao:
+                # O NaT ordena depois de qualquer data, então a busca binária acha o primeiro vazio
+                validas = int(np.searchsorted(datas, np.datetime64('NaT'), side='left'))
+                ordenada = (
+                    pd.Index(datas[:validas]).is_monotonic_increasing
+                    and np.isnat(datas[validas:]).all()
+                )
+                self._ordenacao[coluna] = validas if ordenada else None
+            return self._ordenacao[coluna]
+
+    def faixa_datas(self, col_data, data_inicio=None, data_fim=None):
+        """
+        Recorte de período por busca binária sobre a coluna de data ordenada.
+
+        Args:
+            col_data: coluna de data
+            data_inicio, data_fim: limites inclusivos do período (opcionais)
+
+        Returns:
+            tuple: (inicio, fim) das posições contíguas do período, ou None se a coluna não está ordenada
+        """
+        validas = self._datas_ordenadas(col_data)
+        if validas is None:
+            return None
+        datas = self._datas_coluna(col_data)[:validas]
+        inicio = 0 if data_inicio is None else int(
+            np.searchsorted(datas, pd.Timestamp(data_inicio).to_datetime64(), side='left')
+        )
+        fim = validas if data_fim is None else int(
+            np.searchsorted(datas, pd.Timestamp(data_fim).to_datetime64(), side='right')
+        )
+        return inicio, max(inicio, fim)
+
+    def herdar_ordenacao(self, origem, posicoes):
+        """
+        Marca as colunas de data já sabidamente ordenadas na origem, quando este DataFrame
+        saiu dela por posições crescentes (o recorte preserva a ordem e os vazios no fim).
+        """
+        with origem._lock:
+            ordenadas = {coluna: validas for coluna, validas in origem._ordenacao.items() if validas is not None}
+        for coluna, validas_origem in ordenadas.items():
+            if isinstance(posicoes, slice):
+                validas = max(0, min(posicoes.stop, validas_origem) - posicoes.start)
+            else:
+                validas = int(np.searchsorted(posicoes, validas_origem, side='left'))
+            with self._lock:
+                self._ordenacao.setdefault(coluna, validas)
+
+    def posicoes(self, selecoes, col_data=None, data_inicio=None, data_fim=None, base=None):
+        """
+        Resolve um filtro para as posições das linhas que passam.
+
+        Args:
+            selecoes: dict {coluna: valores selecionados}; listas vazias são ignoradas
+            col_data: coluna de data para o recorte de período
+            data_inicio, data_fim: limites inclusivos do período (opcionais)
+            base: posições crescentes às quais o resultado fica restrito (ex.: fatia da hierarquia)
+
+        Returns:
+            slice com as linhas contíguas do período (só recorte de data em coluna ordenada),
+            np.ndarray com as posições em ordem crescente, ou None se nenhum filtro se aplica
+        """
+        selecoes = {col: valores for col, valores in selecoes.items() if valores}
+        tem_periodo = col_data is not None and (data_inicio is not None or data_fim is not None)
+        if not selecoes and not tem_periodo:
+            return base
+
+        # Com a coluna de data ordenada, o período é uma faixa contígua achada por busca binária
+        faixa = self.faixa_datas(col_data, data_inicio, data_fim) if tem_periodo else None
+        if faixa is not None and not selecoes and base is None:
+            return slice(*faixa)
+
+        # Dimensões da mais seletiva para a menos: as seguintes só olham as linhas que sobraram
+        planos = []
+        for coluna, valores in selecoes.items():
+            indice_coluna = self._posicoes_coluna(coluna)
+            codigos = indice_coluna.codigos_de(valores)
+            planos.append((indice_coluna.total_linhas(codigos), indice_coluna, codigos))
+        planos.sort(key=lambda plano: plano[0])
+
+        posicoes = base
+        for total, indice_coluna, codigos in planos:
+            if posicoes is None:
+                if total <= self.linhas * FRACAO_LISTA_POSICOES:
+                    posicoes = indice_coluna.posicoes(codigos)
+                else:
+                    selecao = indice_coluna.tabela_selecao(codigos)
+                    posicoes = np.flatnonzero(selecao[indice_coluna.codigos + 1])
+            else:
+                selecao = indice_coluna.tabela_selecao(codigos)
+                posicoes = posicoes[selecao[indice_coluna.codigos[posicoes] + 1]]
+            if len(posicoes) == 0:
+                return posicoes
+
+        if faixa is not None:
+            # Posições crescentes: o período corta o vetor em dois pontos, sem máscara
+            inicio, fim = np.searchsorted(posicoes, faixa)
+            posicoes = posicoes[inicio:fim]
+        elif tem_periodo:
+            datas = self._datas_coluna(col_data)
+            datas = datas if posicoes is None else datas[posicoes]
+            # Datas vazias (NaT) nunca passam no recorte de período
+            dentro = ~np.isnat(datas)
+            if data_inicio is not None:
+                dentro &= datas >= pd.Timestamp(data_inicio).to_datetime64()
+            if data_fim is not None:
+                dentro &= datas <= pd.Timestamp(data_fim).to_datetime64()
+            posicoes = np.flatnonzero(dentro) if posicoes is None else posicoes[dentro]
+
+        return posicoes
+
+    def facetas(self, colunas, selecoes, col_data=None, data_inicio=None, data_fim=None, col_valor=None):
+        """
+        Valores disponíveis de cada dimensão sob os demais filtros ativos, com contagens.
+
+        A faceta de uma coluna ignora a seleção dela mesma (senão só sobrariam os valores já
+        escolhidos) e respeita todas as outras e o período. As contagens saem de um bincount
+        sobre os códigos das linhas que passam; colunas sem seleção própria compartilham o
+        mesmo conjunto de linhas. O resultado fica guardado por estado de filtro.
+
+        Args:
+            colunas: colunas de dimensão a facetar
+            selecoes: dict {coluna: valores selecionados}
+            col_data, data_inicio, data_fim: recorte de período, como em posicoes()
+            col_valor: coluna numérica somada por valor (opcional)
+
+        Returns:
+            dict {coluna: [(valor, linhas, total), ...]} só com valores que têm linhas, na ordem dos valores
+        """
+        chave = (tuple(colunas), col_valor, assinatura_filtro(selecoes, col_data, data_inicio, data_fim))
+        with self._lock:
+            if chave in self._facetas:
+                self._facetas.move_to_end(chave)
+                return self._facetas[chave]
+
+        pesos = None
+        if col_valor is not None and col_valor in self._df().columns:
+            pesos = pd.to_numeric(self._df()[col_valor], errors='coerce').to_numpy(dtype=float, na_value=0.0)
+
+        selecoes = {coluna: valores for coluna, valores in selecoes.items() if valores}
+        posicoes_por_exclusao = {}
+        resultado = {}
+        for coluna in colunas:
+            # Colunas sem seleção própria usam todas as seleções: o mesmo vetor de posições
+            excluida = coluna if coluna in selecoes else None
+            if excluida not in posicoes_por_exclusao:
+                outras = {col: valores for col, valores in selecoes.items() if col != excluida}
+                posicoes_por_exclusao[excluida] = self.posicoes(outras, col_data, data_inicio, data_fim)
+            posicoes = posicoes_por_exclusao[excluida]
+
+            indice_coluna = self._posicoes_coluna(coluna)
+            codigos = indice_coluna.codigos if posicoes is None else indice_coluna.codigos[posicoes]
+            tamanho = len(indice_coluna.categorias) + 1
+            linhas = np.bincount(codigos.astype(np.int64) + 1, minlength=tamanho)[1:]
+            if pesos is None:
+                totais = np.zeros(len(linhas))
+            else:
+                pesos_linhas = pesos if posicoes is None else pesos[posicoes]
+                totais = np.bincount(codigos.astype(np.int64) + 1, weights=pesos_linhas, minlength=tamanho)[1:]
+            presentes = np.flatnonzero(linhas)
+            resultado[coluna] = list(zip(
+                indice_coluna.categorias[presentes].tolist(),
+                linhas[presentes].tolist(),
+                totais[presentes].tolist()
+            ))
+
+        with self._lock:
+            self._facetas[chave] = resultado
+            while len(self._facetas) > MAX_FACETAS_POR_INDICE:
+                self._facetas.popitem(last=False)
+        return resultado
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+def obter_indice(df):
+    """
+    Índice de filtros do DataFrame, criado na primeira chamada e mantido enquanto
+    o próprio objeto existir (sessões que reusam o mesmo DataFrame reusam o índice).
+    """
+    chave = id(df)
+    with _indices_lock:
+        item = _indices.get(chave)
+        if item is not None and item[0]() is df:
+            return item[1]
+        indice = IndiceFiltros(df)
+        _indices[chave] = (weakref.ref(df), indice)
+    weakref.finalize(df, _indices.pop, chave, None)
+    return indice
+
+def _montar(df, indice, posicoes):
+    """DataFrame das posições resolvidas pelo índice (que passa a saber a ordenação herdada)"""
+    if posicoes is None:
+        return df.copy(deep=False)
+    resultado = df.iloc[posicoes] if isinstance(posicoes, slice) else df.take(posicoes)
+    obter_indice(resultado).herdar_ordenacao(indice, posicoes)
+    return resultado
+
+def filtrar(df, selecoes, col_data=None, data_inicio=None, data_fim=None):
+    """
+    Aplica o filtro com o índice do DataFrame e monta o resultado com um único take.
+
+    Returns:
+        DataFrame: linhas filtradas (cópia rasa do df se nenhum filtro se aplica)
+    """
+    indice = obter_indice(df)
+    return _montar(df, indice, indice.posicoes(selecoes, col_data, data_inicio, data_fim))
+
+def facetas(df, colunas, selecoes, col_data=None, data_inicio=None, data_fim=None, col_valor=None):
+    """Facetas do DataFrame pelo seu índice de filtros (ver IndiceFiltros.facetas)"""
+    return obter_indice(df).facetas(colunas, selecoes, col_data, data_inicio, data_fim, col_valor)
+
+def fatiar_periodo(df, col_data, data_inicio=None, data_fim=None):
+    """
+    Recorta o DataFrame a um período (limites inclusivos).
+
+    Com a coluna de data em ordem crescente o recorte é uma fatia achada por busca binária;
+    fora disso cai na comparação da coluna inteira.
+
+    Args:
+        df: DataFrame
+        col_data: coluna de data
+        data_inicio, data_fim: limites do período (opcionais)
+
+    Returns:
+        DataFrame: linhas do período
+    """
+    if df.empty:
+        return df
+    return filtrar(df, {}, col_data, data_inicio, data_fim)
+
+# ==============================
+# CACHE DE RESULTADOS ENTRE SESSÕES
+# ==============================
+def assinatura_filtro(selecoes, col_data=None, data_inicio=None, data_fim=None):
+    """
+    Forma canônica de um filtro: a ordem das colunas e dos valores não importa,
+    seleções vazias são descartadas e as datas viram texto ISO.
+
+    Returns:
+        str: assinatura usada como chave do cache
+    """
+    canonico = {
+        'selecoes': {
+            str(coluna): sorted({str(valor) for valor in valores})
+            for coluna, valores in selecoes.items() if valores
+        },
+        'periodo': None if col_data is None or (data_inicio is None and data_fim is None) else [
+            str(col_data),
+            None if data_inicio is None else pd.Timestamp(data_inicio).isoformat(),
+            None if data_fim is None else pd.Timestamp(data_fim).isoformat(),
+        ],
+    }
+    return json.dumps(canonico, sort_keys=True, ensure_ascii=False)
+
+class CacheResultados:
+    """
+    Resultados de filtro compartilhados entre as sessões do processo.
+
+    Cada entrada guarda as posições das linhas e o DataFrame montado: quem pede a mesma visão
+    recebe o mesmo objeto, com o mesmo índice de filtros, mesmo que nenhuma sessão o segure entre
+    uma execução e outra (as sessões guardam só o handle). O custo de uma entrada é o das posições
+    mais o das linhas copiadas pelo take (recortes contíguos são fatias sem cópia); ao estourar o
+    orçamento, as entradas usadas há mais tempo são descartadas.
+    """
+
+    def __init__(self, orcamento_bytes=ORCAMENTO_CACHE_BYTES):
+        self.orcamento_bytes = orcamento_bytes
+        self.bytes_usados = 0
+        self.acertos = 0
+        self.faltas = 0
+        self.descartes = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _custo(df, posicoes):
+        if not isinstance(posicoes, np.ndarray) or len(df) == 0:
+            return 0
+        bytes_por_linha = df.memory_usage(index=True, deep=False).sum() / len(df)
+        return posicoes.nbytes + int(len(posicoes) * bytes_por_linha)
+
+    def obter(self, df, prefixo, selecoes, col_data=None, data_inicio=None, data_fim=None, base=None):
+        """
+        Filtra o DataFrame reaproveitando o resultado de outra sessão com a mesma chave.
+
+        Args:
+            df: DataFrame de origem (o mesmo objeto para todas as sessões da versão)
+            prefixo: parte da chave que identifica a origem, ex. (versão do dataset, tabela)
+            selecoes, col_data, data_inicio, data_fim, base: filtro, como em IndiceFiltros.posicoes
+                (quem passa uma base deve identificá-la no prefixo)
+
+        Returns:
+            DataFrame: linhas filtradas
+        """
+        chave = (prefixo, assinatura_filtro(selecoes, col_data, data_inicio, data_fim))
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada['origem']() is not df:
+                # Mesma chave para outro DataFrame (ex.: dataset recarregado): a entrada não vale mais
+                self._remover(chave)
+                entrada = None
+            if entrada is None:
+                self.faltas += 1
+            else:
+                self.acertos += 1
+                self._entradas.move_to_end(chave)
+                return entrada['resultado']
+
+        indice = obter_indice(df)
+        posicoes = indice.posicoes(selecoes, col_data, data_inicio, data_fim, base)
+        resultado = _montar(df, indice, posicoes)
+        custo = self._custo(df, posicoes)
+
+        with self._lock:
+            if chave in self._entradas:
+                # Outra sessão montou a mesma visão enquanto esta calculava: fica a que já estava
+                self._entradas.move_to_end(chave)
+                return self._entradas[chave]['resultado']
+            self._entradas[chave] = {
+                'origem': weakref.ref(df),
+                'posicoes': posicoes,
+                'resultado': resultado,
+                'custo': custo,
+            }
+            self.bytes_usados += custo
+            # Visões de DataFrames que já saíram do registro (versão antiga) não serão mais pedidas
+            for antiga in [c for c, e in self._entradas.items() if e['origem']() is None]:
+                self._remover(antiga)
+            while self.bytes_usados > self.orcamento_bytes and len(self._entradas) > 1:
+                self._remover(next(iter(self._entradas)))
+                self.descartes += 1
+        return resultado
+
+    def _remover(self, chave):
+        entrada = self._entradas.pop(chave)
+        self.bytes_usados -= entrada['custo']
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.bytes_usados = 0
+
+    def estatisticas(self):
+        """Contadores do cache: entradas, memória usada e acertos/faltas desde o início do processo"""
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                'entradas': len(self._entradas),
+                'bytes_usados': self.bytes_usados,
+                'orcamento_bytes': self.orcamento_bytes,
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+                'descartes': self.descartes,
+                'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+            }
+
+_cache_resultados = CacheResultados()
+
+def obter_cache_resultados():
+    """Cache de resultados do processo (único para todas as sessões do Streamlit)"""
+    return _cache_resultados
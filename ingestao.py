@@ -0,0 +1,913 @@
+"""
+Ingestão de planilhas: Excel em streaming, CSV/Parquet/Feather via pyarrow e tipagem comum
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows não possui o módulo resource
+    resource = None
+
+TAMANHO_BLOCO_PADRAO = 50_000
+TAMANHO_BLOCO_JOB = 20_000  # blocos menores no worker para o progresso andar com mais frequência
+
+# ==============================
+# MEDIÇÃO DE DESEMPENHO
+# ==============================
+def _pico_memoria_mb():
+    """Retorna o pico de memória residente do processo em MB (ou None se indisponível)"""
+    if resource is None:
+        return None
+    # No Linux ru_maxrss vem em KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _montar_estatisticas(total_linhas, inicio, df, tipos, invalidos, motor):
+    """Monta o dicionário de estatísticas de throughput da leitura"""
+    duracao = max(time.perf_counter() - inicio, 1e-9)
+    pico = _pico_memoria_mb()
+    return {
+        'linhas': total_linhas,
+        'segundos': round(duracao, 3),
+        'linhas_por_segundo': round(total_linhas / duracao, 1),
+        'pico_mb': round(pico, 1) if pico is not None else None,
+        'memoria_df_mb': round(float(df.memory_usage(deep=True).sum()) / 1024 ** 2, 1),
+        'tipos': tipos,
+        'valores_invalidos': invalidos,
+        'motor': motor,
+    }
+
+# ==============================
+# INFERÊNCIA E CONVERSÃO DE TIPOS
+# ==============================
+def _normalizar_cabecalho(cabecalho):
+    """Replica os nomes de coluna que o pandas geraria (Unnamed: N, duplicadas .1, .2...)"""
+    nomes = []
+    vistos = {}
+    for i, nome in enumerate(cabecalho):
+        nome = f"Unnamed: {i}" if nome is None or str(nome).strip() == '' else str(nome)
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+def _inferir_tipo(valores):
+    """
+    Infere o tipo de uma coluna a partir das células nativas do openpyxl.
+
+    Regra conservadora: só vira 'data' se todas as células preenchidas forem datas,
+    e só vira 'numero' se todas forem numéricas e ao menos uma tiver casas decimais.
+    Colunas inteiras (códigos, pedidos) continuam texto, como no read_excel(dtype=str).
+    """
+    preenchidos = [v for v in valores if v is not None and v != '']
+    if not preenchidos:
+        return 'texto'
+    if all(isinstance(v, (datetime, date)) for v in preenchidos):
+        return 'data'
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in preenchidos):
+        if any(isinstance(v, float) and not v.is_integer() for v in preenchidos):
+            return 'numero'
+    return 'texto'
+
+def _celula_para_texto(valor):
+    """Converte uma célula para texto do mesmo jeito que read_excel(dtype=str)"""
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+def _converter_coluna(valores, tipo):
+    """
+    Converte a lista de valores de um bloco para o tipo final.
+
+    Returns:
+        tuple: (array/Series convertida, quantidade de valores não convertidos)
+    """
+    if tipo == 'data':
+        serie = pd.to_datetime(pd.Series(valores, dtype=object), errors='coerce')
+        invalidos = int(serie.isna().sum()) - sum(v is None or v == '' for v in valores)
+        return serie.to_numpy(), max(invalidos, 0)
+    if tipo == 'numero':
+        serie = pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce')
+        invalidos = int(serie.isna().sum()) - sum(v is None or v == '' for v in valores)
+        return serie.to_numpy(dtype='float64'), max(invalidos, 0)
+    return np.array([_celula_para_texto(v) for v in valores], dtype=object), 0
+
+# ==============================
+# LEITURA EM STREAMING
+# ==============================
+def _eh_xlsx(arquivo):
+    """Verifica pela assinatura ZIP se o arquivo é um .xlsx (o .xls antigo não é suportado pelo openpyxl)"""
+    posicao = arquivo.tell() if hasattr(arquivo, 'tell') else 0
+    assinatura = arquivo.read(4)
+    arquivo.seek(posicao)
+    return assinatura[:2] == b'PK'
+
+def ler_planilha(arquivo, tipos=None, tamanho_bloco=TAMANHO_BLOCO_PADRAO, aba=None, progresso=None,
+                 max_linhas=None):
+    """
+    Lê uma planilha Excel em streaming, tipando as colunas bloco a bloco.
+
+    Usa o openpyxl em modo somente leitura, então a planilha nunca é carregada
+    inteira em memória e as células não passam por string antes da conversão.
+
+    Args:
+        arquivo: caminho ou objeto file-like (ex: UploadedFile do Streamlit)
+        tipos: dict opcional {coluna: 'data' | 'numero' | 'texto'}; colunas ausentes
+               são inferidas pelo primeiro bloco
+        tamanho_bloco: quantidade de linhas convertidas por vez
+        aba: nome da aba (padrão: primeira aba)
+        progresso: função opcional chamada a cada bloco com (linhas lidas, total estimado ou None)
+        max_linhas: para a leitura após essa quantidade de linhas (amostra)
+
+    Returns:
+        tuple: (DataFrame tipado, dict com estatísticas de leitura)
+    """
+    inicio = time.perf_counter()
+    tipos = dict(tipos or {})
+
+    if hasattr(arquivo, 'seek'):
+        arquivo.seek(0)
+        if not _eh_xlsx(arquivo):
+            # Formato .xls: sem streaming disponível, mantém o caminho antigo
+            df = pd.read_excel(arquivo, dtype=str, nrows=max_linhas)
+            tipos_finais = {col: 'texto' for col in df.columns}
+            if progresso is not None:
+                progresso(len(df), len(df))
+            return df, _montar_estatisticas(len(df), inicio, df, tipos_finais, {}, 'xlrd')
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        ws = wb[aba] if aba else wb.worksheets[0]
+        linhas = ws.iter_rows(values_only=True)
+
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return pd.DataFrame(), _montar_estatisticas(0, inicio, pd.DataFrame(), {}, {}, 'openpyxl')
+        colunas = _normalizar_cabecalho(cabecalho)
+        n_colunas = len(colunas)
+        # Dimensão declarada na planilha (pode faltar em arquivos gerados por outros sistemas)
+        total_estimado = ws.max_row - 1 if ws.max_row else None
+
+        blocos = {col: [] for col in colunas}
+        invalidos = {col: 0 for col in colunas}
+        total_linhas = 0
+
+        while max_linhas is None or total_linhas < max_linhas:
+            tamanho = tamanho_bloco if max_linhas is None else min(tamanho_bloco, max_linhas - total_linhas)
+            brutas = list(islice(linhas, tamanho))
+            if not brutas:
+                break
+            bloco = [linha for linha in brutas if any(v is not None and v != '' for v in linha)]
+            del brutas
+            if not bloco:
+                continue
+
+            # Completa linhas curtas (openpyxl omite células vazias no final)
+            bloco = [tuple(linha) + (None,) * (n_colunas - len(linha)) if len(linha) < n_colunas else linha[:n_colunas]
+                     for linha in bloco]
+            valores_por_coluna = list(zip(*bloco))
+
+            for col, valores in zip(colunas, valores_por_coluna):
+                if col not in tipos:
+                    tipos[col] = _inferir_tipo(valores)
+                convertido, n_invalidos = _converter_coluna(valores, tipos[col])
+                blocos[col].append(convertido)
+                invalidos[col] += n_invalidos
+
+            total_linhas += len(bloco)
+            del bloco, valores_por_coluna
+            if progresso is not None:
+                progresso(total_linhas, total_estimado)
+    finally:
+        wb.close()
+
+    dados = {}
+    for col in colunas:
+        tipo = tipos.get(col, 'texto')
+        if not blocos[col]:
+            dados[col] = pd.Series([], dtype=object)
+        elif tipo == 'data':
+            dados[col] = pd.Series(np.concatenate(blocos[col]), dtype='datetime64[ns]')
+        elif tipo == 'numero':
+            dados[col] = pd.Series(np.concatenate(blocos[col]), dtype='float64')
+        else:
+            dados[col] = pd.Series(np.concatenate(blocos[col]), dtype=object)
+        blocos[col] = None  # liberar os blocos à medida que as colunas são montadas
+
+    df = pd.DataFrame(dados)
+    tipos_finais = {col: tipos.get(col, 'texto') for col in colunas}
+    invalidos = {col: n for col, n in invalidos.items() if n}
+    estatisticas = _montar_estatisticas(total_linhas, inicio, df, tipos_finais, invalidos, 'openpyxl')
+    estatisticas['linhas_estimadas'] = total_estimado
+    return df, estatisticas
+
+# ==============================
+# CSV, PARQUET E FEATHER
+# ==============================
+EXTENSOES_PLANILHA = ('xlsx', 'xls')
+EXTENSOES_CSV = ('csv', 'txt')
+EXTENSOES_PARQUET = ('parquet',)
+EXTENSOES_FEATHER = ('feather', 'arrow')
+EXTENSOES_SUPORTADAS = EXTENSOES_PLANILHA + EXTENSOES_CSV + EXTENSOES_PARQUET + EXTENSOES_FEATHER
+
+FORMATOS_DATA = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M']
+TAMANHO_AMOSTRA_TIPO = 1_000
+_REGEX_INTEIRO = r'^-?\d+$'
+_REGEX_DECIMAL_PONTO = r'^-?(\d*\.\d+|\d+(\.\d+)?[eE][-+]?\d+)$'
+_REGEX_DECIMAL_VIRGULA = r'^-?(\d{1,3}(\.\d{3})*|\d+),\d+([eE][-+]?\d+)?$'
+_REGEX_MILHAR_PONTO = r'^-?\d{1,3}(\.\d{3})+$'
+_REGEX_MILHAR_VIRGULA = r'^-?\d{1,3}(,\d{3})+(\.\d+)?$'
+
+def _extensao(nome):
+    return str(nome).rsplit('.', 1)[-1].lower() if '.' in str(nome) else ''
+
+def _ler_bytes(arquivo):
+    if hasattr(arquivo, 'getvalue'):
+        return arquivo.getvalue()
+    if hasattr(arquivo, 'read'):
+        arquivo.seek(0)
+        return arquivo.read()
+    with open(arquivo, 'rb') as f:
+        return f.read()
+
+def _detectar_csv(amostra):
+    """Detecta codificação e separador pelo início do arquivo (exports do ERP costumam vir em latin-1 com ';')"""
+    try:
+        texto = amostra.decode('utf-8')
+        codificacao = 'utf8'
+    except UnicodeDecodeError as e:
+        # A amostra pode ter cortado um caractere multibyte no final
+        if e.start >= len(amostra) - 3:
+            texto = amostra[:e.start].decode('utf-8')
+            codificacao = 'utf8'
+        else:
+            texto = amostra.decode('latin-1')
+            codificacao = 'latin1'
+    primeira_linha = texto.lstrip('\ufeff').splitlines()[0] if texto.strip() else ''
+    separador = max([';', ',', '\t', '|'], key=primeira_linha.count)
+    return codificacao, separador, primeira_linha
+
+def _tipar_texto(coluna, separador):
+    """
+    Infere o tipo de uma coluna lida como texto, com a mesma regra conservadora do Excel:
+    'data' se todos os valores forem datas, 'numero' se todos forem numéricos com
+    alguma casa decimal; inteiros (códigos, pedidos) continuam texto.
+    
+    Returns:
+        tuple: (array Arrow convertido, tipo)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    
+    coluna = pc.utf8_trim_whitespace(coluna)
+    coluna = pc.if_else(pc.equal(coluna, ''), pa.scalar(None, pa.string()), coluna)
+    preenchidos = len(coluna) - coluna.null_count
+    if preenchidos == 0:
+        return coluna, 'texto'
+    # O tipo é escolhido numa amostra e só então confirmado na coluna inteira
+    amostra = coluna.drop_null().slice(0, TAMANHO_AMOSTRA_TIPO)
+    
+    def todos(valores, *regexes):
+        casam = pc.match_substring_regex(valores, regexes[0])
+        for regex in regexes[1:]:
+            casam = pc.or_(casam, pc.match_substring_regex(valores, regex))
+        return pc.sum(casam).as_py() == len(valores) - valores.null_count
+    
+    for formato in FORMATOS_DATA:
+        if pc.strptime(amostra, format=formato, unit='s', error_is_null=True).null_count:
+            continue
+        datas = pc.strptime(coluna, format=formato, unit='s', error_is_null=True)
+        if datas.null_count == coluna.null_count:
+            return datas, 'data'
+    
+    if todos(amostra, _REGEX_INTEIRO) and todos(coluna, _REGEX_INTEIRO):
+        return coluna, 'texto'
+    if separador == ';' and todos(amostra, _REGEX_DECIMAL_VIRGULA, _REGEX_INTEIRO) \
+            and todos(coluna, _REGEX_DECIMAL_VIRGULA, _REGEX_INTEIRO):
+        # Formato brasileiro: 1.234,56
+        normalizada = pc.replace_substring(pc.replace_substring(coluna, '.', ''), ',', '.')
+        return pc.cast(normalizada, pa.float64()), 'numero'
+    if todos(amostra, _REGEX_DECIMAL_PONTO, _REGEX_INTEIRO) and todos(coluna, _REGEX_DECIMAL_PONTO, _REGEX_INTEIRO):
+        return pc.cast(coluna, pa.float64()), 'numero'
+    return coluna, 'texto'
+
+def _tabela_para_pandas(tabela):
+    """
+    Converte uma tabela Arrow já tipada (Parquet/Feather) para o formato da ingestão:
+    datas sem fuso, números float64 e inteiros/demais tipos como texto.
+    
+    Returns:
+        tuple: (DataFrame, dict {coluna: tipo})
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    
+    tipos = {}
+    colunas = []
+    for nome, coluna in zip(tabela.column_names, tabela.columns):
+        tipo = coluna.type
+        if pa.types.is_dictionary(tipo):
+            coluna = coluna.cast(tipo.value_type)
+            tipo = tipo.value_type
+        if pa.types.is_timestamp(tipo) or pa.types.is_date(tipo):
+            if pa.types.is_timestamp(tipo) and tipo.tz is not None:
+                coluna = pc.local_timestamp(coluna)
+            coluna = coluna.cast(pa.timestamp('ns'))
+            tipos[nome] = 'data'
+        elif pa.types.is_floating(tipo) or pa.types.is_decimal(tipo):
+            coluna = coluna.cast(pa.float64())
+            tipos[nome] = 'numero'
+        else:
+            coluna = coluna.cast(pa.string())
+            tipos[nome] = 'texto'
+        colunas.append(coluna)
+    
+    df = pa.table(colunas, names=tabela.column_names).to_pandas()
+    return df, tipos
+
+def ler_csv(arquivo, max_linhas=None):
+    """
+    Lê um CSV com o leitor multithread do pyarrow.
+    
+    Todas as colunas entram como texto (preserva zeros à esquerda de códigos) e
+    depois são tipadas de forma vetorizada pela mesma regra do Excel. Separador
+    (';', ',', tab ou '|') e codificação (UTF-8 ou latin-1) são detectados.
+    
+    Args:
+        arquivo: caminho ou objeto file-like
+        max_linhas: lê só as primeiras linhas (amostra); o total é estimado pelo tamanho do arquivo
+    
+    Returns:
+        tuple: (DataFrame tipado, dict com estatísticas de leitura)
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    
+    inicio = time.perf_counter()
+    conteudo = _ler_bytes(arquivo)
+    codificacao, separador, primeira_linha = _detectar_csv(conteudo[:64 * 1024])
+    if not primeira_linha:
+        return pd.DataFrame(), _montar_estatisticas(0, inicio, pd.DataFrame(), {}, {}, 'pyarrow.csv')
+    
+    import csv
+    cabecalho = next(csv.reader([primeira_linha], delimiter=separador))
+    colunas = _normalizar_cabecalho(cabecalho)
+    
+    tamanho_total = tamanho_lido = len(conteudo)
+    if max_linhas is not None:
+        # Corta o conteúdo na (max_linhas + 1)-ésima quebra de linha
+        fim = -1
+        for _ in range(max_linhas + 1):
+            fim = conteudo.find(b'\n', fim + 1)
+            if fim == -1:
+                break
+        if fim != -1:
+            conteudo = conteudo[:fim + 1]
+            tamanho_lido = fim + 1
+    
+    tabela = pv.read_csv(
+        pa.BufferReader(conteudo),
+        read_options=pv.ReadOptions(use_threads=True, encoding=codificacao, column_names=colunas, skip_rows=1),
+        parse_options=pv.ParseOptions(delimiter=separador),
+        convert_options=pv.ConvertOptions(column_types={col: pa.string() for col in colunas},
+                                          strings_can_be_null=True)
+    )
+    del conteudo
+    
+    tipos = {}
+    convertidas = []
+    for nome, coluna in zip(colunas, tabela.columns):
+        coluna = coluna.combine_chunks()
+        convertida, tipos[nome] = _tipar_texto(coluna, separador)
+        convertidas.append(convertida)
+    tabela = pa.table(convertidas, names=colunas)
+    
+    df, _ = _tabela_para_pandas(tabela)
+    estatisticas = _montar_estatisticas(len(df), inicio, df, tipos, {}, 'pyarrow.csv')
+    estatisticas['linhas_estimadas'] = len(df)
+    if max_linhas is not None and len(df) >= max_linhas:
+        estatisticas['linhas_estimadas'] = int(tamanho_total / tamanho_lido * len(df))
+    return df, estatisticas
+
+def ler_parquet_ou_feather(arquivo, formato, max_linhas=None):
+    """
+    Lê um arquivo Parquet ou Feather (já tipado na origem) e normaliza os tipos.
+    
+    Returns:
+        tuple: (DataFrame tipado, dict com estatísticas de leitura)
+    """
+    import pyarrow as pa
+    
+    inicio = time.perf_counter()
+    fonte = pa.BufferReader(_ler_bytes(arquivo))
+    if formato == 'parquet':
+        import pyarrow.parquet as pq
+        if max_linhas is not None:
+            arquivo_pq = pq.ParquetFile(fonte)
+            total = arquivo_pq.metadata.num_rows
+            lote = next(arquivo_pq.iter_batches(batch_size=max_linhas), None)
+            tabela = pa.Table.from_batches([lote]) if lote is not None else arquivo_pq.schema_arrow.empty_table()
+        else:
+            tabela = pq.read_table(fonte, use_threads=True)
+            total = tabela.num_rows
+    else:
+        import pyarrow.ipc as ipc
+        leitor = ipc.open_file(fonte)
+        tabela = leitor.read_all()
+        total = tabela.num_rows
+        if max_linhas is not None:
+            tabela = tabela.slice(0, max_linhas)
+    
+    tabela = tabela.rename_columns(_normalizar_cabecalho(tabela.column_names))
+    df, tipos = _tabela_para_pandas(tabela)
+    estatisticas = _montar_estatisticas(len(df), inicio, df, tipos, {}, f'pyarrow.{formato}')
+    estatisticas['linhas_estimadas'] = total
+    return df, estatisticas
+
+def ler_arquivo(arquivo, nome_arquivo=None, progresso=None, **kwargs):
+    """
+    Lê o arquivo enviado escolhendo o leitor pela extensão (Excel, CSV, Parquet ou Feather).
+    
+    Args:
+        arquivo: caminho ou objeto file-like (ex: UploadedFile do Streamlit)
+        nome_arquivo: nome original, usado para a extensão quando arquivo não tem .name
+        progresso: função opcional (linhas lidas, total estimado ou None)
+        **kwargs: max_linhas (amostra, vale para todos os formatos) e demais opções do ler_planilha (Excel)
+    
+    Returns:
+        tuple: (DataFrame tipado, dict com estatísticas de leitura)
+    """
+    extensao = _extensao(nome_arquivo or getattr(arquivo, 'name', None) or arquivo)
+    max_linhas = kwargs.pop('max_linhas', None)
+    if extensao in EXTENSOES_CSV:
+        df, estatisticas = ler_csv(arquivo, max_linhas=max_linhas)
+    elif extensao in EXTENSOES_PARQUET + EXTENSOES_FEATHER:
+        formato = 'parquet' if extensao in EXTENSOES_PARQUET else 'feather'
+        df, estatisticas = ler_parquet_ou_feather(arquivo, formato, max_linhas=max_linhas)
+    else:
+        return ler_planilha(arquivo, progresso=progresso, max_linhas=max_linhas, **kwargs)
+    
+    if progresso is not None:
+        progresso(len(df), len(df))
+    return df, estatisticas
+
+# ==============================
+# AMOSTRA PARA MAPEAMENTO
+# ==============================
+LINHAS_AMOSTRA = 200
+AMOSTRAS_MANTIDAS = 4
+_amostras = {}
+_amostras_lock = threading.Lock()
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+def ler_amostra(conteudo, nome_arquivo, linhas=LINHAS_AMOSTRA):
+    """
+    Lê só o cabeçalho e as primeiras linhas do arquivo, para o mapeamento de colunas
+    e a pré-visualização. A leitura completa fica para o job de ingestão.
+    
+    O resultado fica em cache pelo hash do conteúdo, então os reruns do Streamlit
+    (cada widget alterado) não leem o arquivo de novo.
+    
+    Args:
+        conteudo: bytes do arquivo enviado
+        nome_arquivo: nome original (define o formato pela extensão)
+        linhas: quantidade de linhas da amostra
+    
+    Returns:
+        tuple: (DataFrame da amostra, dict com estatísticas, incluindo 'linhas_estimadas' e 'hash')
+    """
+    chave = (hash_conteudo(conteudo), linhas)
+    with _amostras_lock:
+        if chave in _amostras:
+            df, estatisticas = _amostras[chave]
+            return df.copy(deep=False), dict(estatisticas)
+    
+    df, estatisticas = ler_arquivo(io.BytesIO(conteudo), nome_arquivo, max_linhas=linhas)
+    estatisticas['hash'] = chave[0]
+    with _amostras_lock:
+        _amostras[chave] = (df, estatisticas)
+        while len(_amostras) > AMOSTRAS_MANTIDAS:
+            del _amostras[next(iter(_amostras))]
+    return df.copy(deep=False), dict(estatisticas)
+
+# ==============================
+# MAPEAMENTOS SALVOS
+# ==============================
+MAPEAMENTOS_JSON = "mapeamentos_colunas.json"
+_mapeamentos_lock = threading.Lock()
+
+def assinatura_schema(colunas):
+    """Assinatura do layout do arquivo: hash dos nomes de coluna ordenados"""
+    return hashlib.sha256(json.dumps(sorted(str(c) for c in colunas)).encode()).hexdigest()[:16]
+
+def _ler_mapeamentos(diretorio):
+    try:
+        with open(Path(diretorio) / MAPEAMENTOS_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def obter_mapeamento(diretorio, colunas):
+    """
+    Mapeamento de colunas salvo para o layout do arquivo.
+    
+    Returns:
+        dict: config de colunas (sem data_hora_upload) ou None se o layout for novo
+    """
+    registro = _ler_mapeamentos(diretorio).get(assinatura_schema(colunas))
+    if registro is None:
+        return None
+    # Confere se as colunas mapeadas continuam existindo no arquivo
+    mapeadas = [v for k, v in registro['config'].items() if k.startswith('col_') and v and v != 'Nenhuma']
+    if any(col not in colunas for col in mapeadas):
+        return None
+    return dict(registro['config'])
+
+def salvar_mapeamento(diretorio, colunas, config):
+    """Guarda o mapeamento de colunas usado com sucesso para este layout de arquivo"""
+    from dados import _escrever_json_atomico
+    
+    with _mapeamentos_lock:
+        mapeamentos = _ler_mapeamentos(diretorio)
+        mapeamentos[assinatura_schema(colunas)] = {
+            'colunas': sorted(str(c) for c in colunas),
+            'config': {k: v for k, v in config.items() if k != 'data_hora_upload'},
+            'atualizado_em': datetime.now().isoformat()
+        }
+        _escrever_json_atomico(Path(diretorio) / MAPEAMENTOS_JSON, mapeamentos)
+
+# ==============================
+# PREPARAÇÃO DOS DADOS
+# ==============================
+def _coluna_mapeada(config, chave):
+    col = config.get(chave)
+    return col if col and col != 'Nenhuma' else None
+
+def _para_numero(serie):
+    """
+    pd.to_numeric que também entende texto no formato brasileiro (1.234,56) ou com milhar
+    em vírgula (1,234.56).
+    
+    O separador decimal é decidido uma vez para a coluna inteira, pela maioria dos valores
+    que só cabem num dos formatos: numa coluna brasileira "1.234" é mil duzentos e trinta e
+    quatro. Valores fora do formato escolhido ficam NaN (contados como números inválidos).
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie
+    texto = serie.astype('string').str.strip()
+    
+    def casa(*regexes):
+        casam = texto.str.fullmatch(regexes[0])
+        for regex in regexes[1:]:
+            casam = casam | texto.str.fullmatch(regex)
+        return casam.fillna(False).astype(bool)
+    
+    virgula = casa(_REGEX_DECIMAL_VIRGULA)
+    ponto = casa(_REGEX_DECIMAL_PONTO, _REGEX_MILHAR_VIRGULA)
+    if virgula.sum() > ponto.sum():
+        # Formato brasileiro: ponto só como milhar
+        convertiveis = virgula | casa(_REGEX_MILHAR_PONTO)
+        normalizado = texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    else:
+        convertiveis = casa(_REGEX_MILHAR_VIRGULA)
+        normalizado = texto.str.replace(',', '', regex=False)
+    texto = texto.where(~convertiveis, normalizado)
+    return pd.to_numeric(texto, errors='coerce').astype('float64')
+
+def _para_data(serie):
+    """pd.to_datetime; texto é lido com o dia primeiro (dd/mm/aaaa)"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    return pd.to_datetime(serie, errors='coerce', dayfirst=True)
+
+def preparar_upload(df_upload, config, diagnostico=None):
+    """
+    Aplica o mapeamento de colunas à planilha lida: tipagem, mês comercial,
+    pedido único, dimensões categóricas e separação entre vendas e devoluções.
+    
+    Args:
+        df_upload: DataFrame lido da planilha
+        config: dicionário de configuração de colunas
+        diagnostico: dict opcional preenchido com 'datas_invalidas' e 'numeros_invalidos'
+                     (valores preenchidos que não puderam ser convertidos)
+    
+    Returns:
+        tuple: (df_vendas, df_devolucoes, lista de avisos)
+    
+    Raises:
+        ValueError: se não sobrar nenhuma linha válida ou nenhuma venda
+    """
+    from utils import calcular_meses_comerciais
+    from dados import codificar_dimensoes
+    
+    avisos = []
+    diagnostico = diagnostico if diagnostico is not None else {}
+    diagnostico['numeros_invalidos'] = {}
+    col_data = config['col_data']
+    
+    # Converter data APENAS na coluna selecionada
+    df_upload[col_data] = _para_data(df_upload[col_data])
+    diagnostico['datas_invalidas'] = int(df_upload[col_data].isna().sum())
+    
+    # Converter valor, quantidade e toneladas para numérico
+    for chave in ('col_valor', 'col_quantidade', 'col_toneladas'):
+        col = _coluna_mapeada(config, chave)
+        if col:
+            preenchidos = int(df_upload[col].notna().sum())
+            df_upload[col] = _para_numero(df_upload[col])
+            invalidos = preenchidos - int(df_upload[col].notna().sum())
+            if invalidos:
+                diagnostico['numeros_invalidos'][col] = invalidos
+    
+    # Remover linhas com datas inválidas
+    linhas_antes = len(df_upload)
+    df_upload = df_upload.dropna(subset=[col_data])
+    if linhas_antes > len(df_upload):
+        avisos.append(f"⚠️ {linhas_antes - len(df_upload)} linhas com datas inválidas foram removidas")
+    if df_upload.empty:
+        raise ValueError("Nenhuma linha válida após processar as datas!")
+    
+    # Calcular mês comercial (vetorizado) e a chave inteira para ordenação/particionamento
+    chaves_mes, rotulos_mes = calcular_meses_comerciais(df_upload[col_data])
+    df_upload['Mes_Comercial'] = rotulos_mes.astype(str)
+    df_upload['Mes_Comercial_Chave'] = chaves_mes
+    
+    # Criar pedido único
+    col_pedido = _coluna_mapeada(config, 'col_pedido')
+    if col_pedido:
+        df_upload['Pedido_Unico'] = df_upload[col_pedido].astype(str) + "_" + df_upload[config['col_codCliente']].astype(str)
+    else:
+        df_upload['Pedido_Unico'] = df_upload.index.astype(str)
+    
+    # Dimensões como categóricas antes da separação: vendas e devoluções
+    # compartilham as mesmas categorias
+    codificar_dimensoes(df_upload, config)
+    
+    # Separar vendas e devoluções
+    col_tipo_movimento = _coluna_mapeada(config, 'col_tipo_movimento')
+    if col_tipo_movimento:
+        # Aceitar diferentes formatos: VEN/DEV ou Venda/Devolução
+        tipos = df_upload[col_tipo_movimento].astype(str)
+        valores_unicos = tipos.unique()
+        avisos.append(f"📋 Tipos encontrados: {', '.join([str(v) for v in valores_unicos])}")
+        
+        if any('VEN' in str(v).upper() for v in valores_unicos):
+            df_vendas = df_upload[tipos.str.upper().str.contains('VEN', na=False)].copy()
+            df_devolucoes = df_upload[tipos.str.upper().str.contains('DEV', na=False)].copy()
+        else:
+            df_vendas = df_upload[tipos.str.contains('Venda', case=False, na=False)].copy()
+            df_devolucoes = df_upload[tipos.str.contains('Devol', case=False, na=False)].copy()
+    else:
+        # Se não tem coluna de tipo, considerar tudo como venda
+        df_vendas = df_upload
+        df_devolucoes = pd.DataFrame()
+    
+    if df_vendas.empty:
+        raise ValueError("Nenhuma venda encontrada na planilha! Verifique se a coluna 'Tipo Movimento' contém 'VEN' ou 'Venda'")
+    
+    return df_vendas, df_devolucoes, avisos
+
+# ==============================
+# PERFIL DE QUALIDADE
+# ==============================
+NIVEIS_HIERARQUIA = ['diretor', 'gerente_regional', 'gerente', 'supervisor', 'coordenador', 'consultor', 'vendedor']
+EXEMPLOS_MAXIMOS = 20
+
+def _contagem_por_mes(df):
+    from dados import COLUNA_PARTICAO
+    if df is None or df.empty or COLUNA_PARTICAO not in df.columns:
+        return {}
+    contagem = df[COLUNA_PARTICAO].value_counts(sort=False).sort_index()
+    return {str(int(chave)): int(n) for chave, n in contagem.items()}
+
+def perfilar_qualidade(df_vendas, df_devolucoes, config, diagnostico=None, hierarquias=None):
+    """
+    Perfil de qualidade da carga, calculado com operações vetorizadas sobre os dados já tipados.
+    
+    Args:
+        df_vendas: DataFrame de vendas preparado
+        df_devolucoes: DataFrame de devoluções preparado (pode ser vazio)
+        config: dicionário de configuração de colunas
+        diagnostico: dict preenchido pelo preparar_upload (datas e números inválidos)
+        hierarquias: lista de hierarquias dos usuários ({'nivel', 'valor'}), para achar
+                     atribuições que não existem nos dados
+    
+    Returns:
+        dict: perfil serializável em JSON (gravado como qualidade.json no snapshot)
+    """
+    diagnostico = diagnostico or {}
+    df_devolucoes = df_devolucoes if df_devolucoes is not None else pd.DataFrame()
+    mapeadas = {chave: col for chave, col in config.items()
+                if chave.startswith('col_') and col and col != 'Nenhuma'}
+    
+    # Nulos nas colunas mapeadas (vendas + devoluções)
+    nulos = {}
+    for col in dict.fromkeys(mapeadas.values()):
+        n = sum(int(df[col].isna().sum()) for df in (df_vendas, df_devolucoes) if col in df.columns)
+        if n:
+            nulos[col] = n
+    
+    # Chaves (pedido, cliente, produto) repetidas nas vendas
+    chave_duplicados = [mapeadas.get('col_pedido'), mapeadas.get('col_codCliente') or mapeadas.get('col_cliente'),
+                        mapeadas.get('col_produto')]
+    duplicados = None
+    if all(col and col in df_vendas.columns for col in chave_duplicados):
+        duplicados = {'chave': chave_duplicados,
+                      'linhas': int(df_vendas.duplicated(subset=chave_duplicados).sum())}
+    
+    # Valores negativos lançados como venda
+    negativos = None
+    col_valor = mapeadas.get('col_valor')
+    if col_valor in df_vendas.columns:
+        mascara = df_vendas[col_valor] < 0
+        negativos = {'linhas': int(mascara.sum()), 'valor': float(df_vendas.loc[mascara, col_valor].sum())}
+    
+    # Hierarquia: linhas sem responsável e atribuições de usuários que não aparecem nos dados
+    hierarquia = {}
+    atribuicoes = {}
+    for h in hierarquias or []:
+        if h and h.get('nivel'):
+            valores = h.get('valor')
+            atribuicoes.setdefault(h['nivel'], set()).update(valores if isinstance(valores, list) else [valores])
+    for nivel in NIVEIS_HIERARQUIA:
+        col = mapeadas.get(f'col_{nivel}')
+        if not col or col not in df_vendas.columns:
+            continue
+        serie = df_vendas[col]
+        presentes = set(serie.cat.categories if isinstance(serie.dtype, pd.CategoricalDtype) else serie.dropna().unique())
+        desconhecidos = sorted(str(v) for v in atribuicoes.get(nivel, set()) if v not in presentes)
+        hierarquia[nivel] = {
+            'coluna': col,
+            'linhas_sem_valor': int(serie.isna().sum()),
+            'valores_distintos': len(presentes),
+            'atribuicoes_sem_dados': desconhecidos[:EXEMPLOS_MAXIMOS],
+            'total_atribuicoes_sem_dados': len(desconhecidos)
+        }
+    
+    return {
+        'gerado_em': datetime.now().isoformat(),
+        'linhas': {'vendas': len(df_vendas), 'devolucoes': len(df_devolucoes)},
+        'datas_invalidas': diagnostico.get('datas_invalidas', 0),
+        'numeros_invalidos': diagnostico.get('numeros_invalidos', {}),
+        'nulos': nulos,
+        'duplicados': duplicados,
+        'vendas_negativas': negativos,
+        'hierarquia': hierarquia,
+        'linhas_por_mes': {'vendas': _contagem_por_mes(df_vendas), 'devolucoes': _contagem_por_mes(df_devolucoes)}
+    }
+
+# ==============================
+# INGESTÃO EM SEGUNDO PLANO
+# ==============================
+# Um worker só: cargas são serializadas e não disputam CPU entre si com as sessões
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestao")
+_jobs = {}
+_jobs_lock = threading.Lock()
+JOBS_MANTIDOS = 20
+
+def _atualizar_job(job_id, **campos):
+    with _jobs_lock:
+        _jobs[job_id].update(campos)
+
+def _executar_ingestao(job_id, diretorio, conteudo, nome_arquivo, config, incremental, chave, hierarquias):
+    """Lê, prepara e publica a planilha; roda na thread do worker"""
+    from dados import gravar_snapshot, mesclar_snapshot, obter_registro, QUALIDADE_JSON
+    
+    inicio = time.perf_counter()
+    _atualizar_job(job_id, status='executando', etapa='Lendo planilha', iniciado_em=datetime.now())
+    
+    def progresso(linhas, total):
+        decorrido = time.perf_counter() - inicio
+        eta = None
+        if total and linhas and total > linhas:
+            eta = (total - linhas) * decorrido / linhas
+        _atualizar_job(job_id, linhas_processadas=linhas, linhas_estimadas=total, eta_segundos=eta)
+    
+    try:
+        df_upload, estatisticas = ler_arquivo(io.BytesIO(conteudo), nome_arquivo, tamanho_bloco=TAMANHO_BLOCO_JOB,
+                                               progresso=progresso)
+        colunas_arquivo = list(df_upload.columns)
+        _atualizar_job(job_id, etapa='Preparando dados', estatisticas=estatisticas,
+                       linhas_processadas=len(df_upload), linhas_estimadas=len(df_upload), eta_segundos=None)
+        
+        diagnostico = {}
+        df_vendas, df_devolucoes, avisos = preparar_upload(df_upload, config, diagnostico)
+        del df_upload
+        _atualizar_job(job_id, etapa='Verificando qualidade', avisos=avisos)
+        qualidade = perfilar_qualidade(df_vendas, df_devolucoes, config, diagnostico, hierarquias)
+        qualidade['arquivo'] = nome_arquivo
+        qualidade['modo'] = 'incremental' if incremental else 'completo'
+        
+        _atualizar_job(job_id, etapa='Publicando nova versão')
+        anexos = {QUALIDADE_JSON: qualidade}
+        if incremental:
+            manifesto = mesclar_snapshot(diretorio, df_vendas, df_devolucoes, config, chave=chave, anexos=anexos)
+        else:
+            manifesto = gravar_snapshot(diretorio, df_vendas, df_devolucoes, config, anexos=anexos)
+        # Todas as sessões passam a ver a nova versão; a carga, as fatias de hierarquia dos
+        # usuários, o cubo de agregados e os esboços de distintos ficam prontos aqui, antes do primeiro acesso
+        obter_registro(diretorio).invalidar()
+        _atualizar_job(job_id, etapa='Preparando acessos')
+        obter_registro(diretorio).preparar_fatias_hierarquia(hierarquias or [])
+        obter_registro(diretorio).esbocos_distintos()
+        # Próximos arquivos com o mesmo layout já entram com este mapeamento
+        salvar_mapeamento(diretorio, colunas_arquivo, config)
+        
+        col_data = config['col_data']
+        _atualizar_job(
+            job_id, status='concluido', etapa='Concluído', finalizado_em=datetime.now(),
+            resultado={
+                'vendas': len(df_vendas),
+                'devolucoes': len(df_devolucoes),
+                'data_min': df_vendas[col_data].min(),
+                'data_max': df_vendas[col_data].max(),
+                'meses_alterados': manifesto.get('meses_alterados')
+            }
+        )
+    except Exception as e:
+        _atualizar_job(job_id, status='falhou', etapa='Falhou', finalizado_em=datetime.now(),
+                       erro=str(e), detalhes=traceback.format_exc())
+
+def iniciar_ingestao(diretorio, conteudo, nome_arquivo, config, incremental=False, chave=None, automatico=False,
+                     hierarquias=None):
+    """
+    Enfileira a ingestão de uma planilha no worker em segundo plano.
+    
+    O job sobrevive à navegação do admin e à queda da conexão; ao terminar,
+    publica uma nova versão do dataset de forma atômica.
+    
+    Args:
+        diretorio: diretório base de dados (ex: data/)
+        conteudo: bytes do arquivo enviado
+        nome_arquivo: nome original do arquivo (exibição)
+        config: dicionário de configuração de colunas
+        incremental: mescla com os dados atuais em vez de substituir
+        chave: colunas da chave de upsert na carga incremental (None = por mês)
+        automatico: job iniciado sozinho com o mapeamento salvo do layout
+        hierarquias: hierarquias dos usuários, usadas no perfil de qualidade e nas fatias de hierarquia
+    
+    Returns:
+        str: id do job
+    """
+    job_id = uuid.uuid4().hex[:12]
+    with _jobs_lock:
+        _jobs[job_id] = {
+            'id': job_id,
+            'arquivo': nome_arquivo,
+            'status': 'na_fila',
+            'etapa': 'Na fila',
+            'incremental': incremental,
+            'automatico': automatico,
+            'criado_em': datetime.now(),
+            'iniciado_em': None,
+            'finalizado_em': None,
+            'linhas_processadas': 0,
+            'linhas_estimadas': None,
+            'eta_segundos': None,
+            'avisos': [],
+            'resultado': None,
+            'erro': None,
+        }
+        # Manter só o histórico recente
+        finalizados = [j for j in _jobs.values() if j['status'] in ('concluido', 'falhou')]
+        for job in sorted(finalizados, key=lambda j: j['criado_em'])[:-JOBS_MANTIDOS]:
+            del _jobs[job['id']]
+    _executor.submit(_executar_ingestao, job_id, diretorio, conteudo, nome_arquivo, config, incremental, chave,
+                     hierarquias)
+    return job_id
+
+def obter_job(job_id):
+    """Cópia do estado atual de um job (None se não existir)"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+def listar_jobs():
+    """Cópias de todos os jobs, do mais recente para o mais antigo"""
+    with _jobs_lock:
+        return sorted((dict(j) for j in _jobs.values()), key=lambda j: j['criado_em'], reverse=True)
+
+def job_ativo():
+    """Job na fila ou em execução, se houver"""
+    return next((j for j in listar_jobs() if j['status'] in ('na_fila', 'executando')), None)
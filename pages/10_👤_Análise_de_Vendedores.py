@@ -3,7 +3,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import sys
 sys.path.append('/workspaces/realh')
-from utils import formatar_moeda, ordenar_mes_comercial, obter_periodo_mes_comercial, exibir_logo, exibir_top_com_alternancia, safe_strftime
+from utils import formatar_moeda, ordenar_mes_comercial, obter_periodo_mes_comercial, FilterSpec, exibir_logo, exibir_top_com_alternancia, safe_strftime, formatar_contagem, ajuda_contagem
 
 st.set_page_config(page_title="Análise de Vendedores", page_icon="👤", layout="wide")
 
@@ -12,15 +12,19 @@ exibir_logo()
 st.title("👤 Análise de Vendedores")
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+spec = FilterSpec(dados)
+
+# Pegar as visões da sessão
+df_vendas = spec.vendas()
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = spec.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 col_vendedor = st.session_state['col_vendedor']
@@ -43,16 +47,9 @@ if meses_comerciais_disponiveis:
     # Aplicar filtro de mês (sobre os dados já filtrados pelos filtros globais)
     if mes_selecionado != 'Todos os Meses':
         data_inicio, data_fim = obter_periodo_mes_comercial(mes_selecionado)
-        df_vendas = df_vendas[
-            (df_vendas[st.session_state['col_data']] >= data_inicio) & 
-            (df_vendas[st.session_state['col_data']] <= data_fim)
-        ].copy()
-        
-        if not df_devolucoes.empty:
-            df_devolucoes = df_devolucoes[
-                (df_devolucoes[st.session_state['col_data']] >= data_inicio) & 
-                (df_devolucoes[st.session_state['col_data']] <= data_fim)
-            ].copy()
+        spec = spec.com_mes_comercial(mes_selecionado)
+        df_vendas = spec.vendas()
+        df_devolucoes = spec.devolucoes()
         
         st.sidebar.info(f"📅 {safe_strftime(data_inicio)} a {safe_strftime(data_fim)}")
     else:
@@ -61,33 +58,8 @@ if meses_comerciais_disponiveis:
 # ==============================
 # PROCESSAR DADOS POR VENDEDOR
 # ==============================
-vendas_por_vendedor = df_vendas.groupby(col_vendedor)[st.session_state['col_valor']].sum().sort_values(ascending=False)
-
-if not df_devolucoes.empty and col_vendedor in df_devolucoes.columns:
-    devolucoes_por_vendedor = df_devolucoes.groupby(col_vendedor)[st.session_state['col_valor']].sum()
-else:
-    devolucoes_por_vendedor = pd.Series(dtype=float)
-
-# Calcular quantidade e toneladas por vendedor
-quantidade_por_vendedor = pd.Series(dtype=float)
-toneladas_por_vendedor = pd.Series(dtype=float)
-
-if col_quantidade != 'Nenhuma' and col_quantidade in df_vendas.columns:
-    quantidade_por_vendedor = df_vendas.groupby(col_vendedor)[col_quantidade].sum()
-
-if col_toneladas != 'Nenhuma' and col_toneladas in df_vendas.columns:
-    toneladas_por_vendedor = df_vendas.groupby(col_vendedor)[col_toneladas].sum()
-
-df_vendedores_analise = pd.DataFrame({
-    'Vendas': vendas_por_vendedor,
-    'Devoluções': devolucoes_por_vendedor,
-    'Quantidade': quantidade_por_vendedor,
-    'Toneladas': toneladas_por_vendedor
-}).fillna(0)
-
-df_vendedores_analise['Líquido'] = df_vendedores_analise['Vendas'] - df_vendedores_analise['Devoluções']
-df_vendedores_analise['Taxa Dev. (%)'] = (df_vendedores_analise['Devoluções'] / df_vendedores_analise['Vendas'] * 100).fillna(0)
-df_vendedores_analise = df_vendedores_analise.sort_values('Vendas', ascending=False)
+df_vendedores_analise = spec.resumo_entidades(col_vendedor)
+vendas_por_vendedor = df_vendedores_analise['Vendas']
 
 # ==============================
 # ABAS DE ANÁLISE
@@ -216,7 +188,11 @@ with tab_detalhes:
     vendedor_selecionado = st.selectbox("Selecione um vendedor:", df_vendedores_analise.index.tolist())
     
     if vendedor_selecionado:
-        df_vendedor_sel = df_vendas[df_vendas[col_vendedor] == vendedor_selecionado]
+        spec_vendedor_sel = spec.com_entidade(col_vendedor, vendedor_selecionado)
+        df_vendedor_sel = spec_vendedor_sel.vendas()
+        # Exata: entra no ticket médio
+        pedidos_vendedor = spec_vendedor_sel.distintos('pedidos', modo='exato')
+        clientes_vendedor = spec_vendedor_sel.distintos('clientes')
         row_vendedor = df_vendedores_analise.loc[vendedor_selecionado]
         
         # KPIs do vendedor
@@ -237,11 +213,11 @@ with tab_detalhes:
         # Métricas adicionais
         col_a, col_b, col_c, col_d = st.columns(4)
         
-        col_a.metric("📦 Pedidos", df_vendedor_sel['Pedido_Unico'].nunique())
-        col_b.metric("👥 Clientes Atendidos", df_vendedor_sel[st.session_state['col_codCliente']].nunique())
+        col_a.metric("📦 Pedidos", pedidos_vendedor)
+        col_b.metric("👥 Clientes Atendidos", formatar_contagem(clientes_vendedor), help=ajuda_contagem(clientes_vendedor))
         col_c.metric("🛍️ Produtos Vendidos", df_vendedor_sel[st.session_state['col_produto']].nunique())
         
-        ticket_medio = row_vendedor['Vendas'] / df_vendedor_sel['Pedido_Unico'].nunique() if df_vendedor_sel['Pedido_Unico'].nunique() > 0 else 0
+        ticket_medio = row_vendedor['Vendas'] / pedidos_vendedor if pedidos_vendedor > 0 else 0
         col_d.metric("🎯 Ticket Médio", formatar_moeda(ticket_medio))
         
         # Quantidade e Toneladas
@@ -258,13 +234,13 @@ with tab_detalhes:
         
         with col_top1:
             st.markdown("##### 👥 Top 5 Clientes")
-            top_clientes = df_vendedor_sel.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_clientes = df_vendedor_sel.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (cliente, valor) in enumerate(top_clientes.items(), 1):
                 st.write(f"{idx}. **{cliente}**: {formatar_moeda(valor)}")
         
         with col_top2:
             st.markdown("##### 🛍️ Top 5 Produtos")
-            top_produtos = df_vendedor_sel.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_produtos = df_vendedor_sel.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (produto, valor) in enumerate(top_produtos.items(), 1):
                 st.write(f"{idx}. **{produto}**: {formatar_moeda(valor)}")
         
@@ -275,7 +251,7 @@ with tab_detalhes:
         if col_linha != 'Nenhuma' and col_linha in df_vendedor_sel.columns:
             st.markdown("##### 🏢 Distribuição por Linha")
             
-            vendas_linha = df_vendedor_sel.groupby(col_linha)[st.session_state['col_valor']].sum().sort_values(ascending=False)
+            vendas_linha = df_vendedor_sel.groupby(col_linha, observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False)
             
             col_pizza1, col_pizza2 = st.columns(2)
             
@@ -298,12 +274,12 @@ with tab_detalhes:
                 # Top produtos por quantidade/toneladas
                 if col_quantidade != 'Nenhuma' and col_quantidade in df_vendedor_sel.columns:
                     st.markdown("##### 📦 Top 5 Produtos por Quantidade")
-                    top_qtde = df_vendedor_sel.groupby(st.session_state['col_produto'])[col_quantidade].sum().sort_values(ascending=False).head(5)
+                    top_qtde = df_vendedor_sel.groupby(st.session_state['col_produto'], observed=True)[col_quantidade].sum().sort_values(ascending=False).head(5)
                     for idx, (produto, qtde) in enumerate(top_qtde.items(), 1):
                         st.write(f"{idx}. **{produto}**: {qtde:,.0f} un")
                 elif col_toneladas != 'Nenhuma' and col_toneladas in df_vendedor_sel.columns:
                     st.markdown("##### ⚖️ Top 5 Produtos por Toneladas")
-                    top_ton = df_vendedor_sel.groupby(st.session_state['col_produto'])[col_toneladas].sum().sort_values(ascending=False).head(5)
+                    top_ton = df_vendedor_sel.groupby(st.session_state['col_produto'], observed=True)[col_toneladas].sum().sort_values(ascending=False).head(5)
                     for idx, (produto, ton) in enumerate(top_ton.items(), 1):
                         st.write(f"{idx}. **{produto}**: {ton:,.2f} Tn")
 
@@ -317,11 +293,12 @@ with tab_evolucao:
     vendedor_evolucao = st.selectbox("Selecione um vendedor:", df_vendedores_analise.index.tolist(), key="vendedor_evolucao")
     
     if vendedor_evolucao:
-        df_vendedor_evolucao = df_vendas_original[df_vendas_original[col_vendedor] == vendedor_evolucao]
+        spec_vendedor_evolucao = FilterSpec(dados, filtrada=False).com_entidade(col_vendedor, vendedor_evolucao)
+        df_vendedor_evolucao = spec_vendedor_evolucao.vendas()
         
         # Gráfico de Evolução de Vendas
         st.markdown("#### 💰 Evolução do Valor de Vendas")
-        vendas_por_mes = df_vendedor_evolucao.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        vendas_por_mes = spec_vendedor_evolucao.agregar('Mes_Comercial', [st.session_state['col_valor']])
         vendas_por_mes['Ordem'] = vendas_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_por_mes = vendas_por_mes.sort_values('Ordem')
         
@@ -350,7 +327,7 @@ with tab_evolucao:
         # Gráfico de Evolução de Quantidade
         if col_quantidade != 'Nenhuma' and col_quantidade in df_vendedor_evolucao.columns:
             st.markdown("#### 📦 Evolução da Quantidade")
-            qtde_por_mes = df_vendedor_evolucao.groupby('Mes_Comercial')[col_quantidade].sum().reset_index()
+            qtde_por_mes = spec_vendedor_evolucao.agregar('Mes_Comercial', [col_quantidade])
             qtde_por_mes['Ordem'] = qtde_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
             qtde_por_mes = qtde_por_mes.sort_values('Ordem')
             
@@ -379,7 +356,7 @@ with tab_evolucao:
         # Gráfico de Evolução de Toneladas
         if col_toneladas != 'Nenhuma' and col_toneladas in df_vendedor_evolucao.columns:
             st.markdown("#### ⚖️ Evolução das Toneladas")
-            ton_por_mes = df_vendedor_evolucao.groupby('Mes_Comercial')[col_toneladas].sum().reset_index()
+            ton_por_mes = spec_vendedor_evolucao.agregar('Mes_Comercial', [col_toneladas])
             ton_por_mes['Ordem'] = ton_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
             ton_por_mes = ton_por_mes.sort_values('Ordem')
             
@@ -410,7 +387,7 @@ with tab_evolucao:
         # Métricas por mês
         st.markdown("#### 📊 Métricas Mensais")
         
-        metricas_mensais = df_vendedor_evolucao.groupby('Mes_Comercial').agg({
+        metricas_mensais = df_vendedor_evolucao.groupby('Mes_Comercial', observed=True).agg({
             st.session_state['col_valor']: 'sum',
             'Pedido_Unico': 'nunique',
             st.session_state['col_codCliente']: 'nunique',
@@ -435,9 +412,9 @@ with tab_evolucao:
         st.markdown("---")
         st.markdown("#### 🛍️ Top 5 Produtos - Evolução")
         
-        top_produtos_evolucao = df_vendedor_evolucao.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5).index.tolist()
+        top_produtos_evolucao = df_vendedor_evolucao.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5).index.tolist()
         
-        vendas_produtos_mes = df_vendedor_evolucao[df_vendedor_evolucao[st.session_state['col_produto']].isin(top_produtos_evolucao)].groupby(['Mes_Comercial', st.session_state['col_produto']])[st.session_state['col_valor']].sum().reset_index()
+        vendas_produtos_mes = df_vendedor_evolucao[df_vendedor_evolucao[st.session_state['col_produto']].isin(top_produtos_evolucao)].groupby(['Mes_Comercial', st.session_state['col_produto']], observed=True)[st.session_state['col_valor']].sum().reset_index()
         vendas_produtos_mes['Ordem'] = vendas_produtos_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_produtos_mes = vendas_produtos_mes.sort_values('Ordem')
         
@@ -674,8 +651,8 @@ with tab_comparativo:
             col_vendedor = st.session_state.get('col_vendedor', 'Vendedor')
             st.write("**Coluna vendedor esperada:**", col_vendedor)
         
-        if 'df_vendas' in st.session_state and not st.session_state.df_vendas.empty:
-            df_temporal = st.session_state.df_vendas.copy()
+        df_temporal = dados.vendas()
+        if not df_temporal.empty:
             
             # Usar a coluna de vendedor da sessão
             col_vendedor = st.session_state.get('col_vendedor', 'Vendedor')
@@ -683,14 +660,14 @@ with tab_comparativo:
             # Verificar se a coluna existe
             if col_vendedor in df_temporal.columns:
                 # Filtrar apenas vendedores selecionados
-                df_temporal_filt = df_temporal[df_temporal[col_vendedor].isin(vendedores_selecionados)]
+                df_temporal_filt = FilterSpec(dados).com_entidade(col_vendedor, vendedores_selecionados).vendas()
                 
                 if not df_temporal_filt.empty:
                     # Verificar se a coluna Mes_Comercial existe
                     col_mes = 'Mes_Comercial' if 'Mes_Comercial' in df_temporal_filt.columns else st.session_state.get('col_data', 'Data')
                     
                     # Agrupar por mês comercial e vendedor
-                    df_evolucao = df_temporal_filt.groupby([col_mes, col_vendedor]).agg({
+                    df_evolucao = df_temporal_filt.groupby([col_mes, col_vendedor], observed=True).agg({
                         st.session_state['col_valor']: 'sum'
                     }).reset_index()
                     
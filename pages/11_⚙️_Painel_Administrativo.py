@@ -3,8 +3,11 @@ import pandas as pd
 import sys
 sys.path.append('/workspaces/realh')
 from auth import (list_users, add_user, update_user, delete_user, 
-                  save_vendas_data, load_vendas_data)
-from utils import calcular_mes_comercial, exibir_logo, safe_strftime
+                  load_vendas_data, DATA_DIR)
+from utils import exibir_logo, safe_strftime, valores_unicos_ordenados
+from dados import ler_anexo, resumo_dataset, QUALIDADE_JSON
+from indices import obter_cache_resultados
+from ingestao import ler_amostra, obter_mapeamento, EXTENSOES_SUPORTADAS, iniciar_ingestao, obter_job, job_ativo
 
 st.set_page_config(
     page_title="Painel Admin - Real H",
@@ -26,6 +29,144 @@ exibir_logo()
 st.title("⚙️ Painel Administrativo")
 st.markdown("---")
 
+# ==========================================
+# ACOMPANHAMENTO DA CARGA EM SEGUNDO PLANO
+# ==========================================
+ICONES_JOB = {'na_fila': '🕒', 'executando': '⏳', 'concluido': '✅', 'falhou': '❌'}
+
+JOB_EM_ANDAMENTO = ('na_fila', 'executando')
+
+def exibir_job_ingestao(job_id):
+    """Mostra a carga: com atualização automática enquanto o job roda, estática depois que termina"""
+    job = obter_job(job_id)
+    if job is None:
+        return
+    if job['status'] in JOB_EM_ANDAMENTO:
+        acompanhar_job_ingestao(job_id)
+    else:
+        exibir_resultado_job(job)
+
+def _cabecalho_job(job):
+    origem = " com o mapeamento salvo" if job.get('automatico') else ""
+    st.markdown(f"**{ICONES_JOB[job['status']]} Carga de `{job['arquivo']}`{origem}** — {job['etapa']}")
+
+@st.fragment(run_every=2)
+def acompanhar_job_ingestao(job_id):
+    """Progresso do job, relido a cada 2s só enquanto ele está na fila ou executando"""
+    job = obter_job(job_id)
+    if job is None:
+        return
+    if job['status'] not in JOB_EM_ANDAMENTO:
+        # Terminou: a página inteira roda de novo, já com a nova versão dos dados e sem o timer
+        st.rerun(scope="app")
+    
+    _cabecalho_job(job)
+    processadas = job['linhas_processadas']
+    estimadas = job['linhas_estimadas']
+    st.progress(min(processadas / estimadas, 1.0) if estimadas else 0.0)
+    detalhe = f"{processadas:,} linhas processadas"
+    if estimadas:
+        detalhe += f" de ~{estimadas:,}"
+    if job['eta_segundos'] is not None:
+        detalhe += f" • restante estimado: {job['eta_segundos']:.0f}s"
+    st.caption(detalhe)
+
+def exibir_resultado_job(job):
+    """Resultado de um job que já terminou (concluído ou com falha)"""
+    _cabecalho_job(job)
+    if job['status'] == 'concluido':
+        resultado = job['resultado']
+        col_a, col_b, col_c = st.columns(3)
+        with col_a:
+            st.metric("📊 Vendas", f"{resultado['vendas']:,}")
+        with col_b:
+            st.metric("↩️ Devoluções", f"{resultado['devolucoes']:,}")
+        with col_c:
+            st.metric("📅 Período", f"{safe_strftime(resultado['data_min'], '%m/%Y')} - {safe_strftime(resultado['data_max'], '%m/%Y')}")
+        if resultado['meses_alterados']:
+            from utils import rotulo_mes_comercial
+            st.info("🔁 Meses regravados: " + ", ".join(rotulo_mes_comercial(m) for m in resultado['meses_alterados']))
+        estatisticas = job.get('estatisticas')
+        if estatisticas:
+            st.caption(f"⚡ {estatisticas['linhas_por_segundo']:,.0f} linhas/s na leitura")
+    else:
+        st.error(f"❌ Erro ao processar dados: {job['erro']}")
+        with st.expander("🔍 Ver detalhes do erro"):
+            st.code(job.get('detalhes', ''))
+        st.info("💡 Verifique se as colunas selecionadas estão corretas")
+    
+    for aviso in job['avisos']:
+        st.caption(aviso)
+    
+    # Comemorar uma vez por job
+    if st.session_state.get('job_ingestao_exibido') != job['id']:
+        st.session_state['job_ingestao_exibido'] = job['id']
+        if job['status'] == 'concluido':
+            st.balloons()
+
+# ==========================================
+# QUALIDADE DA ÚLTIMA CARGA
+# ==========================================
+def exibir_qualidade(qualidade):
+    """Mostra o perfil de qualidade gravado junto do snapshot (qualidade.json)"""
+    st.subheader("🩺 Qualidade da Última Carga")
+    if not qualidade:
+        st.caption("Sem perfil de qualidade: os dados atuais foram carregados antes desta verificação existir.")
+        return
+    
+    st.caption(f"Arquivo `{qualidade.get('arquivo', '-')}` • carga {qualidade.get('modo', '-')} • "
+               f"{qualidade['linhas']['vendas']:,} vendas e {qualidade['linhas']['devolucoes']:,} devoluções")
+    
+    duplicados = qualidade.get('duplicados')
+    negativos = qualidade.get('vendas_negativas')
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("📅 Datas inválidas", f"{qualidade['datas_invalidas']:,}")
+    with col2:
+        st.metric("🔢 Números inválidos", f"{sum(qualidade['numeros_invalidos'].values()):,}")
+    with col3:
+        st.metric("👯 Chaves duplicadas", f"{duplicados['linhas']:,}" if duplicados else "N/D",
+                  help="Linhas de venda com o mesmo pedido, cliente e produto" if duplicados
+                  else "Mapeie Pedido e Produto para verificar duplicidades")
+    with col4:
+        st.metric("➖ Vendas negativas", f"{negativos['linhas']:,}" if negativos else "N/D",
+                  help=f"Soma: R$ {negativos['valor']:,.2f}" if negativos else None)
+    
+    # Atribuições de usuários que não existem nos dados: esses usuários não veem nada
+    for nivel, info in qualidade.get('hierarquia', {}).items():
+        if info['total_atribuicoes_sem_dados']:
+            st.warning(f"⚠️ {info['total_atribuicoes_sem_dados']} valor(es) de {nivel} atribuídos a usuários "
+                       f"não aparecem nos dados: {', '.join(info['atribuicoes_sem_dados'])}")
+    
+    with st.expander("🔍 Detalhes da verificação"):
+        if qualidade['nulos']:
+            st.markdown("**Valores vazios por coluna**")
+            st.dataframe(pd.DataFrame(list(qualidade['nulos'].items()), columns=['Coluna', 'Vazios']),
+                         hide_index=True, use_container_width=True)
+        if qualidade['numeros_invalidos']:
+            st.markdown("**Números que não puderam ser lidos**")
+            st.dataframe(pd.DataFrame(list(qualidade['numeros_invalidos'].items()), columns=['Coluna', 'Inválidos']),
+                         hide_index=True, use_container_width=True)
+        if qualidade.get('hierarquia'):
+            st.markdown("**Hierarquia**")
+            st.dataframe(pd.DataFrame([
+                {'Nível': nivel, 'Coluna': info['coluna'], 'Valores distintos': info['valores_distintos'],
+                 'Linhas sem valor': info['linhas_sem_valor'],
+                 'Atribuições sem dados': info['total_atribuicoes_sem_dados']}
+                for nivel, info in qualidade['hierarquia'].items()
+            ]), hide_index=True, use_container_width=True)
+        
+        from utils import rotulo_mes_comercial
+        por_mes = qualidade['linhas_por_mes']
+        meses = sorted(set(por_mes['vendas']) | set(por_mes['devolucoes']), key=int)
+        if meses:
+            st.markdown("**Linhas por mês comercial**")
+            st.dataframe(pd.DataFrame([
+                {'Mês': rotulo_mes_comercial(int(m)), 'Vendas': por_mes['vendas'].get(m, 0),
+                 'Devoluções': por_mes['devolucoes'].get(m, 0)}
+                for m in meses
+            ]), hide_index=True, use_container_width=True)
+
 # Tabs principais
 tab1, tab2, tab3, tab4 = st.tabs(["📤 Upload de Dados", "👥 Gerenciar Usuários", "📊 Status do Sistema", "🔒 Logs de Segurança"])
 
@@ -39,35 +180,101 @@ with tab1:
     Cada usuário verá apenas os dados da sua hierarquia.
     """)
     
+    # Carga em andamento (ou a última enviada nesta sessão)
+    job_sessao = st.session_state.get('job_ingestao')
+    if job_sessao is None and job_ativo() is not None:
+        job_sessao = job_ativo()['id']
+    if job_sessao is not None:
+        exibir_job_ingestao(job_sessao)
+        st.markdown("---")
+    
     # Verificar se já existem dados
-    dados_atuais = load_vendas_data()
-    if dados_atuais[0] is not None:
+    resumo_atual = resumo_dataset(DATA_DIR)
+    if resumo_atual is not None:
         st.success("✅ Já existe uma planilha carregada no sistema")
-        st.info(f"📊 Total de registros: {len(dados_atuais[0]):,}")
+        st.info(f"📊 Total de registros: {resumo_atual['linhas']['vendas']:,}")
         
-        if st.button("🔄 Substituir planilha"):
-            st.session_state['substituir_dados'] = True
+        col_substituir, col_incremental = st.columns(2)
+        with col_substituir:
+            if st.button("🔄 Substituir planilha", use_container_width=True):
+                st.session_state['substituir_dados'] = True
+                st.session_state['modo_upload'] = 'substituir'
+        with col_incremental:
+            if st.button("➕ Atualização incremental", use_container_width=True,
+                         help="Envia só os meses ou pedidos novos/corrigidos; o restante da base é mantido"):
+                st.session_state['substituir_dados'] = True
+                st.session_state['modo_upload'] = 'incremental'
     
-    if dados_atuais[0] is None or st.session_state.get('substituir_dados', False):
+    if resumo_atual is None or st.session_state.get('substituir_dados', False):
+        modo_incremental = resumo_atual is not None and st.session_state.get('modo_upload') == 'incremental'
+        chave_upsert = None
+        if modo_incremental:
+            st.info("➕ **Atualização incremental:** apenas os meses comerciais afetados são regravados")
+            criterio = st.radio(
+                "Como mesclar com os dados atuais?",
+                ["Por mês comercial", "Por pedido + cliente"],
+                horizontal=True,
+                help="Por mês comercial: cada mês presente na planilha substitui o mês inteiro. "
+                     "Por pedido + cliente: pedidos reenviados substituem os antigos e os novos são acrescentados."
+            )
+            if criterio == "Por pedido + cliente":
+                chave_upsert = ['Pedido_Unico']
+        
         uploaded_file = st.file_uploader(
-            "Selecione o arquivo Excel (.xlsx ou .xls)",
-            type=['xlsx', 'xls'],
-            help="A planilha deve conter todas as vendas e a hierarquia completa"
+            "Selecione o arquivo (Excel, CSV, Parquet ou Feather)",
+            type=list(EXTENSOES_SUPORTADAS),
+            help="A planilha deve conter todas as vendas e a hierarquia completa. "
+                 "Exportações em CSV ou Parquet do ERP são processadas bem mais rápido que Excel."
         )
         
         if uploaded_file:
-            with st.spinner("Processando planilha..."):
+            with st.spinner("Lendo cabeçalho do arquivo..."):
                 try:
-                    # Ler planilha SEM conversão automática de tipos
-                    df_upload = pd.read_excel(uploaded_file, dtype=str)
+                    # Só cabeçalho e primeiras linhas: a leitura completa acontece no job, ao salvar.
+                    # A amostra fica guardada por arquivo enviado, então mexer nos campos não relê nada.
+                    id_arquivo = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+                    amostra = st.session_state.get('amostra_upload')
+                    if amostra is None or amostra['id'] != id_arquivo:
+                        df_amostra, stats_amostra = ler_amostra(uploaded_file.getvalue(), uploaded_file.name)
+                        amostra = {'id': id_arquivo, 'df': df_amostra, 'stats': stats_amostra}
+                        st.session_state['amostra_upload'] = amostra
+                    df_upload, stats_leitura = amostra['df'], amostra['stats']
                     
-                    st.success(f"✅ Planilha lida com sucesso! {len(df_upload):,} registros")
+                    linhas_estimadas = stats_leitura.get('linhas_estimadas')
+                    total_txt = f"~{linhas_estimadas:,} registros" if linhas_estimadas else "total calculado ao processar"
+                    st.success(f"✅ Arquivo reconhecido: {len(df_upload.columns)} colunas • {total_txt}")
+                    st.caption(f"⚡ Amostra de {len(df_upload):,} linhas lida em {stats_leitura['segundos']:.2f}s")
                     
                     # Mostrar preview
                     with st.expander("👀 Pré-visualização dos dados"):
                         st.dataframe(df_upload.head(10))
                         st.caption(f"Colunas disponíveis: {', '.join(df_upload.columns.tolist())}")
                     
+                    # Layout já conhecido: a substituição completa começa sozinha com o mapeamento salvo.
+                    # Carga incremental não: ela mescla no que já está salvo, e uma correção depois
+                    # mesclaria de novo por cima da automática em vez de substituí-la.
+                    mapeamento_salvo = obter_mapeamento(DATA_DIR, df_upload.columns) or {}
+                    if mapeamento_salvo and not modo_incremental:
+                        if st.session_state.get('job_automatico') != id_arquivo and job_ativo() is None:
+                            config_auto = dict(mapeamento_salvo)
+                            config_auto['data_hora_upload'] = pd.Timestamp.now().strftime("%d/%m/%Y %H:%M")
+                            st.session_state['job_ingestao'] = iniciar_ingestao(
+                                DATA_DIR, uploaded_file.getvalue(), uploaded_file.name, config_auto,
+                                automatico=True, hierarquias=[u.get('hierarquia') for u in list_users()]
+                            )
+                            st.session_state['job_automatico'] = id_arquivo
+                            st.session_state['config'] = config_auto
+                            st.rerun()
+                        st.info("🧠 Layout de arquivo já conhecido: a carga foi iniciada com o mapeamento salvo. "
+                                "Para corrigir, ajuste os campos abaixo e salve de novo — a nova carga substitui a automática.")
+                    elif mapeamento_salvo:
+                        st.info("🧠 Layout de arquivo já conhecido: os campos abaixo vêm do mapeamento salvo. "
+                                "Confira e salve para mesclar os dados.")
+                    
+                    def padrao(chave, coluna_procurada):
+                        """Coluna do mapeamento salvo, se houver; senão o nome usual"""
+                        return mapeamento_salvo.get(chave, coluna_procurada)
+                    
                     # Campo para data/hora do upload
                     st.subheader("📅 Informações do Upload")
                     data_hora_upload = st.text_input(
@@ -92,6 +299,8 @@ with tab1:
                     
                     def get_col_index_optional(coluna_procurada, colunas_df, opcoes_nomes=[]):
                         """Versão para colunas opcionais (com 'Nenhuma')"""
+                        if coluna_procurada == 'Nenhuma':
+                            return 0
                         todas_opcoes = [coluna_procurada] + opcoes_nomes
                         for nome in todas_opcoes:
                             if nome in colunas_df:
@@ -103,168 +312,99 @@ with tab1:
                     with col1:
                         st.markdown("**Colunas Obrigatórias:**")
                         col_data = st.selectbox("📅 Data", df_upload.columns.tolist(),
-                                               index=get_col_index("Data Emissão", df_upload.columns, ["Data", "Data Emissao", "Dt. Emissão"]))
+                                               index=get_col_index(padrao('col_data', "Data Emissão"), df_upload.columns, ["Data", "Data Emissao", "Dt. Emissão"]))
                         col_cliente = st.selectbox("👤 Cliente", df_upload.columns.tolist(),
-                                                  index=get_col_index("Cliente", df_upload.columns, ["Nome Cliente", "Razão Social"]))
+                                                  index=get_col_index(padrao('col_cliente', "Cliente"), df_upload.columns, ["Nome Cliente", "Razão Social"]))
                         col_codCliente = st.selectbox("🆔 Código Cliente", df_upload.columns.tolist(),
-                                                     index=get_col_index("Cód Cliente", df_upload.columns, ["Cod Cliente", "Código Cliente", "CodCliente"]))
+                                                     index=get_col_index(padrao('col_codCliente', "Cód Cliente"), df_upload.columns, ["Cod Cliente", "Código Cliente", "CodCliente"]))
                         col_produto = st.selectbox("📦 Produto", df_upload.columns.tolist(),
-                                                  index=get_col_index("Produto", df_upload.columns, ["Desc. Produto", "Descrição Produto"]))
+                                                  index=get_col_index(padrao('col_produto', "Produto"), df_upload.columns, ["Desc. Produto", "Descrição Produto"]))
                         col_vendedor = st.selectbox("👔 Vendedor", df_upload.columns.tolist(),
-                                                   index=get_col_index("Vendedor", df_upload.columns, ["Nome Vendedor", "Representante"]))
+                                                   index=get_col_index(padrao('col_vendedor', "Vendedor"), df_upload.columns, ["Nome Vendedor", "Representante"]))
                         col_codVendedor = st.selectbox("🔢 Cód Vendedor", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                      index=get_col_index_optional("Cód Vend", df_upload.columns, ["Cod Vendedor", "Código Vendedor", "CodVendedor"]))
+                                                      index=get_col_index_optional(padrao('col_codVendedor', "Cód Vend"), df_upload.columns, ["Cod Vendedor", "Código Vendedor", "CodVendedor"]))
                         col_valor = st.selectbox("💰 Valor", df_upload.columns.tolist(),
-                                                index=get_col_index("Vlr. Líq. Total", df_upload.columns, ["Valor", "Vlr Liquido", "Valor Liquido Total", "Vlr. Liq. Total"]))
+                                                index=get_col_index(padrao('col_valor', "Vlr. Líq. Total"), df_upload.columns, ["Valor", "Vlr Liquido", "Valor Liquido Total", "Vlr. Liq. Total"]))
                         col_linha = st.selectbox("🏢 Linha", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                index=get_col_index_optional("Linha", df_upload.columns, ["Linha Produto", "Categoria"]))
+                                                index=get_col_index_optional(padrao('col_linha', "Linha"), df_upload.columns, ["Linha Produto", "Categoria"]))
                     
                     with col2:
                         st.markdown("**Hierarquia (Opcional):**")
                         col_diretor = st.selectbox("👨‍💼 Diretor", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                  index=get_col_index_optional("Diretor", df_upload.columns))
+                                                  index=get_col_index_optional(padrao('col_diretor', "Diretor"), df_upload.columns))
                         col_gerente_regional = st.selectbox("🌎 Gerente Regional", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                           index=get_col_index_optional("Ger. Regional", df_upload.columns, ["Gerente Regional", "Ger Regional"]))
+                                                           index=get_col_index_optional(padrao('col_gerente_regional', "Ger. Regional"), df_upload.columns, ["Gerente Regional", "Ger Regional"]))
                         col_gerente = st.selectbox("👔 Gerente", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                  index=get_col_index_optional("Gerente", df_upload.columns))
+                                                  index=get_col_index_optional(padrao('col_gerente', "Gerente"), df_upload.columns))
                         col_supervisor = st.selectbox("📋 Supervisor", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                     index=get_col_index_optional("Supervisor", df_upload.columns))
+                                                     index=get_col_index_optional(padrao('col_supervisor', "Supervisor"), df_upload.columns))
                         col_coordenador = st.selectbox("📊 Coordenador", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                      index=get_col_index_optional("Coordenador", df_upload.columns))
+                                                      index=get_col_index_optional(padrao('col_coordenador', "Coordenador"), df_upload.columns))
                         col_consultor = st.selectbox("💼 Consultor", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                    index=get_col_index_optional("Consultor", df_upload.columns))
+                                                    index=get_col_index_optional(padrao('col_consultor', "Consultor"), df_upload.columns))
                         
                         st.markdown("**Outras Colunas:**")
                         col_quantidade = st.selectbox("📊 Quantidade", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                     index=get_col_index_optional("Qtde", df_upload.columns, ["Quantidade", "Qtd"]))
+                                                     index=get_col_index_optional(padrao('col_quantidade', "Qtde"), df_upload.columns, ["Quantidade", "Qtd"]))
                         col_toneladas = st.selectbox("⚖️ Toneladas", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                    index=get_col_index_optional("Tn", df_upload.columns, ["TN", "Toneladas"]))
+                                                    index=get_col_index_optional(padrao('col_toneladas', "Tn"), df_upload.columns, ["TN", "Toneladas"]))
                         col_regiao = st.selectbox("🗺️ Região", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                 index=get_col_index_optional("Região", df_upload.columns, ["Regiao", "UF", "Estado"]))
+                                                 index=get_col_index_optional(padrao('col_regiao', "Região"), df_upload.columns, ["Regiao", "UF", "Estado"]))
                         col_pedido = st.selectbox("📝 Pedido", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                 index=get_col_index_optional("Pedido", df_upload.columns, ["Nº Pedido", "Numero Pedido", "Nr. Pedido"]))
+                                                 index=get_col_index_optional(padrao('col_pedido', "Pedido"), df_upload.columns, ["Nº Pedido", "Numero Pedido", "Nr. Pedido"]))
                         col_tipo_movimento = st.selectbox("🔄 Tipo Movimento", ['Nenhuma'] + df_upload.columns.tolist(),
-                                                         index=get_col_index_optional("Tipo", df_upload.columns, ["Tipo Movimento", "Tp. Movimento"]))
+                                                         index=get_col_index_optional(padrao('col_tipo_movimento', "Tipo"), df_upload.columns, ["Tipo Movimento", "Tp. Movimento"]))
                     
                     if st.button("💾 Salvar e Processar Dados", type="primary", use_container_width=True):
-                        with st.spinner("Processando e salvando dados..."):
-                            try:
-                                # Converter data APENAS na coluna selecionada
-                                df_upload[col_data] = pd.to_datetime(df_upload[col_data], errors='coerce')
-                                
-                                # Converter valor para numérico
-                                df_upload[col_valor] = pd.to_numeric(df_upload[col_valor], errors='coerce')
-                                
-                                # Converter quantidade e toneladas se existirem
-                                if col_quantidade and col_quantidade != 'Nenhuma':
-                                    df_upload[col_quantidade] = pd.to_numeric(df_upload[col_quantidade], errors='coerce')
-                                
-                                if col_toneladas and col_toneladas != 'Nenhuma':
-                                    df_upload[col_toneladas] = pd.to_numeric(df_upload[col_toneladas], errors='coerce')
-                                
-                                # Remover linhas com datas inválidas
-                                linhas_antes = len(df_upload)
-                                df_upload = df_upload.dropna(subset=[col_data])
-                                linhas_depois = len(df_upload)
-                                
-                                if linhas_antes > linhas_depois:
-                                    st.warning(f"⚠️ {linhas_antes - linhas_depois} linhas com datas inválidas foram removidas")
-                                
-                                if df_upload.empty:
-                                    st.error("❌ Nenhuma linha válida após processar as datas!")
-                                    st.stop()
-                                
-                                # Calcular mês comercial
-                                df_upload['Mes_Comercial'] = df_upload[col_data].apply(calcular_mes_comercial)
-                                
-                                # Criar pedido único
-                                if col_pedido and col_pedido != 'Nenhuma':
-                                    df_upload['Pedido_Unico'] = df_upload[col_pedido].astype(str) + "_" + df_upload[col_codCliente].astype(str)
-                                else:
-                                    df_upload['Pedido_Unico'] = df_upload.index.astype(str)
-                                
-                                # Separar vendas e devoluções
-                                if col_tipo_movimento and col_tipo_movimento != 'Nenhuma':
-                                    # Aceitar diferentes formatos: VEN/DEV ou Venda/Devolução
-                                    valores_unicos = df_upload[col_tipo_movimento].unique()
-                                    st.info(f"📋 Tipos encontrados: {', '.join([str(v) for v in valores_unicos])}")
-                                    
-                                    # Tentar identificar o padrão
-                                    if any('VEN' in str(v).upper() for v in valores_unicos):
-                                        df_vendas = df_upload[df_upload[col_tipo_movimento].str.upper().str.contains('VEN', na=False)].copy()
-                                        df_devolucoes = df_upload[df_upload[col_tipo_movimento].str.upper().str.contains('DEV', na=False)].copy()
-                                    else:
-                                        df_vendas = df_upload[df_upload[col_tipo_movimento].str.contains('Venda', case=False, na=False)].copy()
-                                        df_devolucoes = df_upload[df_upload[col_tipo_movimento].str.contains('Devol', case=False, na=False)].copy()
-                                else:
-                                    # Se não tem coluna de tipo, considerar tudo como venda
-                                    df_vendas = df_upload.copy()
-                                    df_devolucoes = pd.DataFrame()
-                                
-                                # Validar se há vendas
-                                if df_vendas.empty:
-                                    st.error("❌ Nenhuma venda encontrada na planilha!")
-                                    st.info("💡 Verifique se a coluna 'Tipo Movimento' contém 'VEN' ou 'Venda'")
-                                    st.stop()
-                                
-                                # Configuração
-                                config = {
-                                    'col_data': col_data,
-                                    'col_cliente': col_cliente,
-                                    'col_codCliente': col_codCliente,
-                                    'col_produto': col_produto,
-                                    'col_vendedor': col_vendedor,
-                                    'col_codVendedor': col_codVendedor,
-                                    'col_valor': col_valor,
-                                    'col_linha': col_linha,
-                                    'col_quantidade': col_quantidade,
-                                    'col_toneladas': col_toneladas,
-                                    'col_regiao': col_regiao,
-                                    'col_pedido': col_pedido,
-                                    'col_tipo_movimento': col_tipo_movimento,
-                                    'col_diretor': col_diretor,
-                                    'col_gerente_regional': col_gerente_regional,
-                                    'col_gerente': col_gerente,
-                                    'col_supervisor': col_supervisor,
-                                    'col_coordenador': col_coordenador,
-                                    'col_consultor': col_consultor,
-                                    'data_hora_upload': data_hora_upload
-                                }
-                                
-                                # Salvar
-                                save_vendas_data(df_vendas, df_devolucoes, config)
-                                
-                                # Atualizar session_state com o config incluindo data_hora_upload
-                                st.session_state['config'] = config
-                                
-                                st.success("✅ Dados salvos com sucesso!")
-                                
-                                # Mostrar resumo
-                                col_a, col_b, col_c = st.columns(3)
-                                with col_a:
-                                    st.metric("📊 Vendas", f"{len(df_vendas):,}")
-                                with col_b:
-                                    st.metric("↩️ Devoluções", f"{len(df_devolucoes):,}")
-                                with col_c:
-                                    data_min = df_vendas[col_data].min()
-                                    data_max = df_vendas[col_data].max()
-                                    st.metric("📅 Período", f"{safe_strftime(data_min, '%m/%Y')} - {safe_strftime(data_max, '%m/%Y')}")
-                                
-                                st.balloons()
-                                st.session_state['substituir_dados'] = False
-                                st.rerun()
-                                
-                            except Exception as e:
-                                st.error(f"❌ Erro ao processar dados: {str(e)}")
-                                import traceback
-                                with st.expander("🔍 Ver detalhes do erro"):
-                                    st.code(traceback.format_exc())
-                                st.info("💡 Verifique se as colunas selecionadas estão corretas")
-                                st.stop()
+                        if modo_incremental and chave_upsert and (not col_pedido or col_pedido == 'Nenhuma'):
+                            st.error("❌ Para mesclar por pedido é preciso mapear a coluna de Pedido")
+                            st.stop()
+                        # A carga automática (substituição completa) deste mesmo arquivo pode ser sobreposta por
+                        # outra substituição: o job novo entra na fila depois dela e a troca inteira
+                        sobrepoe_automatica = not modo_incremental and st.session_state.get('job_automatico') == id_arquivo
+                        if job_ativo() is not None and not sobrepoe_automatica:
+                            st.warning("⏳ Já existe uma carga em andamento. Aguarde a conclusão para enviar outra.")
+                            st.stop()
+                        
+                        # Configuração
+                        config = {
+                            'col_data': col_data,
+                            'col_cliente': col_cliente,
+                            'col_codCliente': col_codCliente,
+                            'col_produto': col_produto,
+                            'col_vendedor': col_vendedor,
+                            'col_codVendedor': col_codVendedor,
+                            'col_valor': col_valor,
+                            'col_linha': col_linha,
+                            'col_quantidade': col_quantidade,
+                            'col_toneladas': col_toneladas,
+                            'col_regiao': col_regiao,
+                            'col_pedido': col_pedido,
+                            'col_tipo_movimento': col_tipo_movimento,
+                            'col_diretor': col_diretor,
+                            'col_gerente_regional': col_gerente_regional,
+                            'col_gerente': col_gerente,
+                            'col_supervisor': col_supervisor,
+                            'col_coordenador': col_coordenador,
+                            'col_consultor': col_consultor,
+                            'data_hora_upload': data_hora_upload
+                        }
+                        
+                        # Processamento e gravação rodam no worker: sobrevivem à navegação e à queda da conexão
+                        st.session_state['job_ingestao'] = iniciar_ingestao(
+                            DATA_DIR, uploaded_file.getvalue(), uploaded_file.name, config,
+                            incremental=modo_incremental, chave=chave_upsert,
+                            hierarquias=[u.get('hierarquia') for u in list_users()]
+                        )
+                        st.session_state['config'] = config
+                        st.session_state['substituir_dados'] = False
+                        st.session_state.pop('modo_upload', None)
+                        st.session_state.pop('amostra_upload', None)
+                        st.rerun()
                 
                 except Exception as e:
                     st.error(f"❌ Erro ao ler planilha: {str(e)}")
-                    st.info("💡 Verifique se o arquivo é um Excel válido (.xlsx ou .xls)")
+                    st.info("💡 Verifique se o arquivo é um Excel, CSV, Parquet ou Feather válido")
 
 # ==========================================
 # TAB 2: GERENCIAR USUÁRIOS
@@ -443,7 +583,7 @@ with tab2:
                         
                         coluna = nivel_coluna_map.get(edit_nivel)
                         if coluna and coluna in dados[0].columns and coluna != 'Nenhuma':
-                            valores_disponiveis = sorted(dados[0][coluna].dropna().unique().tolist())
+                            valores_disponiveis = valores_unicos_ordenados(dados[0][coluna])
                     
                     # Converter valor atual para lista se for string
                     if isinstance(current_valor, str) and current_valor:
@@ -572,7 +712,7 @@ with tab2:
                     
                     coluna = nivel_coluna_map.get(nivel_hierarquia)
                     if coluna and coluna in dados[0].columns and coluna != 'Nenhuma':
-                        valores_disponiveis = sorted(dados[0][coluna].dropna().unique().tolist())
+                        valores_disponiveis = valores_unicos_ordenados(dados[0][coluna])
                 
                 if valores_disponiveis:
                     # Mostrar lista de valores disponíveis
@@ -640,29 +780,52 @@ with tab2:
 with tab3:
     st.header("📊 Status do Sistema")
     
-    dados = load_vendas_data()
+    # Só metadados (manifesto e rodapés Parquet): nenhuma linha é carregada nesta aba
+    resumo = resumo_dataset(DATA_DIR)
     
-    if dados[0] is not None:
-        df_vendas, df_devolucoes, config = dados
+    if resumo is not None:
+        config = resumo['config']
         
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("📊 Total de Vendas", f"{len(df_vendas):,}")
+            st.metric("📊 Total de Vendas", f"{resumo['linhas']['vendas']:,}")
         
         with col2:
-            st.metric("↩️ Total de Devoluções", f"{len(df_devolucoes):,}")
+            st.metric("↩️ Total de Devoluções", f"{resumo['linhas']['devolucoes']:,}")
         
         with col3:
-            valor_total = df_vendas[config['col_valor']].sum()
+            valor_total = resumo['valor_total']['vendas']
             st.metric("💰 Valor Total", f"R$ {valor_total:,.2f}")
         
         st.markdown("---")
         
         st.subheader("📅 Período dos Dados")
-        data_min = df_vendas[config['col_data']].min()
-        data_max = df_vendas[config['col_data']].max()
+        data_min = pd.to_datetime(resumo['periodo']['data_min'])
+        data_max = pd.to_datetime(resumo['periodo']['data_max'])
         st.info(f"📆 De {safe_strftime(data_min)} até {safe_strftime(data_max)}")
+        if resumo['versao']:
+            st.caption(f"🗂️ Versão {resumo['versao']} • publicada em {safe_strftime(pd.to_datetime(resumo['criado_em']), '%d/%m/%Y %H:%M')} "
+                       f"• {len(resumo['particoes']['vendas'])} meses comerciais")
+        
+        st.markdown("---")
+        
+        exibir_qualidade(ler_anexo(DATA_DIR, QUALIDADE_JSON))
+        
+        st.markdown("---")
+        
+        st.subheader("⚡ Cache de Visões Compartilhadas")
+        cache = obter_cache_resultados().estatisticas()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("🗃️ Visões em cache", cache['entradas'])
+        with col2:
+            st.metric("🎯 Taxa de acerto", f"{cache['taxa_acerto']:.0%}")
+        with col3:
+            st.metric("✅ Acertos / ❌ Faltas", f"{cache['acertos']} / {cache['faltas']}")
+        with col4:
+            st.metric("💾 Memória", f"{cache['bytes_usados'] / 2**20:.1f} MB",
+                      help=f"Orçamento de {cache['orcamento_bytes'] / 2**20:.0f} MB; {cache['descartes']} visões descartadas")
         
         st.markdown("---")
         
@@ -3,7 +3,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import sys
 sys.path.append('/workspaces/realh')
-from utils import formatar_moeda, obter_periodo_mes_comercial, exibir_logo, gerar_relatorio_pptx
+from utils import formatar_moeda, exibir_logo, gerar_relatorio_pptx, FilterSpec
 from utils_template import preencher_template_pptx
 import os
 
@@ -22,15 +22,12 @@ Crie apresentações profissionais em PPTX para:
 """)
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Handle da sessão: o relatório só monta a visão do mês escolhido (ver abaixo)
+dados = st.session_state['dados_sessao']
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 st.markdown("---")
@@ -94,20 +91,11 @@ st.markdown("---")
 # ==============================
 # FILTRAR DADOS DO PERÍODO
 # ==============================
-data_inicio, data_fim = obter_periodo_mes_comercial(mes_relatorio)
-
-df_periodo = df_vendas_original[
-    (df_vendas_original[st.session_state['col_data']] >= data_inicio) & 
-    (df_vendas_original[st.session_state['col_data']] <= data_fim)
-].copy()
-
-if not df_devolucoes_original.empty:
-    df_dev_periodo = df_devolucoes_original[
-        (df_devolucoes_original[st.session_state['col_data']] >= data_inicio) & 
-        (df_devolucoes_original[st.session_state['col_data']] <= data_fim)
-    ].copy()
-else:
-    df_dev_periodo = pd.DataFrame()
+# Só o mês do relatório: a faixa de datas sai por busca binária nas linhas do registro
+# e a hierarquia pela fatia pré-calculada, sem varrer o histórico
+spec_periodo = FilterSpec(dados, filtrada=False).com_mes_comercial(mes_relatorio)
+df_periodo = spec_periodo.vendas()
+df_dev_periodo = spec_periodo.devolucoes()
 
 st.markdown("### 📊 Pré-visualização do Relatório")
 
@@ -115,8 +103,9 @@ st.markdown("### 📊 Pré-visualização do Relatório")
 # CALCULAR MÉTRICAS
 # ==============================
 valor_total = df_periodo[st.session_state['col_valor']].sum()
-clientes_unicos = df_periodo[st.session_state['col_codCliente']].nunique()
-pedidos_unicos = df_periodo['Pedido_Unico'].nunique()
+# Exatas: vão para o PPTX e entram no ticket médio
+clientes_unicos = spec_periodo.distintos('clientes', modo='exato')
+pedidos_unicos = spec_periodo.distintos('pedidos', modo='exato')
 produtos_unicos = df_periodo[st.session_state['col_produto']].nunique()
 vendedores_unicos = df_periodo[st.session_state['col_codVendedor']].nunique()
 ticket_medio = valor_total / pedidos_unicos if pedidos_unicos > 0 else 0
@@ -158,19 +147,19 @@ st.markdown("---")
 tops_dict = {}
 
 if incluir_top_clientes:
-    top_clientes = df_periodo.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).reset_index()
+    top_clientes = df_periodo.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).reset_index()
     top_clientes.columns = ['Cliente', 'Valor']
     top_clientes['Valor'] = top_clientes['Valor'].apply(formatar_moeda)
     tops_dict["👥 Top 10 Clientes"] = top_clientes
 
 if incluir_top_produtos:
-    top_produtos = df_periodo.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).reset_index()
+    top_produtos = df_periodo.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).reset_index()
     top_produtos.columns = ['Produto', 'Valor']
     top_produtos['Valor'] = top_produtos['Valor'].apply(formatar_moeda)
     tops_dict["🛍️ Top 10 Produtos"] = top_produtos
 
 if incluir_top_vendedores:
-    top_vendedores = df_periodo.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).reset_index()
+    top_vendedores = df_periodo.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).reset_index()
     top_vendedores.columns = ['Vendedor', 'Valor']
     top_vendedores['Valor'] = top_vendedores['Valor'].apply(formatar_moeda)
     tops_dict["🧑‍💼 Top 10 Vendedores"] = top_vendedores
@@ -183,7 +172,7 @@ graficos_dict = {}
 if incluir_graficos:
     # Gráfico: Top Clientes
     if incluir_top_clientes:
-        top_clientes_grafico = df_periodo.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10)
+        top_clientes_grafico = df_periodo.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10)
         
         fig_clientes = go.Figure()
         fig_clientes.add_trace(go.Bar(
@@ -209,7 +198,7 @@ if incluir_graficos:
     
     # Gráfico: Top Produtos
     if incluir_top_produtos:
-        top_produtos_grafico = df_periodo.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10)
+        top_produtos_grafico = df_periodo.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10)
         
         fig_produtos = go.Figure()
         fig_produtos.add_trace(go.Bar(
@@ -235,7 +224,7 @@ if incluir_graficos:
     
     # Gráfico: Top Vendedores
     if incluir_top_vendedores:
-        top_vendedores_grafico = df_periodo.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10)
+        top_vendedores_grafico = df_periodo.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10)
         
         fig_vendedores = go.Figure()
         fig_vendedores.add_trace(go.Bar(
@@ -2,8 +2,8 @@ import streamlit as st
 import pandas as pd
 import sys
 sys.path.append('/workspaces/realh')
-from utils import calcular_mes_comercial, obter_periodo_mes_comercial, ordenar_mes_comercial, exibir_logo, exibir_filtros_globais, aplicar_filtros_globais, safe_strftime, check_session_timeout
-from auth import load_vendas_data, apply_hierarchy_filter
+from utils import calcular_mes_comercial, obter_periodo_mes_comercial, ordenar_mes_comercial, exibir_logo, exibir_filtros_globais, DadosSessao, safe_strftime, check_session_timeout
+from auth import load_vendas_data, DATA_DIR
 
 # ==============================
 # CONFIGURAÇÃO DA PÁGINA
@@ -27,7 +27,9 @@ check_session_timeout(30)
 # ==============================
 # CARREGAR DADOS CENTRALIZADOS
 # ==============================
-dados_salvos = load_vendas_data()
+# Os DataFrames do próprio registro (mesmo objeto para todas as sessões), só para conferir se há dados
+# e ler a configuração; nada aqui é copiado para a sessão
+dados_salvos = load_vendas_data(compartilhado=True)
 
 user_name = st.session_state.get('user_data', {}).get('nome', 'Usuário')
 user_type = st.session_state.get('user_data', {}).get('tipo', 'user')
@@ -46,8 +48,8 @@ if dados_salvos[0] is None:
         st.info("📞 Entre em contato com o administrador para carregar os dados.")
     st.stop()
 
-# Carregar e aplicar filtro de hierarquia
-df_vendas_central, df_devolucoes_central, config = dados_salvos
+# Configuração de colunas do dataset
+config = dados_salvos[2]
 
 # Salvar config no session_state ANTES de exibir o logo
 for key, value in config.items():
@@ -74,21 +76,19 @@ if user_hierarchy and user_hierarchy.get('nivel'):
         st.info(f"🔒 Visualizando dados de: **{valores_str}** ({user_hierarchy.get('nivel')})")
     else:
         st.info(f"🔒 Visualizando dados de: **{valor}** ({user_hierarchy.get('nivel')})")
-    
-    df_vendas_filtrado = apply_hierarchy_filter(df_vendas_central, user_hierarchy, config)
-    df_devolucoes_filtrado = apply_hierarchy_filter(df_devolucoes_central, user_hierarchy, config) if not df_devolucoes_central.empty else pd.DataFrame()
-else:
-    df_vendas_filtrado = df_vendas_central.copy()
-    df_devolucoes_filtrado = df_devolucoes_central.copy()
+
+# A sessão guarda só um handle (hierarquia, colunas e filtros), nunca DataFrames: as visões são montadas
+# sob demanda pelo cache compartilhado entre sessões, sobre os DataFrames do registro
+for chave in ('df_vendas', 'df_vendas_original', 'df_devolucoes', 'df_devolucoes_original', 'chave_dados_sessao'):
+    st.session_state.pop(chave, None)
+df_vendas_hierarquia = DadosSessao(DATA_DIR, user_hierarchy, config).vendas(filtrada=False)
 
 # Atualizar session_state
 st.session_state['dados_carregados'] = True
-st.session_state['df_vendas_original'] = df_vendas_filtrado.copy()
-st.session_state['df_devolucoes_original'] = df_devolucoes_filtrado.copy()
 
 # Calcular e salvar meses comerciais disponíveis
-if 'Mes_Comercial' in df_vendas_filtrado.columns:
-    meses_comerciais = df_vendas_filtrado['Mes_Comercial'].dropna().unique()
+if 'Mes_Comercial' in df_vendas_hierarquia.columns:
+    meses_comerciais = df_vendas_hierarquia['Mes_Comercial'].dropna().unique()
     meses_comerciais_ordenados = sorted(meses_comerciais, key=ordenar_mes_comercial, reverse=True)
     st.session_state['meses_comerciais_disponiveis'] = meses_comerciais_ordenados
 else:
@@ -100,24 +100,7 @@ st.success("✅ Dados carregados e processados com sucesso!")
 # EXIBIR FILTROS GLOBAIS NA SIDEBAR
 # ==============================
 filtros = exibir_filtros_globais(
-    st.session_state['df_vendas_original'],
-    st.session_state['col_cliente'],
-    st.session_state['col_produto'],
-    st.session_state['col_vendedor'],
-    st.session_state['col_linha'],
-    st.session_state['col_data'],
-    col_diretor=st.session_state.get('col_diretor'),
-    col_gerente=st.session_state.get('col_gerente'),
-    col_gerente_regional=st.session_state.get('col_gerente_regional'),
-    col_supervisor=st.session_state.get('col_supervisor'),
-    col_coordenador=st.session_state.get('col_coordenador'),
-    col_consultor=st.session_state.get('col_consultor')
-)
-
-# Aplicar filtros ao df_vendas
-df_vendas_filtrado = aplicar_filtros_globais(
-    st.session_state['df_vendas_original'],
-    filtros,
+    df_vendas_hierarquia,
     st.session_state['col_cliente'],
     st.session_state['col_produto'],
     st.session_state['col_vendedor'],
@@ -131,26 +114,9 @@ df_vendas_filtrado = aplicar_filtros_globais(
     col_consultor=st.session_state.get('col_consultor')
 )
 
-st.session_state['df_vendas'] = df_vendas_filtrado
-
-# Aplicar filtros em devoluções se existirem
-if not st.session_state.get('df_devolucoes_original', pd.DataFrame()).empty:
-    df_dev_filtrado = aplicar_filtros_globais(
-        st.session_state['df_devolucoes_original'],
-        filtros,
-        st.session_state['col_cliente'],
-        st.session_state['col_produto'],
-        st.session_state['col_vendedor'],
-        st.session_state['col_linha'],
-        st.session_state['col_data'],
-        col_diretor=st.session_state.get('col_diretor'),
-        col_gerente=st.session_state.get('col_gerente'),
-        col_gerente_regional=st.session_state.get('col_gerente_regional'),
-        col_supervisor=st.session_state.get('col_supervisor'),
-        col_coordenador=st.session_state.get('col_coordenador'),
-        col_consultor=st.session_state.get('col_consultor')
-    )
-    st.session_state['df_devolucoes'] = df_dev_filtrado
+# Handle com hierarquia + filtros globais: as páginas pedem dados.vendas()/dados.devolucoes()
+st.session_state['dados_sessao'] = DadosSessao(DATA_DIR, user_hierarchy, config, filtros)
+df_vendas_filtrado = st.session_state['dados_sessao'].vendas()
 
 # ==============================
 # INFORMAÇÕES E NAVEGAÇÃO
@@ -2,7 +2,7 @@ import streamlit as st
 import pandas as pd
 import sys
 sys.path.append('/workspaces/realh')
-from utils import formatar_moeda, obter_periodo_mes_comercial, ordenar_mes_comercial, exibir_logo, exibir_top_com_alternancia, safe_strftime
+from utils import formatar_moeda, obter_periodo_mes_comercial, FilterSpec, ordenar_mes_comercial, exibir_logo, exibir_top_com_alternancia, safe_strftime, formatar_contagem, ajuda_contagem
 
 st.set_page_config(page_title="Dashboard", page_icon="📊", layout="wide")
 
@@ -17,15 +17,19 @@ exibir_logo()
 st.title("📊 Dashboard - Visão Geral")
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+spec = FilterSpec(dados)
+
+# Pegar as visões da sessão
+df_vendas = spec.vendas()
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = spec.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 # ==============================
@@ -44,16 +48,9 @@ if meses_comerciais_disponiveis:
     # Aplicar filtro de mês (sobre os dados já filtrados pelos filtros globais)
     if mes_selecionado != 'Todos os Meses':
         data_inicio, data_fim = obter_periodo_mes_comercial(mes_selecionado)
-        df_vendas = df_vendas[
-            (df_vendas[st.session_state['col_data']] >= data_inicio) & 
-            (df_vendas[st.session_state['col_data']] <= data_fim)
-        ].copy()
-        
-        if not df_devolucoes.empty:
-            df_devolucoes = df_devolucoes[
-                (df_devolucoes[st.session_state['col_data']] >= data_inicio) & 
-                (df_devolucoes[st.session_state['col_data']] <= data_fim)
-            ].copy()
+        spec = spec.com_mes_comercial(mes_selecionado)
+        df_vendas = spec.vendas()
+        df_devolucoes = spec.devolucoes()
         
         st.sidebar.info(f"📅 {safe_strftime(data_inicio)} a {safe_strftime(data_fim)}")
     else:
@@ -63,8 +60,9 @@ if meses_comerciais_disponiveis:
 # CALCULAR MÉTRICAS
 # ==============================
 valor_total = df_vendas[st.session_state['col_valor']].sum()
-clientes_unicos = df_vendas[st.session_state['col_codCliente']].nunique()
-pedidos_unicos = df_vendas['Pedido_Unico'].nunique()
+# Exatas: entram no ticket médio
+clientes_unicos = spec.distintos('clientes', modo='exato')
+pedidos_unicos = spec.distintos('pedidos', modo='exato')
 produtos_unicos = df_vendas[st.session_state['col_produto']].nunique()
 vendedores_unicos = df_vendas[st.session_state['col_codVendedor']].nunique()
 ticket_medio_pedido = valor_total / pedidos_unicos if pedidos_unicos > 0 else 0
@@ -73,8 +71,8 @@ ticket_medio = valor_total / clientes_unicos if clientes_unicos > 0 else 0
 # Devoluções
 if not df_devolucoes.empty:
     valor_devolucoes = df_devolucoes[st.session_state['col_valor']].sum()
-    clientes_devolucao = df_devolucoes[st.session_state['col_codCliente']].nunique()
-    pedidos_devolucao = df_devolucoes['Pedido_Unico'].nunique()
+    clientes_devolucao = spec.distintos('clientes', 'devolucoes')
+    pedidos_devolucao = spec.distintos('pedidos', 'devolucoes')
     taxa_devolucao = (valor_devolucoes / valor_total * 100) if valor_total > 0 else 0
 else:
     valor_devolucoes = clientes_devolucao = pedidos_devolucao = taxa_devolucao = 0
@@ -180,8 +178,8 @@ with tab_vendas:
 with tab_devolucoes:
     col1, col2, col3 = st.columns(3)
     col1.metric("↩️ Total de Devoluções", formatar_moeda(valor_devolucoes))
-    col2.metric("👥 Clientes com Devolução", f"{clientes_devolucao:,}")
-    col3.metric("📦 Pedidos Devolvidos", f"{pedidos_devolucao:,}")
+    col2.metric("👥 Clientes com Devolução", formatar_contagem(clientes_devolucao), help=ajuda_contagem(clientes_devolucao))
+    col3.metric("📦 Pedidos Devolvidos", formatar_contagem(pedidos_devolucao), help=ajuda_contagem(pedidos_devolucao))
     
     if valor_total > 0:
         col4, col5 = st.columns(2)
@@ -198,13 +196,13 @@ st.markdown("### 🏆 Top 10 - Destaques do Período")
 col_top1, col_top2 = st.columns(2)
 
 with col_top1:
-    top_clientes = df_vendas.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
+    top_clientes = df_vendas.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
     top_clientes.columns = ['Cliente', 'Valor']
     top_clientes['Valor'] = top_clientes['Valor'].apply(formatar_moeda)
     exibir_top_com_alternancia(top_clientes, "👥 Top Clientes", "dashboard_top_clientes", tipo_grafico='bar')
 
 with col_top2:
-    top_produtos = df_vendas.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
+    top_produtos = df_vendas.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
     top_produtos.columns = ['Produto', 'Valor']
     top_produtos['Valor'] = top_produtos['Valor'].apply(formatar_moeda)
     exibir_top_com_alternancia(top_produtos, "🛍️ Top Produtos", "dashboard_top_produtos", tipo_grafico='bar')
@@ -214,14 +212,14 @@ st.markdown("---")
 col_top3, col_top4 = st.columns(2)
 
 with col_top3:
-    top_vendedores = df_vendas.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
+    top_vendedores = df_vendas.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
     top_vendedores.columns = ['Vendedor', 'Valor']
     top_vendedores['Valor'] = top_vendedores['Valor'].apply(formatar_moeda)
     exibir_top_com_alternancia(top_vendedores, "🧑‍💼 Top Vendedores", "dashboard_top_vendedores", tipo_grafico='bar')
 
 with col_top4:
     if st.session_state.get('col_linha') and st.session_state['col_linha'] != "Nenhuma":
-        vendas_linha = df_vendas.groupby(st.session_state['col_linha'])[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
+        vendas_linha = df_vendas.groupby(st.session_state['col_linha'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).reset_index()
         vendas_linha.columns = ['Linha', 'Valor']
         vendas_linha['Valor'] = vendas_linha['Valor'].apply(formatar_moeda)
         exibir_top_com_alternancia(vendas_linha, "📊 Vendas por Linha", "dashboard_top_linhas", tipo_grafico='pie')
@@ -5,7 +5,7 @@ import plotly.graph_objects as go
 from datetime import datetime
 import sys
 sys.path.append('/workspaces/realh')
-from utils import (calcular_mes_comercial, obter_periodo_mes_comercial, exibir_logo,
+from utils import (calcular_mes_comercial, obter_periodo_mes_comercial, FilterSpec, exibir_logo,
                   exibir_filtros_globais, aplicar_filtros_globais, ordenar_mes_comercial, safe_strftime, formatar_moeda)
 
 st.set_page_config(page_title="Comparativos", page_icon="📈", layout="wide")
@@ -22,15 +22,18 @@ Compare períodos para entender tendências e monitorar mudanças no negócio:
 """)
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state or 'df_vendas_original' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+
+# Pegar as visões da sessão
+df_vendas = dados.vendas()
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = dados.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 # ==============================
@@ -60,18 +63,21 @@ if len(meses_comerciais_disponiveis) >= 2:
     data_inicio_2, data_fim_2 = obter_periodo_mes_comercial(mes_2)
     
     # Filtrar dados (usa df_vendas que já está filtrado pelos filtros globais)
-    df_periodo_1 = df_vendas[df_vendas['Mes_Comercial'] == mes_1]
-    df_periodo_2 = df_vendas[df_vendas['Mes_Comercial'] == mes_2]
+    spec_1 = FilterSpec(dados).com_mes_comercial(mes_1)
+    spec_2 = FilterSpec(dados).com_mes_comercial(mes_2)
+    df_periodo_1 = spec_1.vendas()
+    df_periodo_2 = spec_2.vendas()
     
     # Calcular métricas período 1
     valor_total_1 = df_periodo_1[st.session_state['col_valor']].sum()
-    clientes_unicos_1 = df_periodo_1[st.session_state['col_codCliente']].nunique()
-    pedidos_unicos_1 = df_periodo_1['Pedido_Unico'].nunique()
+    # Exatas: entram no ticket médio e nas variações entre os períodos
+    clientes_unicos_1 = spec_1.distintos('clientes', modo='exato')
+    pedidos_unicos_1 = spec_1.distintos('pedidos', modo='exato')
     ticket_medio_1 = valor_total_1 / pedidos_unicos_1 if pedidos_unicos_1 > 0 else 0
     
     # Devoluções período 1
     if not df_devolucoes.empty:
-        df_dev_1 = df_devolucoes[df_devolucoes['Mes_Comercial'] == mes_1]
+        df_dev_1 = spec_1.devolucoes()
         valor_dev_1 = df_dev_1[st.session_state['col_valor']].sum()
     else:
         valor_dev_1 = 0
@@ -80,13 +86,13 @@ if len(meses_comerciais_disponiveis) >= 2:
     
     # Calcular métricas período 2
     valor_total_2 = df_periodo_2[st.session_state['col_valor']].sum()
-    clientes_unicos_2 = df_periodo_2[st.session_state['col_codCliente']].nunique()
-    pedidos_unicos_2 = df_periodo_2['Pedido_Unico'].nunique()
+    clientes_unicos_2 = spec_2.distintos('clientes', modo='exato')
+    pedidos_unicos_2 = spec_2.distintos('pedidos', modo='exato')
     ticket_medio_2 = valor_total_2 / pedidos_unicos_2 if pedidos_unicos_2 > 0 else 0
     
     # Devoluções período 2
     if not df_devolucoes.empty:
-        df_dev_2 = df_devolucoes[df_devolucoes['Mes_Comercial'] == mes_2]
+        df_dev_2 = spec_2.devolucoes()
         valor_dev_2 = df_dev_2[st.session_state['col_valor']].sum()
     else:
         valor_dev_2 = 0
@@ -217,10 +223,10 @@ if len(meses_comerciais_disponiveis) >= 2:
         st.markdown("---")
         st.markdown("### 📈 Comparativo por Linha")
         
-        vendas_linha_1 = df_periodo_1.groupby(st.session_state['col_linha'])[st.session_state['col_valor']].sum().reset_index()
+        vendas_linha_1 = df_periodo_1.groupby(st.session_state['col_linha'], observed=True)[st.session_state['col_valor']].sum().reset_index()
         vendas_linha_1.columns = ['Linha', 'Valor_1']
         
-        vendas_linha_2 = df_periodo_2.groupby(st.session_state['col_linha'])[st.session_state['col_valor']].sum().reset_index()
+        vendas_linha_2 = df_periodo_2.groupby(st.session_state['col_linha'], observed=True)[st.session_state['col_valor']].sum().reset_index()
         vendas_linha_2.columns = ['Linha', 'Valor_2']
         
         comparativo_linha = vendas_linha_1.merge(vendas_linha_2, on='Linha', how='outer').fillna(0)
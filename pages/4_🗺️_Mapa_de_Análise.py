@@ -18,10 +18,13 @@ Esta página ajuda você a navegar rapidamente para a segmentação que precisa!
 st.markdown("---")
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+
 # ==============================
 # QUER APROFUNDAR A ANÁLISE?
 # ==============================
@@ -121,7 +124,7 @@ st.markdown("---")
 # ==============================
 # DEVOLUÇÕES (se houver dados)
 # ==============================
-if not st.session_state.get('df_devolucoes', pd.DataFrame()).empty:
+if not dados.devolucoes().empty:
     st.markdown("### 💼 Análise de Devoluções")
     
     st.markdown("Entenda os padrões de devoluções em todas as categorias:")
@@ -3,7 +3,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import sys
 sys.path.append('/workspaces/realh')
-from utils import formatar_moeda, ordenar_mes_comercial, obter_periodo_mes_comercial, exibir_logo, safe_strftime
+from utils import formatar_moeda, ordenar_mes_comercial, obter_periodo_mes_comercial, FilterSpec, exibir_logo, safe_strftime, formatar_contagem, ajuda_contagem
 
 st.set_page_config(page_title="Análise por Linha", page_icon="🏢", layout="wide")
 
@@ -12,21 +12,25 @@ exibir_logo()
 st.title("🏢 Análise por Linha de Produto")
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+spec = FilterSpec(dados)
+df_vendas = spec.vendas()
+
 # Verificar se coluna Linha está configurada
 col_linha = st.session_state.get('col_linha', 'Nenhuma')
-if col_linha == "Nenhuma" or col_linha not in st.session_state['df_vendas'].columns:
+if col_linha == "Nenhuma" or col_linha not in df_vendas.columns:
     st.warning("⚠️ Configure a coluna 'Linha' na página inicial para visualizar esta análise.")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Pegar as visões da sessão
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = spec.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 # ==============================
@@ -47,16 +51,9 @@ if meses_comerciais_disponiveis:
     # Aplicar filtro de mês (sobre os dados já filtrados pelos filtros globais)
     if mes_selecionado != 'Todos os Meses':
         data_inicio, data_fim = obter_periodo_mes_comercial(mes_selecionado)
-        df_vendas = df_vendas[
-            (df_vendas[st.session_state['col_data']] >= data_inicio) & 
-            (df_vendas[st.session_state['col_data']] <= data_fim)
-        ].copy()
-        
-        if not df_devolucoes.empty:
-            df_devolucoes = df_devolucoes[
-                (df_devolucoes[st.session_state['col_data']] >= data_inicio) & 
-                (df_devolucoes[st.session_state['col_data']] <= data_fim)
-            ].copy()
+        spec = spec.com_mes_comercial(mes_selecionado)
+        df_vendas = spec.vendas()
+        df_devolucoes = spec.devolucoes()
         
         st.sidebar.info(f"📅 {safe_strftime(data_inicio)} a {safe_strftime(data_fim)}")
     else:
@@ -65,36 +62,11 @@ if meses_comerciais_disponiveis:
 # ==============================
 # PROCESSAR DADOS POR LINHA
 # ==============================
-vendas_por_linha = df_vendas.groupby(col_linha)[st.session_state['col_valor']].sum().sort_values(ascending=False)
-
-if not df_devolucoes.empty and col_linha in df_devolucoes.columns:
-    devolucoes_por_linha = df_devolucoes.groupby(col_linha)[st.session_state['col_valor']].sum()
-else:
-    devolucoes_por_linha = pd.Series(dtype=float)
-
-# Calcular quantidade e toneladas por linha
-quantidade_por_linha = pd.Series(dtype=float)
-toneladas_por_linha = pd.Series(dtype=float)
-
 col_quantidade = st.session_state.get('col_quantidade', 'Nenhuma')
 col_toneladas = st.session_state.get('col_toneladas', 'Nenhuma')
 
-if col_quantidade != 'Nenhuma' and col_quantidade in df_vendas.columns:
-    quantidade_por_linha = df_vendas.groupby(col_linha)[col_quantidade].sum()
-
-if col_toneladas != 'Nenhuma' and col_toneladas in df_vendas.columns:
-    toneladas_por_linha = df_vendas.groupby(col_linha)[col_toneladas].sum()
-
-df_linhas_analise = pd.DataFrame({
-    'Vendas': vendas_por_linha,
-    'Devoluções': devolucoes_por_linha,
-    'Quantidade': quantidade_por_linha,
-    'Toneladas': toneladas_por_linha
-}).fillna(0)
-
-df_linhas_analise['Líquido'] = df_linhas_analise['Vendas'] - df_linhas_analise['Devoluções']
-df_linhas_analise['Taxa Dev. (%)'] = (df_linhas_analise['Devoluções'] / df_linhas_analise['Vendas'] * 100).fillna(0)
-df_linhas_analise = df_linhas_analise.sort_values('Vendas', ascending=False)
+df_linhas_analise = spec.resumo_entidades(col_linha)
+vendas_por_linha = df_linhas_analise['Vendas']
 
 # ==============================
 # ABAS DE ANÁLISE
@@ -149,11 +121,11 @@ with tab_insights:
             st.write(f"💰 Faturamento: {formatar_moeda(melhor_valor)}")
             st.write(f"📊 Participação: {participacao_melhor:.1f}%")
             
-            df_melhor = df_vendas[df_vendas[col_linha] == melhor_linha]
-            clientes_melhor = df_melhor[st.session_state['col_codCliente']].nunique()
-            pedidos_melhor = df_melhor['Pedido_Unico'].nunique()
-            st.write(f"👥 Clientes: {clientes_melhor:,}")
-            st.write(f"📦 Pedidos: {pedidos_melhor:,}")
+            spec_melhor = spec.com_entidade(col_linha, melhor_linha)
+            clientes_melhor = spec_melhor.distintos('clientes')
+            pedidos_melhor = spec_melhor.distintos('pedidos')
+            st.write(f"👥 Clientes: {formatar_contagem(clientes_melhor)}")
+            st.write(f"📦 Pedidos: {formatar_contagem(pedidos_melhor)}")
     
     with col_ins2:
         st.markdown("#### ⚠️ Linha com Maior Taxa de Devolução")
@@ -167,11 +139,11 @@ with tab_insights:
             st.write(f"↩️ Valor Devolvido: {formatar_moeda(valor_dev)}")
             
             if not df_devolucoes.empty:
-                df_dev_linha = df_devolucoes[df_devolucoes[col_linha] == linha_maior_dev]
-                clientes_dev = df_dev_linha[st.session_state['col_codCliente']].nunique()
-                pedidos_dev = df_dev_linha['Pedido_Unico'].nunique()
-                st.write(f"👥 Clientes com Devolução: {clientes_dev:,}")
-                st.write(f"📦 Pedidos Devolvidos: {pedidos_dev:,}")
+                spec_dev_linha = spec.com_entidade(col_linha, linha_maior_dev)
+                clientes_dev = spec_dev_linha.distintos('clientes', 'devolucoes')
+                pedidos_dev = spec_dev_linha.distintos('pedidos', 'devolucoes')
+                st.write(f"👥 Clientes com Devolução: {formatar_contagem(clientes_dev)}")
+                st.write(f"📦 Pedidos Devolvidos: {formatar_contagem(pedidos_dev)}")
         else:
             st.info("Nenhuma devolução registrada")
     
@@ -210,7 +182,7 @@ with tab_insights:
         st.markdown("---")
         st.markdown("#### 📈 Evolução Temporal por Linha")
         
-        vendas_linha_mes = df_vendas_original.groupby(['Mes_Comercial', col_linha])[st.session_state['col_valor']].sum().reset_index()
+        vendas_linha_mes = FilterSpec(dados, filtrada=False).agregar(['Mes_Comercial', col_linha], [st.session_state['col_valor']])
         
         fig_evolucao = go.Figure()
         cores_linhas = ['#00CC96', '#636EFA', '#EF553B', '#FFA15A', '#19D3F3']
@@ -264,27 +236,31 @@ with tab_detalhes:
     linha_selecionada = st.selectbox("Selecione uma linha:", df_linhas_analise.index.tolist())
     
     if linha_selecionada:
-        df_linha_sel = df_vendas[df_vendas[col_linha] == linha_selecionada]
+        spec_linha_sel = spec.com_entidade(col_linha, linha_selecionada)
+        df_linha_sel = spec_linha_sel.vendas()
+        # Exata: entra no ticket médio
+        pedidos_linha = spec_linha_sel.distintos('pedidos', modo='exato')
+        clientes_linha = spec_linha_sel.distintos('clientes')
         
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("📦 Pedidos", df_linha_sel['Pedido_Unico'].nunique())
-        col2.metric("👥 Clientes", df_linha_sel[st.session_state['col_codCliente']].nunique())
+        col1.metric("📦 Pedidos", pedidos_linha)
+        col2.metric("👥 Clientes", formatar_contagem(clientes_linha), help=ajuda_contagem(clientes_linha))
         col3.metric("🛍️ Produtos", df_linha_sel[st.session_state['col_produto']].nunique())
         
-        ticket_medio_linha = df_linha_sel[st.session_state['col_valor']].sum() / df_linha_sel['Pedido_Unico'].nunique() if df_linha_sel['Pedido_Unico'].nunique() > 0 else 0
+        ticket_medio_linha = df_linha_sel[st.session_state['col_valor']].sum() / pedidos_linha if pedidos_linha > 0 else 0
         col4.metric("🎯 Ticket Médio", formatar_moeda(ticket_medio_linha))
         
         col_det1, col_det2 = st.columns(2)
         
         with col_det1:
             st.markdown("##### 🏆 Top 5 Produtos")
-            top_produtos_linha = df_linha_sel.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_produtos_linha = df_linha_sel.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (produto, valor) in enumerate(top_produtos_linha.items(), 1):
                 st.write(f"{idx}. **{produto}**: {formatar_moeda(valor)}")
         
         with col_det2:
             st.markdown("##### 👥 Top 5 Clientes")
-            top_clientes_linha = df_linha_sel.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_clientes_linha = df_linha_sel.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (cliente, valor) in enumerate(top_clientes_linha.items(), 1):
                 st.write(f"{idx}. **{cliente}**: {formatar_moeda(valor)}")
         
@@ -296,7 +272,7 @@ with tab_detalhes:
         with col_top1:
             st.markdown("##### 📦 Top 5 Produtos por Quantidade")
             if col_quantidade != 'Nenhuma' and col_quantidade in df_linha_sel.columns:
-                top_qtde = df_linha_sel.groupby(st.session_state['col_produto']).agg({
+                top_qtde = df_linha_sel.groupby(st.session_state['col_produto'], observed=True).agg({
                     col_quantidade: 'sum',
                     st.session_state['col_valor']: 'sum'
                 }).sort_values(col_quantidade, ascending=False).head(5)
@@ -308,7 +284,7 @@ with tab_detalhes:
         with col_top2:
             st.markdown("##### ⚖️ Top 5 Produtos por Toneladas")
             if col_toneladas != 'Nenhuma' and col_toneladas in df_linha_sel.columns:
-                top_ton = df_linha_sel.groupby(st.session_state['col_produto']).agg({
+                top_ton = df_linha_sel.groupby(st.session_state['col_produto'], observed=True).agg({
                     col_toneladas: 'sum',
                     st.session_state['col_valor']: 'sum'
                 }).sort_values(col_toneladas, ascending=False).head(5)
@@ -327,7 +303,8 @@ with tab_evolucao:
     linha_evolucao = st.selectbox("Selecione uma linha para análise:", df_linhas_analise.index.tolist(), key="linha_evolucao")
     
     if linha_evolucao:
-        df_linha_evolucao = df_vendas_original[df_vendas_original[col_linha] == linha_evolucao]
+        spec_linha_evolucao = FilterSpec(dados, filtrada=False).com_entidade(col_linha, linha_evolucao)
+        df_linha_evolucao = spec_linha_evolucao.vendas()
         
         # Preparar dicionário de agregação
         agg_dict = {st.session_state['col_valor']: 'sum'}
@@ -339,7 +316,7 @@ with tab_evolucao:
             agg_dict[col_toneladas] = 'sum'
         
         # Agrupar por mês comercial e produto
-        evolucao_vendas = df_linha_evolucao.groupby(['Mes_Comercial', st.session_state['col_produto']]).agg(agg_dict).reset_index()
+        evolucao_vendas = df_linha_evolucao.groupby(['Mes_Comercial', st.session_state['col_produto']], observed=True).agg(agg_dict).reset_index()
         
         # Ordenar por mês comercial
         evolucao_vendas['Ordem'] = evolucao_vendas['Mes_Comercial'].apply(ordenar_mes_comercial)
@@ -347,7 +324,7 @@ with tab_evolucao:
         
         # Gráfico de Evolução de Vendas
         st.markdown("#### 💰 Evolução do Valor de Vendas")
-        vendas_por_mes = df_linha_evolucao.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        vendas_por_mes = spec_linha_evolucao.agregar('Mes_Comercial', [st.session_state['col_valor']])
         vendas_por_mes['Ordem'] = vendas_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_por_mes = vendas_por_mes.sort_values('Ordem')
         
@@ -376,7 +353,7 @@ with tab_evolucao:
         # Gráfico de Evolução de Quantidade
         if col_quantidade != 'Nenhuma' and col_quantidade in df_linha_evolucao.columns:
             st.markdown("#### 📦 Evolução da Quantidade")
-            qtde_por_mes = df_linha_evolucao.groupby('Mes_Comercial')[col_quantidade].sum().reset_index()
+            qtde_por_mes = spec_linha_evolucao.agregar('Mes_Comercial', [col_quantidade])
             qtde_por_mes['Ordem'] = qtde_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
             qtde_por_mes = qtde_por_mes.sort_values('Ordem')
             
@@ -405,7 +382,7 @@ with tab_evolucao:
         # Gráfico de Evolução de Toneladas
         if col_toneladas != 'Nenhuma' and col_toneladas in df_linha_evolucao.columns:
             st.markdown("#### ⚖️ Evolução das Toneladas")
-            ton_por_mes = df_linha_evolucao.groupby('Mes_Comercial')[col_toneladas].sum().reset_index()
+            ton_por_mes = spec_linha_evolucao.agregar('Mes_Comercial', [col_toneladas])
             ton_por_mes['Ordem'] = ton_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
             ton_por_mes = ton_por_mes.sort_values('Ordem')
             
@@ -435,7 +412,7 @@ with tab_evolucao:
         st.markdown("---")
         st.markdown("#### 🏆 Top 10 Produtos por Período")
         
-        top_produtos = df_linha_evolucao.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).index.tolist()
+        top_produtos = df_linha_evolucao.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(10).index.tolist()
         
         tab_valor, tab_qtde, tab_ton = st.tabs(["💰 Por Valor", "📦 Por Quantidade", "⚖️ Por Toneladas"])
         
@@ -565,7 +542,8 @@ with tab_comparativo:
             st.write("**Colunas df_vendas:**", df_vendas.columns.tolist())
         
         # Filtrar dados apenas das linhas selecionadas
-        df_linhas_filtrado = df_vendas[df_vendas[col_linha].isin(linhas_selecionadas)]
+        spec_linhas_filtrado = spec.com_entidade(col_linha, linhas_selecionadas)
+        df_linhas_filtrado = spec_linhas_filtrado.vendas()
         
         with st.expander("🔍 Debug - Após Filtro Linhas", expanded=False):
             st.write("**Dados filtrados shape:**", df_linhas_filtrado.shape)
@@ -574,7 +552,7 @@ with tab_comparativo:
         
         if not df_linhas_filtrado.empty:
             # Evolução por mês comercial
-            evolucao_linhas = df_linhas_filtrado.groupby(['Mes_Comercial', col_linha])[st.session_state['col_valor']].sum().reset_index()
+            evolucao_linhas = spec_linhas_filtrado.agregar(['Mes_Comercial', col_linha], [st.session_state['col_valor']])
             
             # Gráfico de evolução das linhas selecionadas
             fig_evolucao = go.Figure()
@@ -3,7 +3,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import sys
 sys.path.append('/workspaces/realh')
-from utils import formatar_moeda, ordenar_mes_comercial, obter_periodo_mes_comercial, exibir_logo, exibir_top_com_alternancia, safe_strftime
+from utils import formatar_moeda, ordenar_mes_comercial, obter_periodo_mes_comercial, FilterSpec, exibir_logo, exibir_top_com_alternancia, safe_strftime, formatar_contagem, ajuda_contagem
 
 st.set_page_config(page_title="Análise de Produtos", page_icon="📦", layout="wide")
 
@@ -12,15 +12,19 @@ exibir_logo()
 st.title("📦 Análise de Produtos")
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+spec = FilterSpec(dados)
+
+# Pegar as visões da sessão
+df_vendas = spec.vendas()
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = spec.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 col_produto = st.session_state['col_produto']
@@ -43,16 +47,9 @@ if meses_comerciais_disponiveis:
     # Aplicar filtro de mês (sobre os dados já filtrados pelos filtros globais)
     if mes_selecionado != 'Todos os Meses':
         data_inicio, data_fim = obter_periodo_mes_comercial(mes_selecionado)
-        df_vendas = df_vendas[
-            (df_vendas[st.session_state['col_data']] >= data_inicio) & 
-            (df_vendas[st.session_state['col_data']] <= data_fim)
-        ].copy()
-        
-        if not df_devolucoes.empty:
-            df_devolucoes = df_devolucoes[
-                (df_devolucoes[st.session_state['col_data']] >= data_inicio) & 
-                (df_devolucoes[st.session_state['col_data']] <= data_fim)
-            ].copy()
+        spec = spec.com_mes_comercial(mes_selecionado)
+        df_vendas = spec.vendas()
+        df_devolucoes = spec.devolucoes()
         
         st.sidebar.info(f"📅 {safe_strftime(data_inicio)} a {safe_strftime(data_fim)}")
     else:
@@ -61,33 +58,8 @@ if meses_comerciais_disponiveis:
 # ==============================
 # PROCESSAR DADOS POR PRODUTO
 # ==============================
-vendas_por_produto = df_vendas.groupby(col_produto)[st.session_state['col_valor']].sum().sort_values(ascending=False)
-
-if not df_devolucoes.empty and col_produto in df_devolucoes.columns:
-    devolucoes_por_produto = df_devolucoes.groupby(col_produto)[st.session_state['col_valor']].sum()
-else:
-    devolucoes_por_produto = pd.Series(dtype=float)
-
-# Calcular quantidade e toneladas por produto
-quantidade_por_produto = pd.Series(dtype=float)
-toneladas_por_produto = pd.Series(dtype=float)
-
-if col_quantidade != 'Nenhuma' and col_quantidade in df_vendas.columns:
-    quantidade_por_produto = df_vendas.groupby(col_produto)[col_quantidade].sum()
-
-if col_toneladas != 'Nenhuma' and col_toneladas in df_vendas.columns:
-    toneladas_por_produto = df_vendas.groupby(col_produto)[col_toneladas].sum()
-
-df_produtos_analise = pd.DataFrame({
-    'Vendas': vendas_por_produto,
-    'Devoluções': devolucoes_por_produto,
-    'Quantidade': quantidade_por_produto,
-    'Toneladas': toneladas_por_produto
-}).fillna(0)
-
-df_produtos_analise['Líquido'] = df_produtos_analise['Vendas'] - df_produtos_analise['Devoluções']
-df_produtos_analise['Taxa Dev. (%)'] = (df_produtos_analise['Devoluções'] / df_produtos_analise['Vendas'] * 100).fillna(0)
-df_produtos_analise = df_produtos_analise.sort_values('Vendas', ascending=False)
+df_produtos_analise = spec.resumo_entidades(col_produto)
+vendas_por_produto = df_produtos_analise['Vendas']
 
 # ==============================
 # ABAS DE ANÁLISE
@@ -216,7 +188,8 @@ with tab_detalhes:
     produto_selecionado = st.selectbox("Selecione um produto:", df_produtos_analise.index.tolist())
     
     if produto_selecionado:
-        df_produto_sel = df_vendas[df_vendas[col_produto] == produto_selecionado]
+        spec_produto_sel = spec.com_entidade(col_produto, produto_selecionado)
+        df_produto_sel = spec_produto_sel.vendas()
         row_produto = df_produtos_analise.loc[produto_selecionado]
         
         # KPIs do produto
@@ -237,8 +210,10 @@ with tab_detalhes:
         # Métricas adicionais
         col_a, col_b, col_c, col_d = st.columns(4)
         
-        col_a.metric("📦 Pedidos", df_produto_sel['Pedido_Unico'].nunique())
-        col_b.metric("👥 Clientes", df_produto_sel[st.session_state['col_codCliente']].nunique())
+        pedidos_produto = spec_produto_sel.distintos('pedidos')
+        clientes_produto = spec_produto_sel.distintos('clientes')
+        col_a.metric("📦 Pedidos", formatar_contagem(pedidos_produto), help=ajuda_contagem(pedidos_produto))
+        col_b.metric("👥 Clientes", formatar_contagem(clientes_produto), help=ajuda_contagem(clientes_produto))
         col_c.metric("👤 Vendedores", df_produto_sel[st.session_state['col_vendedor']].nunique())
         
         preco_medio = df_produto_sel[st.session_state['col_valor']].sum() / df_produto_sel[col_quantidade].sum() if col_quantidade != 'Nenhuma' and col_quantidade in df_produto_sel.columns and df_produto_sel[col_quantidade].sum() > 0 else 0
@@ -258,13 +233,13 @@ with tab_detalhes:
         
         with col_top1:
             st.markdown("##### 👥 Top 5 Clientes")
-            top_clientes = df_produto_sel.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_clientes = df_produto_sel.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (cliente, valor) in enumerate(top_clientes.items(), 1):
                 st.write(f"{idx}. **{cliente}**: {formatar_moeda(valor)}")
         
         with col_top2:
             st.markdown("##### 🏆 Top 5 Vendedores")
-            top_vendedores = df_produto_sel.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_vendedores = df_produto_sel.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (vendedor, valor) in enumerate(top_vendedores.items(), 1):
                 st.write(f"{idx}. **{vendedor}**: {formatar_moeda(valor)}")
         
@@ -275,7 +250,7 @@ with tab_detalhes:
         if col_linha != 'Nenhuma' and col_linha in df_produto_sel.columns:
             st.markdown("##### 🏢 Distribuição por Linha")
             
-            vendas_linha = df_produto_sel.groupby(col_linha)[st.session_state['col_valor']].sum().sort_values(ascending=False)
+            vendas_linha = df_produto_sel.groupby(col_linha, observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False)
             
             fig_linha = go.Figure()
             fig_linha.add_trace(go.Pie(
@@ -301,11 +276,12 @@ with tab_evolucao:
     produto_evolucao = st.selectbox("Selecione um produto:", df_produtos_analise.index.tolist(), key="produto_evolucao")
     
     if produto_evolucao:
-        df_produto_evolucao = df_vendas_original[df_vendas_original[col_produto] == produto_evolucao]
+        spec_produto_evolucao = FilterSpec(dados, filtrada=False).com_entidade(col_produto, produto_evolucao)
+        df_produto_evolucao = spec_produto_evolucao.vendas()
         
         # Gráfico de Evolução de Vendas
         st.markdown("#### 💰 Evolução do Valor de Vendas")
-        vendas_por_mes = df_produto_evolucao.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        vendas_por_mes = spec_produto_evolucao.agregar('Mes_Comercial', [st.session_state['col_valor']])
         vendas_por_mes['Ordem'] = vendas_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_por_mes = vendas_por_mes.sort_values('Ordem')
         
@@ -334,7 +310,7 @@ with tab_evolucao:
         # Gráfico de Evolução de Quantidade
         if col_quantidade != 'Nenhuma' and col_quantidade in df_produto_evolucao.columns:
             st.markdown("#### 📦 Evolução da Quantidade")
-            qtde_por_mes = df_produto_evolucao.groupby('Mes_Comercial')[col_quantidade].sum().reset_index()
+            qtde_por_mes = spec_produto_evolucao.agregar('Mes_Comercial', [col_quantidade])
             qtde_por_mes['Ordem'] = qtde_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
             qtde_por_mes = qtde_por_mes.sort_values('Ordem')
             
@@ -363,7 +339,7 @@ with tab_evolucao:
         # Gráfico de Evolução de Toneladas
         if col_toneladas != 'Nenhuma' and col_toneladas in df_produto_evolucao.columns:
             st.markdown("#### ⚖️ Evolução das Toneladas")
-            ton_por_mes = df_produto_evolucao.groupby('Mes_Comercial')[col_toneladas].sum().reset_index()
+            ton_por_mes = spec_produto_evolucao.agregar('Mes_Comercial', [col_toneladas])
             ton_por_mes['Ordem'] = ton_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
             ton_por_mes = ton_por_mes.sort_values('Ordem')
             
@@ -394,7 +370,7 @@ with tab_evolucao:
         # Evolução comparativa: Valor x Quantidade x Toneladas
         st.markdown("#### 📊 Análise Comparativa por Mês")
         
-        dados_completos = df_produto_evolucao.groupby('Mes_Comercial').agg({
+        dados_completos = df_produto_evolucao.groupby('Mes_Comercial', observed=True).agg({
             st.session_state['col_valor']: 'sum',
             col_quantidade: 'sum' if col_quantidade != 'Nenhuma' and col_quantidade in df_produto_evolucao.columns else lambda x: 0,
             col_toneladas: 'sum' if col_toneladas != 'Nenhuma' and col_toneladas in df_produto_evolucao.columns else lambda x: 0
@@ -421,9 +397,9 @@ with tab_evolucao:
         st.markdown("---")
         st.markdown("#### 👥 Top 5 Clientes - Evolução")
         
-        top_clientes_evolucao = df_produto_evolucao.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5).index.tolist()
+        top_clientes_evolucao = df_produto_evolucao.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5).index.tolist()
         
-        vendas_clientes_mes = df_produto_evolucao[df_produto_evolucao[st.session_state['col_cliente']].isin(top_clientes_evolucao)].groupby(['Mes_Comercial', st.session_state['col_cliente']])[st.session_state['col_valor']].sum().reset_index()
+        vendas_clientes_mes = df_produto_evolucao[df_produto_evolucao[st.session_state['col_cliente']].isin(top_clientes_evolucao)].groupby(['Mes_Comercial', st.session_state['col_cliente']], observed=True)[st.session_state['col_valor']].sum().reset_index()
         vendas_clientes_mes['Ordem'] = vendas_clientes_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_clientes_mes = vendas_clientes_mes.sort_values('Ordem')
         
@@ -490,7 +466,8 @@ with tab_comparativo:
             st.write("**Colunas df_vendas:**", df_vendas.columns.tolist())
         
         # Filtrar dados apenas dos produtos selecionados
-        df_produtos_filtrado = df_vendas[df_vendas[col_produto].isin(produtos_selecionados)]
+        spec_produtos_filtrado = spec.com_entidade(col_produto, produtos_selecionados)
+        df_produtos_filtrado = spec_produtos_filtrado.vendas()
         
         with st.expander("🔍 Debug - Após Filtro", expanded=False):
             st.write("**Dados filtrados shape:**", df_produtos_filtrado.shape)
@@ -499,7 +476,7 @@ with tab_comparativo:
         
         if not df_produtos_filtrado.empty:
             # Evolução por mês comercial
-            evolucao_produtos = df_produtos_filtrado.groupby(['Mes_Comercial', col_produto])[st.session_state['col_valor']].sum().reset_index()
+            evolucao_produtos = spec_produtos_filtrado.agregar(['Mes_Comercial', col_produto], [st.session_state['col_valor']])
             
             # Gráfico de evolução dos produtos selecionados
             fig_evolucao_prod = go.Figure()
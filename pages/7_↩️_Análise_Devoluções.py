@@ -4,7 +4,7 @@ import plotly.express as px
 import plotly.graph_objects as go
 import sys
 sys.path.append('/workspaces/realh')
-from utils import formatar_moeda, exibir_logo, exibir_top_com_alternancia
+from utils import formatar_moeda, exibir_logo, exibir_top_com_alternancia, FilterSpec
 
 st.set_page_config(page_title="Análise de Devoluções", page_icon="↩️", layout="wide")
 
@@ -22,13 +22,16 @@ Análise completa de devoluções por todas as categorias disponíveis:
 """)
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+
+# Pegar as visões da sessão
+df_vendas = dados.vendas()
+df_devolucoes = dados.devolucoes()
 
 if df_devolucoes.empty:
     st.warning("⚠️ Não há dados de devoluções disponíveis.")
@@ -42,7 +45,7 @@ with st.sidebar.expander("Informações de Debug", expanded=True):
     st.write(f"- Colunas: {list(df_devolucoes.columns)}")
     
     st.write("**DataFrame Original de Devoluções:**")
-    df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+    df_devolucoes_original = dados.devolucoes(filtrada=False)
     st.write(f"- Total original: {len(df_devolucoes_original)}")
     
     st.write("**Colunas configuradas:**")
@@ -90,10 +93,11 @@ st.markdown("### 📊 Resumo de Devoluções")
 
 valor_total = df_vendas[st.session_state['col_valor']].sum()
 valor_devolucoes = df_devolucoes[st.session_state['col_valor']].sum()
-clientes_unicos = df_vendas[st.session_state['col_codCliente']].nunique()
-clientes_devolucao = df_devolucoes[st.session_state['col_codCliente']].nunique()
-pedidos_totais = df_vendas['Pedido_Unico'].nunique()
-pedidos_devolucao = df_devolucoes['Pedido_Unico'].nunique()
+# Exatas: entram nas taxas, nos percentuais e no ticket médio de devolução
+clientes_unicos = FilterSpec(dados).distintos('clientes', modo='exato')
+clientes_devolucao = FilterSpec(dados).distintos('clientes', 'devolucoes', modo='exato')
+pedidos_totais = FilterSpec(dados).distintos('pedidos', modo='exato')
+pedidos_devolucao = FilterSpec(dados).distintos('pedidos', 'devolucoes', modo='exato')
 
 taxa_devolucao_geral = (valor_devolucoes / valor_total * 100) if valor_total > 0 else 0
 faturamento_liquido = valor_total - valor_devolucoes
@@ -147,14 +151,10 @@ col_c3.success(f"✅ **{clientes_sem_devolucao}** clientes ({percentual_clientes
 
 st.markdown("#### 🎯 Top Clientes com Maior Taxa de Devolução")
 
-vendas_por_cliente = df_vendas.groupby(st.session_state['col_codCliente'])[st.session_state['col_valor']].sum().reset_index()
-vendas_por_cliente.columns = ['CodCliente', 'Vendas']
-
-dev_por_cliente = df_devolucoes.groupby(st.session_state['col_codCliente'])[st.session_state['col_valor']].sum().reset_index()
-dev_por_cliente.columns = ['CodCliente', 'Devolucoes']
-
-comparativo_clientes = vendas_por_cliente.merge(dev_por_cliente, on='CodCliente', how='left')
-comparativo_clientes['Devolucoes'] = comparativo_clientes['Devolucoes'].fillna(0)
+# Vendas, devoluções e líquido por cliente num único groupby sobre a tabela de fatos
+comparativo_clientes = FilterSpec(dados).resumo_movimentos(st.session_state['col_codCliente']).reset_index()
+comparativo_clientes.columns = ['CodCliente', 'Vendas', 'Devolucoes', 'Liquido']
+comparativo_clientes = comparativo_clientes[comparativo_clientes['Vendas'] != 0]
 comparativo_clientes['Taxa_Devolucao'] = (comparativo_clientes['Devolucoes'] / comparativo_clientes['Vendas'] * 100).round(2)
 comparativo_clientes = comparativo_clientes[comparativo_clientes['Devolucoes'] != 0]
 comparativo_clientes['Taxa_Abs'] = comparativo_clientes['Taxa_Devolucao'].abs()
@@ -184,13 +184,12 @@ col_produto = st.session_state.get('col_produto', 'Nenhuma')
 # Opção para usar dados originais (sem filtro de período)
 usar_dados_originais = st.checkbox("🔍 Usar dados originais (ignorar filtros de período)", help="Marque para ver se há devoluções nos dados originais")
 
+spec_analise = FilterSpec(dados, filtrada=not usar_dados_originais)
 if usar_dados_originais:
-    df_dev_analise = st.session_state.get('df_devolucoes_original', df_devolucoes)
-    df_vend_analise = st.session_state.get('df_vendas_original', df_vendas)
+    df_dev_analise = dados.devolucoes(filtrada=False)
     st.info("📊 Usando dados originais (todos os períodos)")
 else:
     df_dev_analise = df_devolucoes
-    df_vend_analise = df_vendas
     st.info("📊 Usando dados filtrados pelos filtros globais")
 
 if col_produto == 'Nenhuma' or col_produto not in df_dev_analise.columns:
@@ -198,14 +197,9 @@ if col_produto == 'Nenhuma' or col_produto not in df_dev_analise.columns:
     st.info(f"Coluna configurada: **{col_produto}**")
     st.info(f"Colunas disponíveis: {', '.join(df_dev_analise.columns)}")
 else:
-    vendas_por_produto = df_vend_analise.groupby(col_produto)[st.session_state['col_valor']].sum().reset_index()
-    vendas_por_produto.columns = ['Produto', 'Vendas']
-
-    dev_por_produto = df_dev_analise.groupby(col_produto)[st.session_state['col_valor']].sum().reset_index()
-    dev_por_produto.columns = ['Produto', 'Devolucoes']
-
-    comparativo_produtos = vendas_por_produto.merge(dev_por_produto, on='Produto', how='left')
-    comparativo_produtos['Devolucoes'] = comparativo_produtos['Devolucoes'].fillna(0)
+    comparativo_produtos = spec_analise.resumo_movimentos(col_produto).reset_index()
+    comparativo_produtos.columns = ['Produto', 'Vendas', 'Devolucoes', 'Liquido']
+    comparativo_produtos = comparativo_produtos[comparativo_produtos['Vendas'] != 0]
     comparativo_produtos['Taxa_Devolucao'] = (comparativo_produtos['Devolucoes'] / comparativo_produtos['Vendas'] * 100).round(2)
     comparativo_produtos = comparativo_produtos[comparativo_produtos['Devolucoes'] != 0]
     comparativo_produtos['Dev_Abs'] = comparativo_produtos['Devolucoes'].abs()
@@ -236,14 +230,9 @@ if col_vendedor == 'Nenhuma' or col_vendedor not in df_dev_analise.columns:
     st.info(f"Coluna configurada: **{col_vendedor}**")
     st.info(f"Colunas disponíveis: {', '.join(df_dev_analise.columns)}")
 else:
-    vendas_por_vendedor = df_vend_analise.groupby(col_vendedor)[st.session_state['col_valor']].sum().reset_index()
-    vendas_por_vendedor.columns = ['Vendedor', 'Vendas']
-
-    dev_por_vendedor = df_dev_analise.groupby(col_vendedor)[st.session_state['col_valor']].sum().reset_index()
-    dev_por_vendedor.columns = ['Vendedor', 'Devolucoes']
-
-    comparativo_vendedores = vendas_por_vendedor.merge(dev_por_vendedor, on='Vendedor', how='left')
-    comparativo_vendedores['Devolucoes'] = comparativo_vendedores['Devolucoes'].fillna(0)
+    comparativo_vendedores = spec_analise.resumo_movimentos(col_vendedor).reset_index()
+    comparativo_vendedores.columns = ['Vendedor', 'Vendas', 'Devolucoes', 'Liquido']
+    comparativo_vendedores = comparativo_vendedores[comparativo_vendedores['Vendas'] != 0]
     comparativo_vendedores['Taxa_Devolucao'] = (comparativo_vendedores['Devolucoes'] / comparativo_vendedores['Vendas'] * 100).round(2)
     comparativo_vendedores = comparativo_vendedores[comparativo_vendedores['Devolucoes'] != 0]
     comparativo_vendedores['Taxa_Abs'] = comparativo_vendedores['Taxa_Devolucao'].abs()
@@ -269,14 +258,9 @@ col_linha = st.session_state.get('col_linha', 'Nenhuma')
 if col_linha != "Nenhuma" and col_linha in df_dev_analise.columns:
     st.markdown("### 🏢 Devoluções por Linha de Produto")
     
-    vendas_por_linha = df_vend_analise.groupby(col_linha)[st.session_state['col_valor']].sum().reset_index()
-    vendas_por_linha.columns = ['Linha', 'Vendas']
-    
-    dev_por_linha = df_dev_analise.groupby(col_linha)[st.session_state['col_valor']].sum().reset_index()
-    dev_por_linha.columns = ['Linha', 'Devolucoes']
-    
-    comparativo_linhas = vendas_por_linha.merge(dev_por_linha, on='Linha', how='left')
-    comparativo_linhas['Devolucoes'] = comparativo_linhas['Devolucoes'].fillna(0)
+    comparativo_linhas = spec_analise.resumo_movimentos(col_linha).reset_index()
+    comparativo_linhas.columns = ['Linha', 'Vendas', 'Devolucoes', 'Liquido']
+    comparativo_linhas = comparativo_linhas[comparativo_linhas['Vendas'] != 0]
     comparativo_linhas['Taxa_Devolucao'] = (comparativo_linhas['Devolucoes'] / comparativo_linhas['Vendas'] * 100).round(2)
     comparativo_linhas = comparativo_linhas[comparativo_linhas['Devolucoes'] != 0]
     comparativo_linhas['Taxa_Abs'] = comparativo_linhas['Taxa_Devolucao'].abs()
@@ -305,14 +289,9 @@ col_regiao = st.session_state.get('col_regiao', 'Nenhuma')
 if col_regiao != "Nenhuma" and col_regiao in df_dev_analise.columns:
     st.markdown("### 🌎 Devoluções por Região")
     
-    vendas_por_regiao = df_vend_analise.groupby(col_regiao)[st.session_state['col_valor']].sum().reset_index()
-    vendas_por_regiao.columns = ['Regiao', 'Vendas']
-    
-    dev_por_regiao = df_dev_analise.groupby(col_regiao)[st.session_state['col_valor']].sum().reset_index()
-    dev_por_regiao.columns = ['Regiao', 'Devolucoes']
-    
-    comparativo_regioes = vendas_por_regiao.merge(dev_por_regiao, on='Regiao', how='left')
-    comparativo_regioes['Devolucoes'] = comparativo_regioes['Devolucoes'].fillna(0)
+    comparativo_regioes = spec_analise.resumo_movimentos(col_regiao).reset_index()
+    comparativo_regioes.columns = ['Regiao', 'Vendas', 'Devolucoes', 'Liquido']
+    comparativo_regioes = comparativo_regioes[comparativo_regioes['Vendas'] != 0]
     comparativo_regioes['Taxa_Devolucao'] = (comparativo_regioes['Devolucoes'] / comparativo_regioes['Vendas'] * 100).round(2)
     comparativo_regioes = comparativo_regioes[comparativo_regioes['Devolucoes'] != 0]
     comparativo_regioes['Taxa_Abs'] = comparativo_regioes['Taxa_Devolucao'].abs()
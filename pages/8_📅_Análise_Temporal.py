@@ -6,7 +6,7 @@ import numpy as np
 from scipy import stats
 import sys
 sys.path.append('/workspaces/realh')
-from utils import (calcular_mes_comercial, obter_periodo_mes_comercial, exibir_logo,
+from utils import (calcular_mes_comercial, obter_periodo_mes_comercial, filtrar_mes_comercial, exibir_logo,
                   exibir_filtros_globais, aplicar_filtros_globais, ordenar_mes_comercial, safe_strftime, formatar_moeda)
 
 st.set_page_config(page_title="Análise Temporal", page_icon="📅", layout="wide")
@@ -25,15 +25,18 @@ Descubra o comportamento temporal do seu negócio com análises avançadas:
 """)
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+
+# Pegar as visões da sessão
+df_vendas = dados.vendas()
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = dados.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 # ==============================
@@ -73,16 +76,8 @@ if meses_comerciais_disponiveis:
     # Aplicar filtro de mês (sobre os dados já filtrados pelos filtros globais)
     if mes_selecionado != 'Todos os Meses':
         data_inicio, data_fim = obter_periodo_mes_comercial(mes_selecionado)
-        df_vendas = df_vendas[
-            (df_vendas[st.session_state['col_data']] >= data_inicio) & 
-            (df_vendas[st.session_state['col_data']] <= data_fim)
-        ].copy()
-        
-        if not df_devolucoes.empty:
-            df_devolucoes = df_devolucoes[
-                (df_devolucoes[st.session_state['col_data']] >= data_inicio) & 
-                (df_devolucoes[st.session_state['col_data']] <= data_fim)
-            ].copy()
+        df_vendas = filtrar_mes_comercial(df_vendas, st.session_state['col_data'], mes_selecionado)
+        df_devolucoes = filtrar_mes_comercial(df_devolucoes, st.session_state['col_data'], mes_selecionado)
         
         st.sidebar.info(f"📅 Período: {safe_strftime(data_inicio)} a {safe_strftime(data_fim)}")
     else:
@@ -92,13 +87,14 @@ if meses_comerciais_disponiveis:
 # ANÁLISE DINÂMICA BASEADA NO TIPO SELECIONADO
 # ==============================
 
-df_temporal = df_vendas.copy()
-df_temporal['Data'] = pd.to_datetime(df_temporal[st.session_state['col_data']])
+# A coluna de data já é datetime64 (contrato do dataset); cópia rasa só para receber as colunas auxiliares
+df_temporal = df_vendas.copy(deep=False)
+df_temporal['Data'] = df_temporal[st.session_state['col_data']]
 
 # Preparar dados de devoluções também
 if not df_devolucoes.empty:
-    df_dev_temporal = df_devolucoes.copy()
-    df_dev_temporal['Data'] = pd.to_datetime(df_dev_temporal[st.session_state['col_data']])
+    df_dev_temporal = df_devolucoes.copy(deep=False)
+    df_dev_temporal['Data'] = df_dev_temporal[st.session_state['col_data']]
 else:
     df_dev_temporal = pd.DataFrame()
 
@@ -106,13 +102,13 @@ else:
 if analise_tipo == "dia":
     st.markdown("### 📊 Análise por Data (Diária) com Tendência")
     
-    vendas_por_periodo = df_temporal.groupby('Data')[st.session_state['col_valor']].sum().reset_index()
+    vendas_por_periodo = df_temporal.groupby('Data', observed=True)[st.session_state['col_valor']].sum().reset_index()
     vendas_por_periodo = vendas_por_periodo.sort_values('Data')
     vendas_por_periodo.columns = ['Período', 'Vendas']
     
     # Adicionar devoluções
     if not df_dev_temporal.empty:
-        dev_por_periodo = df_dev_temporal.groupby('Data')[st.session_state['col_valor']].sum().reset_index()
+        dev_por_periodo = df_dev_temporal.groupby('Data', observed=True)[st.session_state['col_valor']].sum().reset_index()
         dev_por_periodo.columns = ['Período', 'Devoluções']
         vendas_por_periodo = vendas_por_periodo.merge(dev_por_periodo, on='Período', how='left').fillna(0)
     else:
@@ -154,7 +150,7 @@ elif analise_tipo == "dia_semana":
     mapa_dias = {0: 'Segunda', 1: 'Terça', 2: 'Quarta', 3: 'Quinta', 4: 'Sexta', 5: 'Sábado', 6: 'Domingo'}
     df_temporal['Dia_Semana'] = df_temporal['Dia_Num'].map(mapa_dias)
     
-    vendas_por_periodo = df_temporal.groupby(['Dia_Num', 'Dia_Semana'])[st.session_state['col_valor']].agg(['sum', 'count', 'mean']).reset_index()
+    vendas_por_periodo = df_temporal.groupby(['Dia_Num', 'Dia_Semana'], observed=True)[st.session_state['col_valor']].agg(['sum', 'count', 'mean']).reset_index()
     vendas_por_periodo.columns = ['Dia_Num', 'Período', 'Vendas', 'Quantidade', 'Ticket_Médio']
     vendas_por_periodo = vendas_por_periodo.sort_values('Dia_Num')
     
@@ -164,7 +160,7 @@ elif analise_tipo == "dia_semana":
         df_dev_temporal['Dia_Num'] = df_dev_temporal['Data'].dt.dayofweek
         df_dev_temporal['Dia_Semana'] = df_dev_temporal['Dia_Num'].map(mapa_dias)
         
-        dev_por_periodo = df_dev_temporal.groupby(['Dia_Num', 'Dia_Semana'])[st.session_state['col_valor']].sum().reset_index()
+        dev_por_periodo = df_dev_temporal.groupby(['Dia_Num', 'Dia_Semana'], observed=True)[st.session_state['col_valor']].sum().reset_index()
         dev_por_periodo.columns = ['Dia_Num', 'Período', 'Devoluções']
         vendas_por_periodo = vendas_por_periodo.merge(dev_por_periodo, on=['Dia_Num', 'Período'], how='left').fillna(0)
     else:
@@ -199,7 +195,7 @@ elif analise_tipo == "semana":
     df_temporal['Ano'] = df_temporal['Data'].dt.year
     df_temporal['Semana_Label'] = "Sem " + df_temporal['Semana'].astype(str) + "/" + df_temporal['Ano'].astype(str)
     
-    vendas_por_periodo = df_temporal.groupby('Semana_Label')[st.session_state['col_valor']].sum().reset_index()
+    vendas_por_periodo = df_temporal.groupby('Semana_Label', observed=True)[st.session_state['col_valor']].sum().reset_index()
     vendas_por_periodo.columns = ['Período', 'Vendas']
     
     # Adicionar devoluções por semana
@@ -208,7 +204,7 @@ elif analise_tipo == "semana":
         df_dev_temporal['Ano'] = df_dev_temporal['Data'].dt.year
         df_dev_temporal['Semana_Label'] = "Sem " + df_dev_temporal['Semana'].astype(str) + "/" + df_dev_temporal['Ano'].astype(str)
         
-        dev_por_periodo = df_dev_temporal.groupby('Semana_Label')[st.session_state['col_valor']].sum().reset_index()
+        dev_por_periodo = df_dev_temporal.groupby('Semana_Label', observed=True)[st.session_state['col_valor']].sum().reset_index()
         dev_por_periodo.columns = ['Período', 'Devoluções']
         vendas_por_periodo = vendas_por_periodo.merge(dev_por_periodo, on='Período', how='left').fillna(0)
     else:
@@ -237,7 +233,7 @@ elif analise_tipo == "mes":
     
     df_temporal['Mês'] = df_temporal['Data'].dt.to_period('M').astype(str)
     
-    vendas_por_periodo = df_temporal.groupby('Mês')[st.session_state['col_valor']].sum().reset_index()
+    vendas_por_periodo = df_temporal.groupby('Mês', observed=True)[st.session_state['col_valor']].sum().reset_index()
     vendas_por_periodo.columns = ['Período', 'Vendas']
     
     fig = go.Figure(go.Bar(x=vendas_por_periodo['Período'], y=vendas_por_periodo['Vendas'], marker_color='#FFA15A',
@@ -253,14 +249,14 @@ elif analise_tipo == "mes":
 elif analise_tipo == "mes_comercial":
     st.markdown("### 🏢 Análise por Mês Comercial")
     
-    vendas_por_periodo = df_vendas_original.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+    vendas_por_periodo = df_vendas_original.groupby('Mes_Comercial', observed=True)[st.session_state['col_valor']].sum().reset_index()
     vendas_por_periodo.columns = ['Período', 'Vendas']
     vendas_por_periodo['Ordem'] = vendas_por_periodo['Período'].apply(ordenar_mes_comercial)
     vendas_por_periodo = vendas_por_periodo.sort_values('Ordem')
     
     # Adicionar devoluções por mês comercial
     if not df_devolucoes_original.empty:
-        dev_por_periodo = df_devolucoes_original.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        dev_por_periodo = df_devolucoes_original.groupby('Mes_Comercial', observed=True)[st.session_state['col_valor']].sum().reset_index()
         dev_por_periodo.columns = ['Período', 'Devoluções']
         vendas_por_periodo = vendas_por_periodo.merge(dev_por_periodo, on='Período', how='left').fillna(0)
     else:
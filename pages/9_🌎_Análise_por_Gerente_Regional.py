@@ -3,7 +3,8 @@ import pandas as pd
 import plotly.graph_objects as go
 import sys
 sys.path.append('/workspaces/realh')
-from utils import (obter_periodo_mes_comercial, exibir_logo, ordenar_mes_comercial, safe_strftime, formatar_moeda, exibir_top_com_alternancia)
+from utils import (obter_periodo_mes_comercial, FilterSpec, exibir_logo, ordenar_mes_comercial, safe_strftime, formatar_moeda, exibir_top_com_alternancia,
+                   formatar_contagem, ajuda_contagem)
 
 st.set_page_config(page_title="Análise por Gerente Regional", page_icon="🌎", layout="wide")
 
@@ -12,21 +13,25 @@ exibir_logo()
 st.title("🌎 Análise por Gerente Regional")
 
 # Verificar se os dados foram carregados
-if 'df_vendas' not in st.session_state:
+if 'dados_sessao' not in st.session_state:
     st.warning("⚠️ Por favor, carregue os dados na página inicial primeiro!")
     st.stop()
 
+# Visões montadas sob demanda pelo handle da sessão (a sessão não guarda DataFrames)
+dados = st.session_state['dados_sessao']
+spec = FilterSpec(dados)
+df_vendas = spec.vendas()
+
 # Verificar se coluna Gerente Regional está configurada
 col_gerente_regional = st.session_state.get('col_gerente_regional', 'Nenhuma')
-if col_gerente_regional == "Nenhuma" or col_gerente_regional not in st.session_state['df_vendas'].columns:
+if col_gerente_regional == "Nenhuma" or col_gerente_regional not in df_vendas.columns:
     st.warning("⚠️ Configure a coluna 'Ger. Regional' na página inicial para visualizar esta análise.")
     st.stop()
 
-# Pegar dados do session_state
-df_vendas = st.session_state['df_vendas']
-df_vendas_original = st.session_state['df_vendas_original']
-df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
-df_devolucoes_original = st.session_state.get('df_devolucoes_original', pd.DataFrame())
+# Pegar as visões da sessão
+df_vendas_original = dados.vendas(filtrada=False)
+df_devolucoes = spec.devolucoes()
+df_devolucoes_original = dados.devolucoes(filtrada=False)
 meses_comerciais_disponiveis = st.session_state.get('meses_comerciais_disponiveis', [])
 
 col_quantidade = st.session_state.get('col_quantidade', 'Nenhuma')
@@ -56,16 +61,9 @@ if meses_comerciais_disponiveis:
     # Aplicar filtro de mês (sobre os dados já filtrados pelos filtros globais)
     if mes_selecionado != 'Todos os Meses':
         data_inicio, data_fim = obter_periodo_mes_comercial(mes_selecionado)
-        df_vendas = df_vendas[
-            (df_vendas[st.session_state['col_data']] >= data_inicio) & 
-            (df_vendas[st.session_state['col_data']] <= data_fim)
-        ].copy()
-        
-        if not df_devolucoes.empty:
-            df_devolucoes = df_devolucoes[
-                (df_devolucoes[st.session_state['col_data']] >= data_inicio) & 
-                (df_devolucoes[st.session_state['col_data']] <= data_fim)
-            ].copy()
+        spec = spec.com_mes_comercial(mes_selecionado)
+        df_vendas = spec.vendas()
+        df_devolucoes = spec.devolucoes()
         
         st.sidebar.info(f"📅 {safe_strftime(data_inicio)} a {safe_strftime(data_fim)}")
     else:
@@ -74,33 +72,8 @@ if meses_comerciais_disponiveis:
 # ==============================
 # PROCESSAR DADOS POR GERENTE REGIONAL
 # ==============================
-vendas_por_gerente = df_vendas.groupby(col_gerente_regional)[st.session_state['col_valor']].sum().sort_values(ascending=False)
-
-if not df_devolucoes.empty and col_gerente_regional in df_devolucoes.columns:
-    devolucoes_por_gerente = df_devolucoes.groupby(col_gerente_regional)[st.session_state['col_valor']].sum()
-else:
-    devolucoes_por_gerente = pd.Series(dtype=float)
-
-# Calcular quantidade e toneladas por gerente
-quantidade_por_gerente = pd.Series(dtype=float)
-toneladas_por_gerente = pd.Series(dtype=float)
-
-if col_quantidade != 'Nenhuma' and col_quantidade in df_vendas.columns:
-    quantidade_por_gerente = df_vendas.groupby(col_gerente_regional)[col_quantidade].sum()
-
-if col_toneladas != 'Nenhuma' and col_toneladas in df_vendas.columns:
-    toneladas_por_gerente = df_vendas.groupby(col_gerente_regional)[col_toneladas].sum()
-
-df_gerentes_analise = pd.DataFrame({
-    'Vendas': vendas_por_gerente,
-    'Devoluções': devolucoes_por_gerente,
-    'Quantidade': quantidade_por_gerente,
-    'Toneladas': toneladas_por_gerente
-}).fillna(0)
-
-df_gerentes_analise['Líquido'] = df_gerentes_analise['Vendas'] - df_gerentes_analise['Devoluções']
-df_gerentes_analise['Taxa Dev. (%)'] = (df_gerentes_analise['Devoluções'] / df_gerentes_analise['Vendas'] * 100).fillna(0)
-df_gerentes_analise = df_gerentes_analise.sort_values('Vendas', ascending=False)
+df_gerentes_analise = spec.resumo_entidades(col_gerente_regional)
+vendas_por_gerente = df_gerentes_analise['Vendas']
 
 # ==============================
 # ABAS DE ANÁLISE
@@ -184,7 +157,8 @@ with tab_detalhes:
     gerente_selecionado = st.selectbox("Selecione um gerente regional:", df_gerentes_analise.index.tolist())
     
     if gerente_selecionado:
-        df_gerente_sel = df_vendas[df_vendas[col_gerente_regional] == gerente_selecionado]
+        spec_gerente_sel = spec.com_entidade(col_gerente_regional, gerente_selecionado)
+        df_gerente_sel = spec_gerente_sel.vendas()
         row_gerente = df_gerentes_analise.loc[gerente_selecionado]
         
         # KPIs do gerente
@@ -207,8 +181,10 @@ with tab_detalhes:
         
         col_a, col_b, col_c, col_d = st.columns(4)
         
-        col_a.metric("📦 Pedidos", df_gerente_sel['Pedido_Unico'].nunique())
-        col_b.metric("👥 Clientes", df_gerente_sel[st.session_state['col_codCliente']].nunique())
+        pedidos_gerente = spec_gerente_sel.distintos('pedidos')
+        clientes_gerente = spec_gerente_sel.distintos('clientes')
+        col_a.metric("📦 Pedidos", formatar_contagem(pedidos_gerente), help=ajuda_contagem(pedidos_gerente))
+        col_b.metric("👥 Clientes", formatar_contagem(clientes_gerente), help=ajuda_contagem(clientes_gerente))
         col_c.metric("🛍️ Produtos", df_gerente_sel[st.session_state['col_produto']].nunique())
         
         # Contar vendedores da equipe
@@ -229,13 +205,13 @@ with tab_detalhes:
         
         with col_top1:
             st.markdown("##### 👤 Top 5 Vendedores da Equipe")
-            top_vendedores = df_gerente_sel.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_vendedores = df_gerente_sel.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (vendedor, valor) in enumerate(top_vendedores.items(), 1):
                 st.write(f"{idx}. **{vendedor}**: {formatar_moeda(valor)}")
         
         with col_top2:
             st.markdown("##### 👥 Top 5 Clientes")
-            top_clientes = df_gerente_sel.groupby(st.session_state['col_cliente'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_clientes = df_gerente_sel.groupby(st.session_state['col_cliente'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (cliente, valor) in enumerate(top_clientes.items(), 1):
                 st.write(f"{idx}. **{cliente}**: {formatar_moeda(valor)}")
         
@@ -246,14 +222,14 @@ with tab_detalhes:
         
         with col_prod1:
             st.markdown("##### 🛍️ Top 5 Produtos por Valor")
-            top_produtos = df_gerente_sel.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_produtos = df_gerente_sel.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (produto, valor) in enumerate(top_produtos.items(), 1):
                 st.write(f"{idx}. **{produto}**: {formatar_moeda(valor)}")
         
         with col_prod2:
             if col_quantidade != 'Nenhuma' and col_quantidade in df_gerente_sel.columns:
                 st.markdown("##### 📦 Top 5 Produtos por Quantidade")
-                top_qtde = df_gerente_sel.groupby(st.session_state['col_produto'])[col_quantidade].sum().sort_values(ascending=False).head(5)
+                top_qtde = df_gerente_sel.groupby(st.session_state['col_produto'], observed=True)[col_quantidade].sum().sort_values(ascending=False).head(5)
                 for idx, (produto, qtde) in enumerate(top_qtde.items(), 1):
                     st.write(f"{idx}. **{produto}**: {qtde:,.0f} un")
 
@@ -267,7 +243,7 @@ with tab_hierarquia:
     gerente_hierarquia = st.selectbox("Selecione um gerente regional:", df_gerentes_analise.index.tolist(), key="gerente_hierarquia")
     
     if gerente_hierarquia:
-        df_gerente_hier = df_vendas[df_vendas[col_gerente_regional] == gerente_hierarquia]
+        df_gerente_hier = spec.com_entidade(col_gerente_regional, gerente_hierarquia).vendas()
         
         st.markdown(f"#### 🌎 Estrutura de {gerente_hierarquia}")
         
@@ -299,7 +275,7 @@ with tab_hierarquia:
                     st.markdown(f"#### 📊 Performance por {nivel_nome}")
                     
                     # Análise por nível
-                    vendas_nivel = df_gerente_hier.groupby(nivel_coluna)[st.session_state['col_valor']].sum().sort_values(ascending=False)
+                    vendas_nivel = df_gerente_hier.groupby(nivel_coluna, observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False)
                     
                     # Top performers do nível
                     st.markdown(f"##### 🏆 Top 10 {nivel_nome}s")
@@ -357,11 +333,12 @@ with tab_evolucao:
     gerente_evolucao = st.selectbox("Selecione um gerente regional:", df_gerentes_analise.index.tolist(), key="gerente_evolucao")
     
     if gerente_evolucao:
-        df_gerente_evolucao = df_vendas_original[df_vendas_original[col_gerente_regional] == gerente_evolucao]
+        spec_gerente_evolucao = FilterSpec(dados, filtrada=False).com_entidade(col_gerente_regional, gerente_evolucao)
+        df_gerente_evolucao = spec_gerente_evolucao.vendas()
         
         # Gráfico de Evolução de Vendas
         st.markdown("#### 💰 Evolução do Valor de Vendas")
-        vendas_por_mes = df_gerente_evolucao.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        vendas_por_mes = spec_gerente_evolucao.agregar('Mes_Comercial', [st.session_state['col_valor']])
         vendas_por_mes['Ordem'] = vendas_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_por_mes = vendas_por_mes.sort_values('Ordem')
         
@@ -393,7 +370,7 @@ with tab_evolucao:
         with col_ev1:
             if col_quantidade != 'Nenhuma' and col_quantidade in df_gerente_evolucao.columns:
                 st.markdown("#### 📦 Evolução da Quantidade")
-                qtde_por_mes = df_gerente_evolucao.groupby('Mes_Comercial')[col_quantidade].sum().reset_index()
+                qtde_por_mes = spec_gerente_evolucao.agregar('Mes_Comercial', [col_quantidade])
                 qtde_por_mes['Ordem'] = qtde_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
                 qtde_por_mes = qtde_por_mes.sort_values('Ordem')
                 
@@ -420,7 +397,7 @@ with tab_evolucao:
         with col_ev2:
             if col_toneladas != 'Nenhuma' and col_toneladas in df_gerente_evolucao.columns:
                 st.markdown("#### ⚖️ Evolução das Toneladas")
-                ton_por_mes = df_gerente_evolucao.groupby('Mes_Comercial')[col_toneladas].sum().reset_index()
+                ton_por_mes = spec_gerente_evolucao.agregar('Mes_Comercial', [col_toneladas])
                 ton_por_mes['Ordem'] = ton_por_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
                 ton_por_mes = ton_por_mes.sort_values('Ordem')
                 
@@ -449,9 +426,9 @@ with tab_evolucao:
         # Evolução dos top vendedores da equipe
         st.markdown("#### 👤 Evolução dos Top 5 Vendedores da Equipe")
         
-        top_vendedores_equipe = df_gerente_evolucao.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5).index.tolist()
+        top_vendedores_equipe = df_gerente_evolucao.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5).index.tolist()
         
-        vendas_vendedores_mes = df_gerente_evolucao[df_gerente_evolucao[st.session_state['col_vendedor']].isin(top_vendedores_equipe)].groupby(['Mes_Comercial', st.session_state['col_vendedor']])[st.session_state['col_valor']].sum().reset_index()
+        vendas_vendedores_mes = df_gerente_evolucao[df_gerente_evolucao[st.session_state['col_vendedor']].isin(top_vendedores_equipe)].groupby(['Mes_Comercial', st.session_state['col_vendedor']], observed=True)[st.session_state['col_valor']].sum().reset_index()
         vendas_vendedores_mes['Ordem'] = vendas_vendedores_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_vendedores_mes = vendas_vendedores_mes.sort_values('Ordem')
         
@@ -499,8 +476,10 @@ with tab_comparativo:
         gerente_b = st.selectbox("Gerente Regional B:", gerentes_disponiveis_b, key="gerente_b") if gerentes_disponiveis_b else None
     
     if gerente_a and gerente_b:
-        df_gerente_a = df_vendas_original[df_vendas_original[col_gerente_regional] == gerente_a]
-        df_gerente_b = df_vendas_original[df_vendas_original[col_gerente_regional] == gerente_b]
+        spec_gerente_a = FilterSpec(dados, filtrada=False).com_entidade(col_gerente_regional, gerente_a)
+        df_gerente_a = spec_gerente_a.vendas()
+        spec_gerente_b = FilterSpec(dados, filtrada=False).com_entidade(col_gerente_regional, gerente_b)
+        df_gerente_b = spec_gerente_b.vendas()
         
         # KPIs Comparativos
         st.markdown("---")
@@ -518,16 +497,17 @@ with tab_comparativo:
             st.metric("💰 Vendas - B", formatar_moeda(vendas_b), delta=f"{delta_vendas:+.1f}%")
         
         # Clientes
-        clientes_a = df_gerente_a[st.session_state['col_codCliente']].nunique()
-        clientes_b = df_gerente_b[st.session_state['col_codCliente']].nunique()
+        # Exatas: entram nas diferenças entre os gerentes e no ticket médio
+        clientes_a = spec_gerente_a.distintos('clientes', modo='exato')
+        clientes_b = spec_gerente_b.distintos('clientes', modo='exato')
         
         with col2:
             st.metric("👥 Clientes - A", f"{clientes_a:,}")
             st.metric("👥 Clientes - B", f"{clientes_b:,}", delta=f"{clientes_a - clientes_b:+,}")
         
         # Pedidos
-        pedidos_a = df_gerente_a['Pedido_Unico'].nunique()
-        pedidos_b = df_gerente_b['Pedido_Unico'].nunique()
+        pedidos_a = spec_gerente_a.distintos('pedidos', modo='exato')
+        pedidos_b = spec_gerente_b.distintos('pedidos', modo='exato')
         
         with col3:
             st.metric("📦 Pedidos - A", f"{pedidos_a:,}")
@@ -556,11 +536,11 @@ with tab_comparativo:
         st.markdown("#### 📈 Evolução Comparativa de Vendas")
         
         # Preparar dados de evolução
-        vendas_a_mes = df_gerente_a.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        vendas_a_mes = spec_gerente_a.agregar('Mes_Comercial', [st.session_state['col_valor']])
         vendas_a_mes['Ordem'] = vendas_a_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_a_mes = vendas_a_mes.sort_values('Ordem')
         
-        vendas_b_mes = df_gerente_b.groupby('Mes_Comercial')[st.session_state['col_valor']].sum().reset_index()
+        vendas_b_mes = spec_gerente_b.agregar('Mes_Comercial', [st.session_state['col_valor']])
         vendas_b_mes['Ordem'] = vendas_b_mes['Mes_Comercial'].apply(ordenar_mes_comercial)
         vendas_b_mes = vendas_b_mes.sort_values('Ordem')
         
@@ -665,13 +645,13 @@ with tab_comparativo:
         
         with col_prod_a:
             st.markdown(f"##### {gerente_a}")
-            top_prod_a = df_gerente_a.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_prod_a = df_gerente_a.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (produto, valor) in enumerate(top_prod_a.items(), 1):
                 st.write(f"{idx}. **{produto}**: {formatar_moeda(valor)}")
         
         with col_prod_b:
             st.markdown(f"##### {gerente_b}")
-            top_prod_b = df_gerente_b.groupby(st.session_state['col_produto'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_prod_b = df_gerente_b.groupby(st.session_state['col_produto'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (produto, valor) in enumerate(top_prod_b.items(), 1):
                 st.write(f"{idx}. **{produto}**: {formatar_moeda(valor)}")
         
@@ -684,13 +664,13 @@ with tab_comparativo:
         
         with col_vend_a:
             st.markdown(f"##### {gerente_a}")
-            top_vend_a = df_gerente_a.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_vend_a = df_gerente_a.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (vendedor, valor) in enumerate(top_vend_a.items(), 1):
                 st.write(f"{idx}. **{vendedor}**: {formatar_moeda(valor)}")
         
         with col_vend_b:
             st.markdown(f"##### {gerente_b}")
-            top_vend_b = df_gerente_b.groupby(st.session_state['col_vendedor'])[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
+            top_vend_b = df_gerente_b.groupby(st.session_state['col_vendedor'], observed=True)[st.session_state['col_valor']].sum().sort_values(ascending=False).head(5)
             for idx, (vendedor, valor) in enumerate(top_vend_b.items(), 1):
                 st.write(f"{idx}. **{vendedor}**: {formatar_moeda(valor)}")
     else:
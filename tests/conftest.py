@@ -0,0 +1,71 @@
+"""
+Fixtures dos testes: datasets sintéticos gravados como snapshot num diretório temporário
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+CONFIG = {
+    'col_data': 'Data', 'col_valor': 'Valor', 'col_quantidade': 'Qtd', 'col_toneladas': 'Ton',
+    'col_cliente': 'Cliente', 'col_codCliente': 'CodCliente', 'col_produto': 'Produto',
+    'col_vendedor': 'Vendedor', 'col_linha': 'Linha', 'col_gerente': 'Gerente',
+}
+
+def gerar_tabela(rng, linhas, com_hora, fracao_linha_vazia=0.05):
+    """Linhas de venda (ou devolução) de jan a jun/2024, com algumas linhas de produto vazias"""
+    from utils import calcular_meses_comerciais
+
+    segundos = np.sort(rng.integers(0, 180 * 86400, linhas))
+    datas = pd.Timestamp('2024-01-01') + pd.to_timedelta(segundos, unit='s')
+    if not com_hora:
+        datas = datas.normalize()
+    clientes = rng.integers(0, 3000, linhas)
+    df = pd.DataFrame({
+        'Data': datas,
+        'Gerente': rng.choice(['G1', 'G2', 'G3'], linhas),
+        'Linha': rng.choice(['L1', 'L2', 'L3', 'L4'], linhas).astype(object),
+        'Produto': rng.choice([f'P{i:02d}' for i in range(25)], linhas),
+        'Vendedor': rng.choice([f'V{i:02d}' for i in range(15)], linhas),
+        'Cliente': [f'Cliente {c}' for c in clientes],
+        'CodCliente': [f'C{c}' for c in clientes],
+        'Valor': rng.random(linhas) * 1000,
+        'Qtd': rng.integers(1, 20, linhas).astype(float),
+        'Ton': rng.random(linhas),
+    })
+    df.loc[rng.random(linhas) < fracao_linha_vazia, 'Linha'] = None
+    df['Pedido_Unico'] = df['CodCliente'] + '_' + rng.integers(0, 4000, linhas).astype(str)
+    chaves, rotulos = calcular_meses_comerciais(df['Data'])
+    df['Mes_Comercial_Chave'] = chaves
+    df['Mes_Comercial'] = rotulos.astype(str)
+    return df
+
+def _gravar_dataset(diretorio, seed, com_hora):
+    from dados import codificar_dimensoes, gravar_snapshot
+
+    rng = np.random.default_rng(seed)
+    df_vendas = codificar_dimensoes(gerar_tabela(rng, 20_000, com_hora), CONFIG)
+    df_devolucoes = codificar_dimensoes(gerar_tabela(rng, 2_000, com_hora), CONFIG)
+    gravar_snapshot(diretorio, df_vendas, df_devolucoes, dict(CONFIG))
+    return str(diretorio)
+
+@pytest.fixture(scope='session', params=[False, True], ids=['datas_sem_hora', 'datas_com_hora'])
+def dataset(request, tmp_path_factory):
+    """Diretório de um snapshot com vendas e devoluções (datas só com o dia ou com hora)"""
+    com_hora = request.param
+    return _gravar_dataset(tmp_path_factory.mktemp('dados'), seed=7, com_hora=com_hora), com_hora
+
+@pytest.fixture
+def sessao(dataset):
+    """Fábrica de DadosSessao sobre o dataset (hierarquia e filtros globais opcionais)"""
+    from utils import DadosSessao
+
+    diretorio, _ = dataset
+
+    def criar(hierarquia=None, filtros=None):
+        return DadosSessao(diretorio, hierarquia, CONFIG, filtros)
+    return criar
@@ -0,0 +1,190 @@
+"""
+O cubo de agregados tem que responder exatamente o que o groupby nas linhas do recorte responde
+"""
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import CONFIG
+
+MEDIDAS = ['Valor', 'Qtd', 'Ton']
+HIERARQUIA_G2 = {'nivel': 'gerente', 'valor': 'G2'}
+
+def _agregado_linhas(spec, dimensoes, medidas, tabela):
+    """Referência: groupby direto nas linhas do recorte"""
+    return spec.executar(tabela).groupby(dimensoes, observed=True)[medidas].sum().reset_index()
+
+def _normalizar(df, dimensoes):
+    df = df.copy()
+    for col in dimensoes:
+        df[col] = df[col].astype(str)
+    return df.sort_values(dimensoes, ignore_index=True)
+
+def _conferir(spec, dimensoes, medidas=MEDIDAS, tabela='vendas'):
+    obtido = _normalizar(spec.agregar(dimensoes, medidas, tabela), dimensoes)
+    esperado = _normalizar(_agregado_linhas(spec, dimensoes, medidas, tabela), dimensoes)
+    assert len(obtido) == len(esperado)
+    assert (obtido[dimensoes].values == esperado[dimensoes].values).all()
+    for col in medidas:
+        np.testing.assert_allclose(obtido[col].astype(float), esperado[col].astype(float), rtol=1e-9)
+
+def _usa_cubo(spec, dimensoes, tabela='vendas'):
+    plano = spec.compilar(tabela)
+    return not plano['vazio'] and spec._consulta_cubo(plano, dimensoes) is not None
+
+@pytest.mark.parametrize('dimensoes', [['Mes_Comercial'], ['Linha'], ['Mes_Comercial', 'Linha'], ['Produto', 'Vendedor']])
+@pytest.mark.parametrize('tabela', ['vendas', 'devolucoes'])
+def test_sem_filtros_igual_ao_groupby(sessao, dimensoes, tabela):
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao())
+    assert _usa_cubo(spec, dimensoes, tabela)
+    _conferir(spec, dimensoes, tabela=tabela)
+
+def test_linha_vazia_conta_no_total_do_mes(sessao):
+    """Linhas sem linha de produto ficam de fora do agrupamento por linha, mas não do mês"""
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao())
+    df = spec.vendas()
+    assert df['Linha'].isna().any()
+    total_mes = spec.agregar(['Mes_Comercial'], ['Valor'])['Valor'].sum()
+    total_linha = spec.agregar(['Linha'], ['Valor'])['Valor'].sum()
+    assert total_mes == pytest.approx(df['Valor'].sum())
+    assert total_linha == pytest.approx(df.loc[df['Linha'].notna(), 'Valor'].sum())
+
+@pytest.mark.parametrize('dimensoes', [['Mes_Comercial'], ['Linha', 'Produto']])
+def test_hierarquia_e_filtros_globais(sessao, dimensoes):
+    from utils import FilterSpec
+
+    filtros = {'linhas': ['L1', 'L3'], 'vendedores': ['V01', 'V02', 'V07']}
+    spec = FilterSpec(sessao(HIERARQUIA_G2, filtros))
+    assert _usa_cubo(spec, dimensoes)
+    _conferir(spec, dimensoes)
+    assert set(spec.vendas()['Gerente'].astype(str)) == {'G2'}
+
+def test_mes_comercial_e_entidade(sessao):
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao(HIERARQUIA_G2)).com_mes_comercial('Mar/2024').com_entidade('Linha', 'L2')
+    assert _usa_cubo(spec, ['Produto'])
+    _conferir(spec, ['Produto'])
+    _conferir(spec, ['Vendedor'], tabela='devolucoes')
+
+def test_periodo_global_com_fim_a_meia_noite(sessao, dataset):
+    """O filtro global usa data_fim à meia-noite: com hora nas datas o cubo não pode responder"""
+    from utils import FilterSpec
+
+    _, com_hora = dataset
+    filtros = {'data_inicio': dt.date(2024, 2, 10), 'data_fim': dt.date(2024, 4, 20)}
+    spec = FilterSpec(sessao(HIERARQUIA_G2, filtros))
+    assert _usa_cubo(spec, ['Linha']) is (not com_hora)
+    _conferir(spec, ['Linha'])
+    _conferir(spec, ['Mes_Comercial', 'Produto'])
+
+def test_periodo_quebrado_no_meio_do_dia(sessao, dataset):
+    from utils import FilterSpec
+
+    _, com_hora = dataset
+    spec = FilterSpec(sessao()).com_periodo(pd.Timestamp('2024-03-05 12:00'), pd.Timestamp('2024-04-10 08:30'))
+    assert _usa_cubo(spec, ['Linha']) is (not com_hora)
+    _conferir(spec, ['Linha'])
+
+def test_filtro_fora_do_grao_cai_para_as_linhas(sessao):
+    """Cliente não é dimensão do cubo: a consulta volta ao groupby nas linhas"""
+    from cubo import pode_responder
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao(filtros={'clientes': ['Cliente 1', 'Cliente 2', 'Cliente 3']}))
+    plano = spec.compilar('vendas')
+    cubo = plano['registro'].cubo()
+    assert 'Cliente' not in cubo.columns
+    assert not pode_responder(cubo, ['Linha'], {'Cliente': ['Cliente 1']})
+    assert not pode_responder(cubo, ['Cliente'])
+    assert spec._consulta_cubo(plano, ['Linha']) is None
+    _conferir(spec, ['Linha'])
+
+def test_selecao_por_mes_comercial_cai_para_as_linhas(sessao):
+    """'Mes_Comercial' é só agrupamento no cubo: selecionar por ele volta às linhas sem KeyError"""
+    from cubo import pode_responder
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao()).com_entidade('Mes_Comercial', ['Mar/2024', 'Abr/2024'])
+    plano = spec.compilar('vendas')
+    assert pode_responder(plano['registro'].cubo(), ['Mes_Comercial'])
+    assert not pode_responder(plano['registro'].cubo(), ['Linha'], {'Mes_Comercial': ['Mar/2024']})
+    assert not _usa_cubo(spec, ['Linha'])
+    _conferir(spec, ['Linha'])
+
+@pytest.mark.parametrize('dimensoes', [['Mes_Comercial'], ['Mes_Comercial', 'Linha'], ['Linha', 'Mes_Comercial']])
+def test_meses_em_ordem_cronologica_no_cubo_e_nas_linhas(sessao, dimensoes):
+    """Sem reordenar o resultado: cubo e groupby nas linhas devolvem as mesmas linhas, meses pela data"""
+    from cubo import ordenar_por_mes
+    from utils import FilterSpec, chave_de_rotulo_mes_comercial
+
+    pelo_cubo = FilterSpec(sessao())
+    pelas_linhas = FilterSpec(sessao(filtros={'clientes': [f'Cliente {i}' for i in range(1, 40)]}))
+    assert _usa_cubo(pelo_cubo, dimensoes) and not _usa_cubo(pelas_linhas, dimensoes)
+    for spec in (pelo_cubo, pelas_linhas):
+        resultado = spec.agregar(dimensoes, ['Valor'])
+        chaves = resultado['Mes_Comercial'].map(chave_de_rotulo_mes_comercial)
+        if dimensoes[0] == 'Mes_Comercial':
+            assert chaves.is_monotonic_increasing
+        else:
+            assert chaves.groupby(resultado['Linha'].astype(str), sort=False).apply(lambda s: s.is_monotonic_increasing).all()
+    a = pelo_cubo.agregar(dimensoes, ['Valor'])
+    b = ordenar_por_mes(pelo_cubo.executar('vendas').groupby(dimensoes, observed=True)['Valor'].sum().reset_index(), dimensoes)
+    for col in dimensoes:
+        assert (a[col].astype(str).values == b[col].astype(str).values).all()
+    np.testing.assert_allclose(a['Valor'].astype(float), b['Valor'].astype(float), rtol=1e-9)
+
+def test_medida_ou_dimensao_fora_do_cubo(sessao):
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao())
+    assert not _usa_cubo(spec, ['CodCliente'])
+    _conferir(spec, ['CodCliente'], ['Valor'])
+
+def test_resumo_entidades_igual_as_linhas(sessao):
+    from utils import FilterSpec
+
+    spec = FilterSpec(sessao(HIERARQUIA_G2)).com_mes_comercial('Abr/2024')
+    resumo = spec.resumo_entidades('Produto')
+    vendas, devolucoes = spec.vendas(), spec.devolucoes()
+    esperado = pd.DataFrame({
+        'Vendas': vendas.groupby('Produto', observed=True)['Valor'].sum(),
+        'Devoluções': devolucoes.groupby('Produto', observed=True)['Valor'].sum(),
+        'Quantidade': vendas.groupby('Produto', observed=True)['Qtd'].sum(),
+    }).fillna(0)
+    esperado = esperado.loc[resumo.index]
+    for col in esperado.columns:
+        np.testing.assert_allclose(resumo[col], esperado[col])
+
+def test_incremental_igual_a_montagem_completa(dataset, tmp_path):
+    """Regravar meses no cubo do snapshot dá o mesmo cubo que montar tudo de novo"""
+    from conftest import gerar_tabela
+    from cubo import montar_cubo
+    from dados import codificar_dimensoes, gravar_snapshot, mesclar_snapshot, obter_registro
+
+    _, com_hora = dataset
+    rng = np.random.default_rng(11)
+    diretorio = tmp_path / 'incremental'
+    gravar_snapshot(diretorio, codificar_dimensoes(gerar_tabela(rng, 5_000, com_hora), CONFIG),
+                    codificar_dimensoes(gerar_tabela(rng, 500, com_hora), CONFIG), dict(CONFIG))
+    novas = gerar_tabela(rng, 1_000, com_hora)
+    novas = novas[novas['Mes_Comercial_Chave'] == novas['Mes_Comercial_Chave'].iloc[-1]]
+    mesclar_snapshot(diretorio, codificar_dimensoes(novas.reset_index(drop=True), CONFIG), pd.DataFrame(), dict(CONFIG))
+
+    registro = obter_registro(diretorio)
+    cubo = registro.cubo()
+    df_vendas, df_devolucoes, config = registro.obter(compartilhado=True)
+    completo = montar_cubo(df_vendas, df_devolucoes, config)
+    chaves = [c for c in completo.columns if not c.startswith(('vendas_', 'devolucoes_'))]
+    a = _normalizar(cubo, chaves)
+    b = _normalizar(completo, chaves)
+    assert len(a) == len(b)
+    for col in completo.columns:
+        if col not in chaves:
+            np.testing.assert_allclose(a[col].astype(float), b[col].astype(float))
@@ -0,0 +1,99 @@
+"""
+Esboços de distintos por célula: exatos iguais ao nunique, aproximados dentro do erro do HyperLogLog
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from cubo import BITS_HLL, LIMIAR_CELULA_DENSA, EsbocoDistintos
+
+# Erro padrão do HyperLogLog com 2^BITS_HLL registradores; os testes aceitam 3 erros padrão
+ERRO_PADRAO_HLL = 1.04 / np.sqrt(1 << BITS_HLL)
+TOLERANCIA_HLL = 3 * ERRO_PADRAO_HLL
+
+TOTAL_CELULAS = 60
+CELULAS_DENSAS = [0, 1, 2]
+
+@pytest.fixture(scope='module')
+def linhas():
+    """Linhas sintéticas: três células densas (acima de LIMIAR_CELULA_DENSA ids) e várias pequenas"""
+    rng = np.random.default_rng(3)
+    total_ids = 200_000
+    partes_celulas, partes_codigos = [], []
+    for celula in range(TOTAL_CELULAS):
+        if celula in CELULAS_DENSAS:
+            # Ids sobrepostos entre as células densas e repetidos dentro de cada uma
+            inicio = celula * 3_000
+            codigos = rng.integers(inicio, inicio + 3 * LIMIAR_CELULA_DENSA, 6 * LIMIAR_CELULA_DENSA)
+        else:
+            codigos = rng.integers(0, total_ids, rng.integers(0, 3_000))
+        partes_celulas.append(np.full(len(codigos), celula))
+        partes_codigos.append(codigos)
+    celulas = np.concatenate(partes_celulas)
+    codigos = np.concatenate(partes_codigos)
+    # Linhas fora do cubo e ids vazios não contam
+    celulas[rng.random(len(celulas)) < 0.01] = -1
+    codigos[rng.random(len(codigos)) < 0.01] = -1
+    valores = np.array([f'ID{i}' for i in range(total_ids)], dtype=object)
+    return celulas, codigos, valores
+
+@pytest.fixture(scope='module')
+def esboco(linhas):
+    celulas, codigos, valores = linhas
+    return EsbocoDistintos(celulas, codigos, valores, TOTAL_CELULAS)
+
+def _nunique(linhas, selecionadas):
+    celulas, codigos, _ = linhas
+    mascara = np.isin(celulas, selecionadas) & (codigos >= 0)
+    return pd.Series(codigos[mascara]).nunique()
+
+def _recortes():
+    rng = np.random.default_rng(5)
+    return {
+        'todas': np.arange(TOTAL_CELULAS),
+        'nenhuma': np.array([], dtype=np.int64),
+        'uma_densa': np.array([0]),
+        'densas': np.array(CELULAS_DENSAS),
+        'densas_e_pequenas': np.array(CELULAS_DENSAS + [10, 11, 40]),
+        'pequenas': np.arange(3, TOTAL_CELULAS),
+        'aleatorio': np.sort(rng.choice(TOTAL_CELULAS, 25, replace=False)),
+    }
+
+def test_ha_celulas_densas(esboco):
+    assert set(CELULAS_DENSAS) <= set(esboco.densas.tolist())
+
+@pytest.mark.parametrize('nome, selecionadas', list(_recortes().items()))
+def test_exato_igual_ao_nunique(linhas, esboco, nome, selecionadas):
+    assert esboco.contar(selecionadas, 'exato') == _nunique(linhas, selecionadas)
+    assert not esboco.aproxima(selecionadas, 'exato')
+
+@pytest.mark.parametrize('nome, selecionadas', [(n, s) for n, s in _recortes().items() if n != 'nenhuma'])
+def test_aproximado_dentro_do_erro(linhas, esboco, nome, selecionadas):
+    esperado = _nunique(linhas, selecionadas)
+    estimado = esboco.contar(selecionadas, 'aproximado')
+    assert esboco.aproxima(selecionadas, 'aproximado')
+    assert abs(estimado - esperado) <= TOLERANCIA_HLL * esperado
+
+def test_auto_respeita_o_limiar(linhas, esboco):
+    selecionadas = np.arange(TOTAL_CELULAS)
+    volume = esboco.volume(selecionadas)
+    assert esboco.contar(selecionadas, 'auto', limiar=volume) == _nunique(linhas, selecionadas)
+    assert not esboco.aproxima(selecionadas, 'auto', limiar=volume)
+    assert esboco.aproxima(selecionadas, 'auto', limiar=volume - 1)
+
+@pytest.mark.parametrize('nome', ['clientes', 'pedidos'])
+@pytest.mark.parametrize('tabela', ['vendas', 'devolucoes'])
+def test_distintos_do_recorte_igual_ao_nunique(sessao, nome, tabela):
+    """Pelo cubo (com hierarquia, filtros e mês) o modo exato bate com o nunique das linhas"""
+    from utils import FilterSpec
+
+    coluna = 'CodCliente' if nome == 'clientes' else 'Pedido_Unico'
+    especificacoes = [
+        FilterSpec(sessao()),
+        FilterSpec(sessao({'nivel': 'gerente', 'valor': 'G2'}, {'linhas': ['L1', 'L4']})).com_mes_comercial('Fev/2024'),
+        FilterSpec(sessao(filtros={'clientes': ['Cliente 1', 'Cliente 2']})),
+    ]
+    for spec in especificacoes:
+        contagem = spec.distintos(nome, tabela, modo='exato')
+        assert contagem == spec.executar(tabela)[coluna].nunique()
+        assert not contagem.aproximado
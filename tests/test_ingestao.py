@@ -0,0 +1,25 @@
+"""
+Conversão de valores em texto na ingestão: o formato numérico é decidido pela coluna inteira
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.mark.parametrize('valores, esperado', [
+    (['1.234,56', '1.234', '12,5', '850', None], [1234.56, 1234.0, 12.5, 850.0, np.nan]),
+    (['1,234.56', '1.234', '12', '2,000', None], [1234.56, 1.234, 12.0, 2000.0, np.nan]),
+    (['1.5', '2', 3.25, '1e3'], [1.5, 2.0, 3.25, 1000.0]),
+], ids=['brasileiro', 'milhar_com_virgula', 'ponto_decimal'])
+def test_para_numero_decide_o_formato_pela_coluna(valores, esperado):
+    from ingestao import _para_numero
+
+    obtido = _para_numero(pd.Series(valores, dtype=object))
+    np.testing.assert_allclose(obtido.to_numpy(), np.array(esperado, dtype=float))
+
+def test_para_numero_fora_do_formato_vira_invalido():
+    """Numa coluna brasileira "1,234.56" não é lido pela metade: fica NaN e entra no diagnóstico"""
+    from ingestao import _para_numero
+
+    obtido = _para_numero(pd.Series(['1.234,56', '10,00', '1,234.56'], dtype=object))
+    assert obtido.tolist()[:2] == [1234.56, 10.0]
+    assert np.isnan(obtido.iloc[2])
@@ -0,0 +1,68 @@
+"""
+O registro do dataset continua servindo a versão carregada enquanto outra sessão recarrega
+"""
+import threading
+
+import pandas as pd
+import pytest
+
+def test_invalidar_nao_deixa_sessoes_sem_dados(dataset):
+    from dados import RegistroDataset
+
+    diretorio, _ = dataset
+    registro = RegistroDataset(diretorio)
+    df_vendas, _, _ = registro.obter(compartilhado=True)
+    versao = registro.versao()
+
+    carregar = registro._carregar
+    recarregando, liberar = threading.Event(), threading.Event()
+
+    def carregar_devagar():
+        recarregando.set()
+        liberar.wait(5)
+        return carregar()
+
+    registro._carregar = carregar_devagar
+    registro.invalidar()
+    recarga = threading.Thread(target=registro.obter)
+    recarga.start()
+    try:
+        assert recarregando.wait(5)
+        # Durante a recarga o conteúdo atual continua sendo a versão anterior inteira
+        dados, _, versao_atual = registro._atual
+        assert dados[0] is df_vendas and versao_atual == versao
+    finally:
+        liberar.set()
+        recarga.join()
+    novo, _, _ = registro.obter(compartilhado=True)
+    assert novo is not None and len(novo) == len(df_vendas)
+    assert registro.versao() == versao
+
+def test_carregar_particoes_le_so_o_mes_pedido(dataset):
+    from dados import DEVOLUCOES, VENDAS, carregar_particoes, obter_registro
+    from utils import chave_de_rotulo_mes_comercial
+
+    diretorio, _ = dataset
+    for tabela in (VENDAS, DEVOLUCOES):
+        completo = obter_registro(diretorio).tabela(tabela)
+        esperado = completo[completo['Mes_Comercial'].astype(str).isin(['Mar/2024', 'Abr/2024'])]
+        lido = carregar_particoes(diretorio, tabela, meses=['Mar/2024', chave_de_rotulo_mes_comercial('Abr/2024')],
+                                  colunas=['Data', 'Valor', 'Linha'])
+        assert list(lido.columns) == ['Data', 'Valor', 'Linha']
+        assert len(lido) == len(esperado)
+        assert lido['Valor'].sum() == pytest.approx(esperado['Valor'].sum())
+        assert isinstance(lido['Linha'].dtype, pd.CategoricalDtype)
+
+def test_preparar_fatias_inclui_tabela_de_fatos(dataset):
+    from conftest import CONFIG
+    from dados import FATOS, RegistroDataset, selecao_hierarquia
+
+    diretorio, _ = dataset
+    registro = RegistroDataset(diretorio)
+    hierarquia = {'nivel': 'gerente', 'valor': 'G2'}
+    assert registro.preparar_fatias_hierarquia([hierarquia, None]) == 1
+    selecao = selecao_hierarquia(hierarquia, CONFIG, registro.tabela(FATOS).columns)
+    assert any(chave[0] == FATOS for chave in registro._fatias)
+    fatos = registro.tabela(FATOS)
+    posicoes = registro.fatia_hierarquia(FATOS, selecao)
+    assert set(fatos['Gerente'].iloc[posicoes].astype(str)) == {'G2'}
@@ -1,11 +1,13 @@
 """
 Funções utilitárias compartilhadas entre as páginas do dashboard
 """
+import numpy as np
 import pandas as pd
 import streamlit as st
-from dateutil.relativedelta import relativedelta
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import os
+import threading
 
 # ==============================
 # FUNÇÕES DE SEGURANÇA
@@ -57,6 +59,61 @@ def safe_strftime(date_value, format_str='%d/%m/%Y'):
 # ==============================
 # FUNÇÕES DE MÊS COMERCIAL
 # ==============================
+MESES_PT = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+MESES_PT_INV = {nome: i + 1 for i, nome in enumerate(MESES_PT)}
+
+def chave_mes_comercial(ano, mes, dia):
+    """
+    Chave inteira do mês comercial: ano*12 + mês, após deslocar dias < 16 para o mês anterior.
+    Funciona tanto com escalares quanto com arrays numpy/Series (mesma aritmética).
+    """
+    return ano * 12 + mes - (dia < 16)
+
+def rotulo_mes_comercial(chave):
+    """Converte a chave inteira no rótulo "MMM/YYYY" (ex: 24297 -> "Set/2024")"""
+    ano, mes_idx = divmod(int(chave) - 1, 12)
+    return f"{MESES_PT[mes_idx]}/{ano}"
+
+def chave_de_rotulo_mes_comercial(mes_comercial_str):
+    """Converte o rótulo "MMM/YYYY" na chave inteira do mês comercial"""
+    mes_str, ano_str = mes_comercial_str.split('/')
+    return int(ano_str) * 12 + MESES_PT_INV[mes_str]
+
+def calcular_meses_comerciais(datas):
+    """
+    Versão vetorizada de calcular_mes_comercial para uma coluna inteira de datas.
+    
+    Args:
+        datas: Series com datas (datetime64 ou convertível)
+    
+    Returns:
+        tuple: (Series Int32 com a chave ano*12+mês, Series categórica ordenada com o rótulo "MMM/YYYY")
+    """
+    if not pd.api.types.is_datetime64_any_dtype(datas):
+        datas = pd.to_datetime(datas, errors='coerce')
+    valores = datas.to_numpy(dtype='datetime64[ns]')
+    validos = ~pd.isna(valores)
+    
+    # Meses desde 1970-01 e dia do mês, sem passar por objetos Python
+    meses_epoch = valores.astype('datetime64[M]')
+    dia = (valores - meses_epoch).astype('timedelta64[D]').astype('int64') + 1
+    meses_epoch = meses_epoch.astype('int64')
+    chaves = chave_mes_comercial(1970 + meses_epoch // 12, meses_epoch % 12 + 1, dia)
+    
+    chaves = pd.Series(pd.array(np.where(validos, chaves, 0), dtype='Int32'), index=datas.index)
+    chaves[~validos] = pd.NA
+    
+    categorias_chave = np.sort(chaves.dropna().unique().astype('int64'))
+    rotulos = pd.Series(
+        pd.Categorical.from_codes(
+            np.where(validos, np.searchsorted(categorias_chave, chaves.fillna(0).to_numpy('int64')), -1),
+            categories=[rotulo_mes_comercial(c) for c in categorias_chave],
+            ordered=True
+        ),
+        index=datas.index
+    )
+    return chaves, rotulos
+
 def calcular_mes_comercial(data):
     """
     Calcula o mês comercial baseado na regra: 16/MM ao 15/MM+1
@@ -71,20 +128,7 @@ def calcular_mes_comercial(data):
     if pd.isna(data):
         return None
     
-    # Se o dia é >= 16, pertence ao mês comercial atual
-    if data.day >= 16:
-        mes_comercial = data
-    else:
-        # Se o dia é < 16, pertence ao mês comercial anterior
-        mes_comercial = data - relativedelta(months=1)
-    
-    # Retornar no formato "Set/2024"
-    meses_pt = {
-        1: 'Jan', 2: 'Fev', 3: 'Mar', 4: 'Abr', 5: 'Mai', 6: 'Jun',
-        7: 'Jul', 8: 'Ago', 9: 'Set', 10: 'Out', 11: 'Nov', 12: 'Dez'
-    }
-    
-    return f"{meses_pt[mes_comercial.month]}/{mes_comercial.year}"
+    return rotulo_mes_comercial(chave_mes_comercial(data.year, data.month, data.day))
 
 def obter_periodo_mes_comercial(mes_comercial_str):
     """
@@ -96,34 +140,53 @@ def obter_periodo_mes_comercial(mes_comercial_str):
     Returns:
         tuple: (data_inicio, data_fim)
     """
-    meses_pt_inv = {
-        'Jan': 1, 'Fev': 2, 'Mar': 3, 'Abr': 4, 'Mai': 5, 'Jun': 6,
-        'Jul': 7, 'Ago': 8, 'Set': 9, 'Out': 10, 'Nov': 11, 'Dez': 12
-    }
-    
-    mes_str, ano_str = mes_comercial_str.split('/')
-    mes = meses_pt_inv[mes_str]
-    ano = int(ano_str)
+    ano, mes_idx = divmod(chave_de_rotulo_mes_comercial(mes_comercial_str) - 1, 12)
     
     # Início: dia 16 do mês
-    data_inicio = pd.Timestamp(year=ano, month=mes, day=16)
+    data_inicio = pd.Timestamp(year=ano, month=mes_idx + 1, day=16)
     
     # Fim: dia 15 do mês seguinte
-    if mes == 12:
-        data_fim = pd.Timestamp(year=ano + 1, month=1, day=15, hour=23, minute=59, second=59)
-    else:
-        data_fim = pd.Timestamp(year=ano, month=mes + 1, day=15, hour=23, minute=59, second=59)
+    ano_fim, mes_fim_idx = divmod(ano * 12 + mes_idx + 1, 12)
+    data_fim = pd.Timestamp(year=ano_fim, month=mes_fim_idx + 1, day=15, hour=23, minute=59, second=59)
     
     return data_inicio, data_fim
 
+def filtrar_periodo(df, col_data, data_inicio=None, data_fim=None):
+    """
+    Recorta o DataFrame a um período pelo índice de datas (busca binária na coluna ordenada)
+
+    Args:
+        df: DataFrame de vendas ou devoluções
+        col_data: nome da coluna de data
+        data_inicio, data_fim: limites inclusivos do período (opcionais)
+
+    Returns:
+        DataFrame: linhas do período
+    """
+    from indices import fatiar_periodo
+    return fatiar_periodo(df, col_data, data_inicio, data_fim)
+
+def filtrar_mes_comercial(df, col_data, mes_comercial_str):
+    """
+    Recorta o DataFrame a um mês comercial (do dia 16 até o fim do dia 15 do mês seguinte)
+
+    Args:
+        df: DataFrame de vendas ou devoluções
+        col_data: nome da coluna de data
+        mes_comercial_str: str no formato "MMM/YYYY" (ex: "Set/2024")
+
+    Returns:
+        DataFrame: linhas do mês comercial
+    """
+    data_inicio, data_fim = obter_periodo_mes_comercial(mes_comercial_str)
+    # Fim exclusivo no dia 16 seguinte, igual ao cálculo da coluna Mes_Comercial
+    data_fim = data_fim.normalize() + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns')
+    return filtrar_periodo(df, col_data, data_inicio, data_fim)
+
 def ordenar_mes_comercial(mes_str):
     """Converte mês comercial em timestamp para ordenação"""
-    meses_pt_inv = {
-        'Jan': 1, 'Fev': 2, 'Mar': 3, 'Abr': 4, 'Mai': 5, 'Jun': 6,
-        'Jul': 7, 'Ago': 8, 'Set': 9, 'Out': 10, 'Nov': 11, 'Dez': 12
-    }
-    mes, ano = mes_str.split('/')
-    return pd.Timestamp(year=int(ano), month=meses_pt_inv[mes], day=1)
+    ano, mes_idx = divmod(chave_de_rotulo_mes_comercial(mes_str) - 1, 12)
+    return pd.Timestamp(year=ano, month=mes_idx + 1, day=1)
 
 def obter_mes_comercial_atual():
     """Retorna o mês comercial atual (mesmo que incompleto)"""
@@ -571,9 +634,20 @@ def gerar_relatorio_pptx(titulo, periodo, metricas_dict, tops_dict, graficos_dic
 # ==============================
 # FILTROS GLOBAIS
 # ==============================
+def valores_unicos_ordenados(serie):
+    """
+    Lista ordenada dos valores distintos de uma coluna, sem nulos.
+    Em colunas categóricas trabalha só com os códigos inteiros, sem varrer texto.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos = np.unique(serie.cat.codes.to_numpy())
+        codigos = codigos[codigos >= 0]
+        return sorted(serie.cat.categories[codigos].tolist())
+    return sorted(serie.dropna().unique().tolist())
+
 def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_vendedor, col_linha, col_data, 
                            col_diretor=None, col_gerente=None, col_gerente_regional=None, 
-                           col_supervisor=None, col_coordenador=None, col_consultor=None):
+                           col_supervisor=None, col_coordenador=None, col_consultor=None, col_valor=None):
     """
     Exibe painel de filtros globais na sidebar que afetam TODAS as páginas.
     Começa VAZIO - usuário seleciona o que quer
@@ -591,6 +665,7 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         col_supervisor: Nome da coluna de supervisor (opcional)
         col_coordenador: Nome da coluna de coordenador (opcional)
         col_consultor: Nome da coluna de consultor (opcional)
+        col_valor: Nome da coluna de valor, somada nas contagens das opções (padrão: col_valor da sessão)
     
     Returns:
         dict: Dicionário com os filtros aplicados
@@ -618,13 +693,60 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         filtros = st.session_state.filtros_globais
         
+        # -------- FACETAS --------
+        # Cada lista só oferece valores que ainda dão resultado com os demais filtros, com a contagem de linhas.
+        # O estado vem das chaves dos widgets (já com o clique desta execução) e as facetas ficam
+        # guardadas no índice do DataFrame por estado de filtro
+        from indices import facetas
+        dimensoes = {
+            chave: col for chave, col in [
+                ('produtos', col_produto), ('vendedores', col_vendedor), ('linhas', col_linha),
+                ('clientes', col_cliente), ('diretores', col_diretor), ('gerentes_regionais', col_gerente_regional),
+                ('gerentes', col_gerente), ('supervisores', col_supervisor), ('coordenadores', col_coordenador),
+                ('consultores', col_consultor)
+            ] if col and col != 'Nenhuma' and col in df_vendas_original.columns
+        }
+        estado = {chave: st.session_state.get(f'filtro_{chave}', filtros.get(chave, [])) for chave in dimensoes}
+        datas_widget = st.session_state.get('filtro_datas')
+        if datas_widget:
+            estado['data_inicio'], estado['data_fim'] = pd.Timestamp(datas_widget[0]), pd.Timestamp(datas_widget[1])
+        else:
+            estado['data_inicio'], estado['data_fim'] = filtros.get('data_inicio'), filtros.get('data_fim')
+        filtro = _filtro_global(
+            df_vendas_original.columns, estado, col_cliente, col_produto, col_vendedor, col_linha, col_data,
+            col_diretor, col_gerente, col_gerente_regional, col_supervisor, col_coordenador, col_consultor
+        )
+        selecoes, periodo = filtro if filtro is not None else ({}, {})
+        faceta = facetas(
+            df_vendas_original, list(dict.fromkeys(dimensoes.values())), selecoes,
+            col_valor=col_valor or st.session_state.get('col_valor'), **periodo
+        )
+        
+        def opcoes(chave):
+            """Valores com linhas sob os demais filtros, mais os já selecionados (o multiselect exige)"""
+            if chave not in dimensoes:
+                return []
+            valores = [valor for valor, _, _ in faceta[dimensoes[chave]]]
+            presentes = set(valores)
+            selecionados = list(estado.get(chave, [])) + list(filtros.get(chave, []))
+            return valores + [v for v in dict.fromkeys(selecionados) if v not in presentes]
+        
+        def rotulo(chave):
+            """Rótulo da opção com a quantidade de linhas que ela traria"""
+            linhas = {valor: n for valor, n, _ in faceta.get(dimensoes.get(chave), [])}
+            def formatar(valor):
+                quantidade = f"{linhas.get(valor, 0):,}".replace(",", ".")
+                return f"{valor} ({quantidade})"
+            return formatar
+        
         # -------- PRODUTO --------
         st.markdown("**📦 Produtos**")
-        produtos = sorted(df_vendas_original[col_produto].dropna().unique().tolist())
+        produtos = opcoes('produtos')
         
         filtros['produtos'] = st.multiselect(
             "Selecione Produtos:",
             options=produtos,
+            format_func=rotulo('produtos'),
             default=filtros.get('produtos', []),
             key='filtro_produtos'
         )
@@ -633,11 +755,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # -------- VENDEDOR --------
         st.markdown("**👤 Vendedores**")
-        vendedores = sorted(df_vendas_original[col_vendedor].dropna().unique().tolist())
+        vendedores = opcoes('vendedores')
         
         filtros['vendedores'] = st.multiselect(
             "Selecione Vendedores:",
             options=vendedores,
+            format_func=rotulo('vendedores'),
             default=filtros.get('vendedores', []),
             key='filtro_vendedores'
         )
@@ -646,11 +769,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # -------- LINHA --------
         st.markdown("**🏢 Linhas**")
-        linhas = sorted(df_vendas_original[col_linha].dropna().unique().tolist())
+        linhas = opcoes('linhas')
         
         filtros['linhas'] = st.multiselect(
             "Selecione Linhas:",
             options=linhas,
+            format_func=rotulo('linhas'),
             default=filtros.get('linhas', []),
             key='filtro_linhas'
         )
@@ -659,11 +783,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # -------- CLIENTE --------
         st.markdown("**🤝 Clientes**")
-        clientes = sorted(df_vendas_original[col_cliente].dropna().unique().tolist())
+        clientes = opcoes('clientes')
         
         filtros['clientes'] = st.multiselect(
             "Selecione Clientes:",
             options=clientes,
+            format_func=rotulo('clientes'),
             default=filtros.get('clientes', []),
             key='filtro_clientes'
         )
@@ -676,11 +801,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # Diretor
         if col_diretor and col_diretor != 'Nenhuma':
-            diretores = sorted(df_vendas_original[col_diretor].dropna().unique().tolist())
+            diretores = opcoes('diretores')
             if diretores:
                 filtros['diretores'] = st.multiselect(
                     "Diretores:",
                     options=diretores,
+                    format_func=rotulo('diretores'),
                     default=filtros.get('diretores', []),
                     key='filtro_diretores'
                 )
@@ -689,11 +815,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # Gerente Regional
         if col_gerente_regional and col_gerente_regional != 'Nenhuma':
-            gerentes_regionais = sorted(df_vendas_original[col_gerente_regional].dropna().unique().tolist())
+            gerentes_regionais = opcoes('gerentes_regionais')
             if gerentes_regionais:
                 filtros['gerentes_regionais'] = st.multiselect(
                     "Gerentes Regionais:",
                     options=gerentes_regionais,
+                    format_func=rotulo('gerentes_regionais'),
                     default=filtros.get('gerentes_regionais', []),
                     key='filtro_gerentes_regionais'
                 )
@@ -702,11 +829,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # Gerente
         if col_gerente and col_gerente != 'Nenhuma':
-            gerentes = sorted(df_vendas_original[col_gerente].dropna().unique().tolist())
+            gerentes = opcoes('gerentes')
             if gerentes:
                 filtros['gerentes'] = st.multiselect(
                     "Gerentes:",
                     options=gerentes,
+                    format_func=rotulo('gerentes'),
                     default=filtros.get('gerentes', []),
                     key='filtro_gerentes'
                 )
@@ -715,11 +843,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # Supervisor
         if col_supervisor and col_supervisor != 'Nenhuma':
-            supervisores = sorted(df_vendas_original[col_supervisor].dropna().unique().tolist())
+            supervisores = opcoes('supervisores')
             if supervisores:
                 filtros['supervisores'] = st.multiselect(
                     "Supervisores:",
                     options=supervisores,
+                    format_func=rotulo('supervisores'),
                     default=filtros.get('supervisores', []),
                     key='filtro_supervisores'
                 )
@@ -728,11 +857,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # Coordenador
         if col_coordenador and col_coordenador != 'Nenhuma':
-            coordenadores = sorted(df_vendas_original[col_coordenador].dropna().unique().tolist())
+            coordenadores = opcoes('coordenadores')
             if coordenadores:
                 filtros['coordenadores'] = st.multiselect(
                     "Coordenadores:",
                     options=coordenadores,
+                    format_func=rotulo('coordenadores'),
                     default=filtros.get('coordenadores', []),
                     key='filtro_coordenadores'
                 )
@@ -741,11 +871,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # Consultor
         if col_consultor and col_consultor != 'Nenhuma':
-            consultores = sorted(df_vendas_original[col_consultor].dropna().unique().tolist())
+            consultores = opcoes('consultores')
             if consultores:
                 filtros['consultores'] = st.multiselect(
                     "Consultores:",
                     options=consultores,
+                    format_func=rotulo('consultores'),
                     default=filtros.get('consultores', []),
                     key='filtro_consultores'
                 )
@@ -754,13 +885,12 @@ def exibir_filtros_globais(df_vendas_original, col_cliente, col_produto, col_ven
         
         # -------- DATA RANGE --------
         st.markdown("**📅 Período de Datas**")
-        df_temp = df_vendas_original.copy()
-        df_temp[col_data] = pd.to_datetime(df_temp[col_data])
-        data_min = df_temp[col_data].min()
-        data_max = df_temp[col_data].max()
+        # Dados ordenados por data (contrato do dataset): mínimo e máximo são as pontas
+        from dados import intervalo_datas
+        data_min, data_max = intervalo_datas(df_vendas_original, col_data)
         
         # Verificar se as datas são válidas
-        if pd.isna(data_min) or pd.isna(data_max):
+        if data_min is None or data_max is None:
             st.warning("⚠️ Datas inválidas ou ausentes nos dados")
             filtros['data_inicio'] = None
             filtros['data_fim'] = None
@@ -863,89 +993,489 @@ def aplicar_filtros_globais(df_original, filtros, col_cliente, col_produto, col_
         col_consultor: Nome da coluna de consultor (opcional)
     
     Returns:
-        DataFrame: DataFrame filtrado (ou original se sem filtros)
-    """
-    df_filtrado = df_original.copy()
-    
-    # Se nenhum filtro foi selecionado, retorna todos os dados
-    tem_filtro = any([
-        filtros.get('produtos'),
-        filtros.get('vendedores'),
-        filtros.get('linhas'),
-        filtros.get('clientes'),
-        filtros.get('diretores'),
-        filtros.get('gerentes'),
-        filtros.get('gerentes_regionais'),
-        filtros.get('supervisores'),
-        filtros.get('coordenadores'),
-        filtros.get('consultores')
-    ])
-    
-    if not tem_filtro:
-        # Apenas aplicar date range se selecionado diferente do padrão
-        if filtros.get('data_inicio') and filtros.get('data_fim'):
-            df_temp = df_filtrado.copy()
-            df_temp[col_data] = pd.to_datetime(df_temp[col_data], errors='coerce')
-            
-            # Remover linhas com datas inválidas
-            df_filtrado = df_filtrado[df_temp[col_data].notna()]
-            df_temp = df_temp[df_temp[col_data].notna()]
-            
-            if not df_temp.empty:
-                df_filtrado = df_filtrado[
-                    (df_temp[col_data] >= filtros['data_inicio']) & 
-                    (df_temp[col_data] <= filtros['data_fim'])
-                ]
-        return df_filtrado
+        DataFrame: DataFrame filtrado (ou cópia rasa do original se sem filtros)
+    """
+    from indices import filtrar
+    
+    filtro = _filtro_global(df_original.columns, filtros, col_cliente, col_produto, col_vendedor, col_linha, col_data,
+                            col_diretor, col_gerente, col_gerente_regional, col_supervisor, col_coordenador, col_consultor)
+    if filtro is None:
+        return df_original.iloc[0:0]
+    selecoes, periodo = filtro
+    return filtrar(df_original, selecoes, **periodo)
+
+def _filtro_global(colunas_df, filtros, col_cliente, col_produto, col_vendedor, col_linha, col_data,
+                   col_diretor=None, col_gerente=None, col_gerente_regional=None,
+                   col_supervisor=None, col_coordenador=None, col_consultor=None, selecoes=None):
+    """
+    Traduz os filtros globais em seleções por coluna e recorte de período.
+    
+    Args:
+        colunas_df: colunas existentes no DataFrame
+        filtros: Dicionário de filtros retornado por exibir_filtros_globais()
+        col_*: nomes das colunas, como em aplicar_filtros_globais
+        selecoes: seleções já existentes (ex.: da hierarquia) com as quais os filtros se combinam
+    
+    Returns:
+        tuple: (selecoes, periodo) ou None se a combinação não deixa nenhuma linha
+    """
+    def valida(col):
+        return col and col != 'Nenhuma' and col in colunas_df
+    
+    # Cada filtro vira uma seleção de valores por coluna; o índice resolve tudo de uma vez
+    selecoes = dict(selecoes or {})
+    for chave, col in [('produtos', col_produto), ('vendedores', col_vendedor), ('linhas', col_linha),
+                       ('clientes', col_cliente), ('diretores', col_diretor), ('gerentes', col_gerente),
+                       ('gerentes_regionais', col_gerente_regional), ('supervisores', col_supervisor),
+                       ('coordenadores', col_coordenador), ('consultores', col_consultor)]:
+        if filtros.get(chave) and valida(col):
+            if col in selecoes:
+                # Dois filtros na mesma coluna: a linha precisa passar nos dois
+                selecionados = set(filtros[chave])
+                selecoes[col] = [v for v in selecoes[col] if v in selecionados]
+                if not selecoes[col]:
+                    return None
+            else:
+                selecoes[col] = list(filtros[chave])
     
-    # Aplicar filtros básicos
-    if filtros.get('produtos'):
-        df_filtrado = df_filtrado[df_filtrado[col_produto].isin(filtros['produtos'])]
+    # Filtro de data só quando o período foi definido
+    tem_periodo = filtros.get('data_inicio') and filtros.get('data_fim')
+    periodo = {
+        'col_data': col_data if tem_periodo else None,
+        'data_inicio': filtros['data_inicio'] if tem_periodo else None,
+        'data_fim': filtros['data_fim'] if tem_periodo else None
+    }
+    return selecoes, periodo
+
+# ==============================
+# DADOS DA SESSÃO
+# ==============================
+class DadosSessao:
+    """
+    Dados de uma sessão sem cópias de DataFrame.
     
-    if filtros.get('vendedores'):
-        df_filtrado = df_filtrado[df_filtrado[col_vendedor].isin(filtros['vendedores'])]
+    Guarda só o que define a visão do usuário (hierarquia, mapeamento de colunas e filtros globais)
+    e o diretório do dataset. As visões são montadas sob demanda por FilterSpec sobre os DataFrames
+    do registro, compartilhados entre sessões, pelo cache de resultados: a sessão ocupa poucos
+    kilobytes e visões idênticas de sessões diferentes são o mesmo objeto.
+    """
     
-    if filtros.get('linhas'):
-        df_filtrado = df_filtrado[df_filtrado[col_linha].isin(filtros['linhas'])]
+    def __init__(self, diretorio, user_hierarchy, colunas, filtros=None):
+        self.diretorio = str(diretorio)
+        self.user_hierarchy = dict(user_hierarchy or {})
+        self.colunas = {chave: valor for chave, valor in colunas.items() if str(chave).startswith('col_')}
+        # Cópia dos filtros: o dicionário da sidebar continua sendo alterado pelos widgets
+        self.filtros = {chave: list(valor) if isinstance(valor, (list, tuple)) else valor
+                        for chave, valor in (filtros or {}).items()}
     
-    if filtros.get('clientes'):
-        df_filtrado = df_filtrado[df_filtrado[col_cliente].isin(filtros['clientes'])]
+    def visao(self, tabela, filtrada=True):
+        """
+        Monta a visão da tabela para o usuário.
+        
+        Args:
+            tabela: 'vendas' ou 'devolucoes'
+            filtrada: se True aplica também os filtros globais; se False só a hierarquia
+        
+        Returns:
+            DataFrame: linhas visíveis (somente leitura; vazio se não houver dados)
+        """
+        return FilterSpec(self, filtrada).executar(tabela)
     
-    # Aplicar filtros de hierarquia
-    if filtros.get('diretores') and col_diretor and col_diretor != 'Nenhuma':
-        df_filtrado = df_filtrado[df_filtrado[col_diretor].isin(filtros['diretores'])]
+    def vendas(self, filtrada=True):
+        """Vendas visíveis para o usuário (ver visao)"""
+        from dados import VENDAS
+        return self.visao(VENDAS, filtrada)
     
-    if filtros.get('gerentes') and col_gerente and col_gerente != 'Nenhuma':
-        df_filtrado = df_filtrado[df_filtrado[col_gerente].isin(filtros['gerentes'])]
+    def devolucoes(self, filtrada=True):
+        """Devoluções visíveis para o usuário (ver visao)"""
+        from dados import DEVOLUCOES
+        return self.visao(DEVOLUCOES, filtrada)
+
+class ContagemDistintos(int):
+    """Contagem de ids distintos (um int) que sabe se veio da estimativa do HyperLogLog"""
     
-    if filtros.get('gerentes_regionais') and col_gerente_regional and col_gerente_regional != 'Nenhuma':
-        df_filtrado = df_filtrado[df_filtrado[col_gerente_regional].isin(filtros['gerentes_regionais'])]
+    def __new__(cls, valor, aproximado=False):
+        contagem = super().__new__(cls, int(valor))
+        contagem.aproximado = bool(aproximado)
+        return contagem
+
+AJUDA_APROXIMADO = "Estimativa (HyperLogLog, erro típico ~1,6%): recorte grande demais para a contagem exata"
+
+def formatar_contagem(contagem):
+    """Formata uma contagem de distintos, com '≈' na frente quando ela é aproximada"""
+    prefixo = "≈" if getattr(contagem, 'aproximado', False) else ""
+    return f"{prefixo}{int(contagem):,}"
+
+def ajuda_contagem(*contagens):
+    """Texto de ajuda para st.metric quando alguma das contagens é aproximada (senão None)"""
+    return AJUDA_APROXIMADO if any(getattr(c, 'aproximado', False) for c in contagens) else None
+
+# Resumos por entidade guardados entre reruns e sessões (os mais antigos saem primeiro)
+MAX_RESUMOS_ENTIDADES = 256
+_resumos_entidades = OrderedDict()
+_resumos_lock = threading.Lock()
+
+class FilterSpec:
+    """
+    Recorte composto: hierarquia do usuário + filtros globais + período da página + seleção de entidades.
     
-    if filtros.get('supervisores') and col_supervisor and col_supervisor != 'Nenhuma':
-        df_filtrado = df_filtrado[df_filtrado[col_supervisor].isin(filtros['supervisores'])]
+    A especificação é imutável (com_mes_comercial, com_periodo e com_entidade devolvem uma nova) e
+    é compilada num plano de índice sobre os DataFrames compartilhados do registro: a fatia da
+    hierarquia como base, uma seleção de valores por coluna e uma faixa de datas. O resultado fica
+    no cache de resultados, então as páginas não varrem de novo os DataFrames já filtrados e
+    especificações iguais (na mesma sessão ou em outras) recebem o mesmo DataFrame.
     
-    if filtros.get('coordenadores') and col_coordenador and col_coordenador != 'Nenhuma':
-        df_filtrado = df_filtrado[df_filtrado[col_coordenador].isin(filtros['coordenadores'])]
+    Exemplo:
+        spec = FilterSpec(dados).com_mes_comercial('Set/2024')
+        df_linha = spec.com_entidade(col_linha, 'Linha A').vendas()
+    """
     
-    if filtros.get('consultores') and col_consultor and col_consultor != 'Nenhuma':
-        df_filtrado = df_filtrado[df_filtrado[col_consultor].isin(filtros['consultores'])]
+    def __init__(self, dados_sessao, filtrada=True):
+        """
+        Args:
+            dados_sessao: DadosSessao da sessão (hierarquia, colunas e filtros globais)
+            filtrada: se False ignora os filtros globais (só hierarquia)
+        """
+        self.dados_sessao = dados_sessao
+        self.filtrada = filtrada
+        self.data_inicio = None
+        self.data_fim = None
+        self.entidades = {}
     
-    # Aplicar filtro de data
-    if filtros.get('data_inicio') and filtros.get('data_fim'):
-        df_temp = df_filtrado.copy()
-        df_temp[col_data] = pd.to_datetime(df_temp[col_data], errors='coerce')
+    def _copiar(self):
+        nova = FilterSpec(self.dados_sessao, self.filtrada)
+        nova.data_inicio, nova.data_fim = self.data_inicio, self.data_fim
+        nova.entidades = dict(self.entidades)
+        return nova
+    
+    def com_periodo(self, data_inicio=None, data_fim=None):
+        """Restringe a um período (limites inclusivos), em cima do período dos filtros globais"""
+        nova = self._copiar()
+        if data_inicio is not None:
+            data_inicio = pd.Timestamp(data_inicio)
+            nova.data_inicio = data_inicio if nova.data_inicio is None else max(nova.data_inicio, data_inicio)
+        if data_fim is not None:
+            data_fim = pd.Timestamp(data_fim)
+            nova.data_fim = data_fim if nova.data_fim is None else min(nova.data_fim, data_fim)
+        return nova
+    
+    def com_mes_comercial(self, mes_comercial_str):
+        """Restringe a um mês comercial ("MMM/YYYY"); None ou 'Todos os Meses' não restringem"""
+        if not mes_comercial_str or mes_comercial_str == 'Todos os Meses':
+            return self
+        data_inicio, data_fim = obter_periodo_mes_comercial(mes_comercial_str)
+        # Fim exclusivo no dia 16 seguinte, igual ao cálculo da coluna Mes_Comercial
+        return self.com_periodo(data_inicio, data_fim.normalize() + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns'))
+    
+    def com_entidade(self, coluna, valores):
+        """Restringe a um ou mais valores de uma coluna (ex.: a linha ou o vendedor selecionado)"""
+        valores = list(valores) if isinstance(valores, (list, tuple, set, pd.Index, np.ndarray)) else [valores]
+        nova = self._copiar()
+        if coluna in nova.entidades:
+            # Duas seleções na mesma coluna: a linha precisa passar nas duas
+            valores = [v for v in nova.entidades[coluna] if v in set(valores)]
+        nova.entidades[coluna] = valores
+        return nova
+    
+    def compilar(self, tabela):
+        """
+        Compila a especificação num plano de índice para uma tabela.
+        
+        Args:
+            tabela: 'vendas', 'devolucoes' ou 'fatos'
+        
+        Returns:
+            dict com df (DataFrame compartilhado), prefixo (chave da origem no cache), selecoes,
+            periodo e base (fatia da hierarquia); ou None se o recorte é vazio por construção
+        """
+        from dados import obter_registro, selecao_hierarquia
+        from indices import assinatura_filtro
+        
+        dados = self.dados_sessao
+        registro = obter_registro(dados.diretorio)
+        versao = registro.versao()
+        df_central = registro.tabela(tabela)
+        if df_central is None or df_central.empty:
+            return {'df': pd.DataFrame(), 'vazio': True}
+        colunas = dados.colunas
+        
+        selecao = selecao_hierarquia(dados.user_hierarchy, colunas, df_central.columns)
+        if any(not valores for valores in selecao.values()):
+            return {'df': df_central, 'vazio': True}
         
-        # Remover linhas com datas inválidas antes de filtrar
-        df_filtrado = df_filtrado[df_temp[col_data].notna()]
-        df_temp = df_temp[df_temp[col_data].notna()]
+        # Filtros globais viram seleções por coluna; as entidades da página se somam a elas
+        selecoes, periodo = {}, {'col_data': None, 'data_inicio': None, 'data_fim': None}
+        if self.filtrada and dados.filtros:
+            filtro = _filtro_global(
+                df_central.columns, dados.filtros,
+                colunas.get('col_cliente'), colunas.get('col_produto'), colunas.get('col_vendedor'),
+                colunas.get('col_linha'), colunas.get('col_data'),
+                col_diretor=colunas.get('col_diretor'), col_gerente=colunas.get('col_gerente'),
+                col_gerente_regional=colunas.get('col_gerente_regional'), col_supervisor=colunas.get('col_supervisor'),
+                col_coordenador=colunas.get('col_coordenador'), col_consultor=colunas.get('col_consultor')
+            )
+            if filtro is None:
+                return {'df': df_central, 'vazio': True}
+            selecoes, periodo = filtro
+        for coluna, valores in self.entidades.items():
+            if coluna in selecoes:
+                selecionados = set(valores)
+                valores = [v for v in selecoes[coluna] if v in selecionados]
+            if not valores:
+                return {'df': df_central, 'vazio': True}
+            selecoes[coluna] = valores
+        
+        # Período da página dentro do período global
+        if self.data_inicio is not None or self.data_fim is not None:
+            inicio, fim = periodo['data_inicio'], periodo['data_fim']
+            if self.data_inicio is not None:
+                inicio = self.data_inicio if inicio is None else max(pd.Timestamp(inicio), self.data_inicio)
+            if self.data_fim is not None:
+                fim = self.data_fim if fim is None else min(pd.Timestamp(fim), self.data_fim)
+            if inicio is not None and fim is not None and inicio > fim:
+                return {'df': df_central, 'vazio': True}
+            periodo = {'col_data': colunas.get('col_data'), 'data_inicio': inicio, 'data_fim': fim}
+        
+        return {
+            'df': df_central,
+            'vazio': False,
+            'registro': registro,
+            'hierarquia': selecao,
+            'prefixo': (versao, tabela, assinatura_filtro(selecao)),
+            'selecoes': selecoes,
+            'periodo': periodo,
+            'base': registro.fatia_hierarquia(tabela, selecao),
+        }
+    
+    def executar(self, tabela):
+        """
+        Executa o plano compilado pelo cache de resultados compartilhado.
         
-        if not df_temp.empty:
-            df_filtrado = df_filtrado[
-                (df_temp[col_data] >= filtros['data_inicio']) & 
-                (df_temp[col_data] <= filtros['data_fim'])
-            ]
+        Returns:
+            DataFrame: linhas do recorte (somente leitura; vazio se não houver dados)
+        """
+        from indices import obter_cache_resultados
+        plano = self.compilar(tabela)
+        if plano['vazio']:
+            return plano['df'].iloc[0:0]
+        return obter_cache_resultados().obter(
+            plano['df'], plano['prefixo'], plano['selecoes'], base=plano['base'], **plano['periodo']
+        )
     
-    return df_filtrado
+    def agregar(self, dimensoes, medidas=None, tabela='vendas'):
+        """
+        Soma medidas por dimensões no recorte, respondendo pelo cubo de agregados quando ele
+        tem todas as colunas envolvidas (senão agrupa as linhas do recorte).
+        
+        Equivale a executar(tabela).groupby(dimensoes, observed=True)[medidas].sum().reset_index(),
+        com os meses comerciais em ordem cronológica.
+        
+        Args:
+            dimensoes: colunas de agrupamento (nomes reais; 'Mes_Comercial' agrupa por mês comercial)
+            medidas: colunas de valor, quantidade e/ou toneladas (nomes reais); None = só o valor
+            tabela: 'vendas' ou 'devolucoes'
+        
+        Returns:
+            DataFrame: uma linha por combinação das dimensões, com as medidas somadas
+        """
+        from cubo import MEDIDAS, coluna_medida, consultar_cubo, ordenar_por_mes
+        
+        colunas = self.dados_sessao.colunas
+        dimensoes = [dimensoes] if isinstance(dimensoes, str) else list(dimensoes)
+        medidas = [colunas['col_valor']] if medidas is None else list(medidas)
+        plano = self.compilar(tabela)
+        if plano['vazio']:
+            return pd.DataFrame(columns=dimensoes + medidas)
+        
+        # Medida real -> coluna do cubo
+        nomes_cubo = {colunas.get(chave): coluna_medida(tabela, nome) for chave, nome in MEDIDAS.items()}
+        consulta = self._consulta_cubo(plano, dimensoes)
+        if consulta is not None and all(nomes_cubo.get(m) in consulta[0].columns for m in medidas):
+            cubo, selecoes, periodo = consulta
+            resultado = consultar_cubo(
+                cubo, dimensoes, selecoes, periodo['data_inicio'], periodo['data_fim'],
+                tabela=tabela, medidas=[nomes_cubo[m] for m in medidas]
+            )
+            return resultado.rename(columns={nomes_cubo[m]: m for m in medidas})
+        
+        df = self.executar(tabela)
+        return ordenar_por_mes(df.groupby(dimensoes, observed=True)[medidas].sum().reset_index(), dimensoes)
+    
+    def distintos(self, nome, tabela='vendas', modo='auto', limiar=None):
+        """
+        Quantidade de clientes ou pedidos distintos no recorte, respondida pelos esboços por
+        célula do cubo quando os filtros cabem no cubo (senão, nunique nas linhas do recorte).
+        
+        Args:
+            nome: 'clientes' (col_codCliente) ou 'pedidos' (Pedido_Unico)
+            tabela: 'vendas' ou 'devolucoes'
+            modo: 'exato', 'aproximado' (HyperLogLog) ou 'auto' (aproximado só em recortes grandes);
+                use 'exato' quando o número entra em contas ou sai em relatório
+            limiar: volume de ids a partir do qual o modo 'auto' aproxima
+                (padrão: cubo.LIMIAR_DISTINTOS_EXATO)
+        
+        Returns:
+            ContagemDistintos: ids distintos (int), com aproximado=True se for estimativa
+        """
+        from cubo import DISTINTOS, LIMIAR_DISTINTOS_EXATO, celulas_cubo
+        
+        chave = DISTINTOS[nome]
+        coluna = self.dados_sessao.colunas.get(chave) if chave.startswith('col_') else chave
+        plano = self.compilar(tabela)
+        if plano['vazio']:
+            return ContagemDistintos(0)
+        
+        consulta = self._consulta_cubo(plano, [])
+        esboco = plano['registro'].esbocos_distintos().get((tabela, nome)) if consulta is not None else None
+        if esboco is not None:
+            cubo, selecoes, periodo = consulta
+            celulas = celulas_cubo(cubo, selecoes, periodo['data_inicio'], periodo['data_fim'], tabela=tabela)
+            limiar = LIMIAR_DISTINTOS_EXATO if limiar is None else limiar
+            return ContagemDistintos(esboco.contar(celulas, modo, limiar), esboco.aproxima(celulas, modo, limiar))
+        
+        df = self.executar(tabela)
+        return ContagemDistintos(df[coluna].nunique() if coluna in df.columns else 0)
+    
+    def resumo_entidades(self, dimensao):
+        """
+        Resumo por entidade (linha, produto, vendedor, gerente regional...) no recorte: vendas,
+        devoluções, quantidade e toneladas vendidas, líquido e taxa de devolução.
+        
+        Sai de uma única agregação sobre vendas e devoluções juntas: pelo cubo quando ele responde
+        (as medidas das duas tabelas já ficam lado a lado em cada célula), senão por um groupby
+        sobre o recorte da tabela de fatos. O resultado fica guardado por dimensão e
+        assinatura do filtro.
+        
+        Args:
+            dimensao: coluna da entidade (nome real)
+        
+        Returns:
+            DataFrame indexado pela entidade, com 'Vendas', 'Devoluções', 'Quantidade', 'Toneladas',
+            'Líquido' e 'Taxa Dev. (%)', em ordem decrescente de vendas
+        """
+        from cubo import coluna_medida, consultar_cubo
+        from dados import somar_movimentos, VENDAS, DEVOLUCOES, MOVIMENTO_VENDA, MOVIMENTO_DEVOLUCAO
+        from indices import assinatura_filtro
+        
+        colunas = self.dados_sessao.colunas
+        medidas = {'Vendas': (VENDAS, 'col_valor', 'valor'), 'Devoluções': (DEVOLUCOES, 'col_valor', 'valor'),
+                   'Quantidade': (VENDAS, 'col_quantidade', 'quantidade'), 'Toneladas': (VENDAS, 'col_toneladas', 'toneladas')}
+        planos = {tabela: self.compilar(tabela) for tabela in (VENDAS, DEVOLUCOES)}
+        chave = (dimensao,) + tuple(
+            (plano['prefixo'], assinatura_filtro(plano['selecoes'], **plano['periodo']))
+            for plano in planos.values() if not plano['vazio']
+        )
+        with _resumos_lock:
+            if chave in _resumos_entidades:
+                _resumos_entidades.move_to_end(chave)
+                return _resumos_entidades[chave].copy()
+        
+        consulta = self._consulta_cubo(planos[VENDAS], [dimensao]) if not planos[VENDAS]['vazio'] else None
+        if consulta is not None and (planos[DEVOLUCOES]['vazio']
+                                     or planos[DEVOLUCOES]['hierarquia'] == planos[VENDAS]['hierarquia']):
+            # Células com vendas ou devoluções: a união das entidades das duas tabelas
+            cubo, selecoes, periodo = consulta
+            nomes = {nome: coluna_medida(tabela, curto) for nome, (tabela, _, curto) in medidas.items()
+                     if coluna_medida(tabela, curto) in cubo.columns}
+            resumo = consultar_cubo(cubo, [dimensao], selecoes, periodo['data_inicio'], periodo['data_fim'],
+                                    medidas=list(nomes.values()))
+            resumo = resumo.rename(columns={v: k for k, v in nomes.items()}).set_index(dimensao)
+        else:
+            # Um groupby só sobre a tabela de fatos: cada medida sai do bloco do seu movimento
+            df = self.movimentos()
+            movimento = {VENDAS: MOVIMENTO_VENDA, DEVOLUCOES: MOVIMENTO_DEVOLUCAO}
+            nomes = {nome: colunas.get(chave_coluna) for nome, (_, chave_coluna, _) in medidas.items()
+                     if colunas.get(chave_coluna) in df.columns}
+            if df.empty or dimensao not in df.columns or not nomes:
+                resumo = pd.DataFrame(columns=list(medidas), dtype='float64')
+            else:
+                somas = somar_movimentos(df, dimensao, list(dict.fromkeys(nomes.values())))
+                resumo = pd.DataFrame({nome: somas[(col, movimento[medidas[nome][0]])] for nome, col in nomes.items()})
+            resumo.index.name = dimensao
+        
+        for nome in medidas:
+            if nome not in resumo.columns:
+                resumo[nome] = 0.0
+        resumo = resumo[list(medidas)].fillna(0)
+        resumo['Líquido'] = resumo['Vendas'] - resumo['Devoluções']
+        resumo['Taxa Dev. (%)'] = (resumo['Devoluções'] / resumo['Vendas'] * 100).fillna(0)
+        resumo = resumo.sort_values('Vendas', ascending=False)
+        
+        with _resumos_lock:
+            _resumos_entidades[chave] = resumo
+            while len(_resumos_entidades) > MAX_RESUMOS_ENTIDADES:
+                _resumos_entidades.popitem(last=False)
+        return resumo.copy()
+    
+    def _consulta_cubo(self, plano, dimensoes):
+        """
+        Traduz o plano compilado numa consulta ao cubo: (cubo, seleções, período), ou None se o
+        cubo não responde exatamente (coluna fora do grão, período quebrado no meio do dia etc.).
+        """
+        from cubo import pode_responder
+        
+        # Hierarquia e filtros somados numa seleção só
+        selecoes = dict(plano['selecoes'])
+        for coluna, valores in plano['hierarquia'].items():
+            if coluna in selecoes:
+                permitidos = set(valores)
+                valores = [v for v in selecoes[coluna] if v in permitidos]
+            selecoes[coluna] = valores
+        if not all(selecoes.values()):
+            return None
+        
+        cubo = plano['registro'].cubo()
+        periodo = plano['periodo']
+        if not pode_responder(cubo, dimensoes, selecoes, periodo['data_inicio'], periodo['data_fim']):
+            return None
+        return cubo, selecoes, periodo
+    
+    def vendas(self):
+        """Vendas do recorte"""
+        from dados import VENDAS
+        return self.executar(VENDAS)
+    
+    def devolucoes(self):
+        """Devoluções do recorte"""
+        from dados import DEVOLUCOES
+        return self.executar(DEVOLUCOES)
+    
+    def movimentos(self):
+        """Vendas e devoluções do recorte numa tabela só (ver dados.montar_fatos)"""
+        from dados import FATOS
+        return self.executar(FATOS)
+    
+    def resumo_movimentos(self, dimensao, chave_medida='col_valor'):
+        """
+        Vendas, devoluções e líquido de uma medida por entidade, num único groupby sobre o
+        recorte da tabela de fatos.
+        
+        Args:
+            dimensao: coluna da entidade (nome real)
+            chave_medida: chave da medida no mapeamento de colunas
+        
+        Returns:
+            DataFrame indexado pela entidade com 'Vendas', 'Devoluções' e 'Líquido'
+            (entidades com vendas ou devoluções no recorte)
+        """
+        from dados import coluna_liquida, somar_movimentos, MOVIMENTO_VENDA, MOVIMENTO_DEVOLUCAO
+        
+        col = self.dados_sessao.colunas.get(chave_medida)
+        df = self.movimentos()
+        if df.empty or dimensao not in df.columns or col not in df.columns:
+            resumo = pd.DataFrame(columns=['Vendas', 'Devoluções', 'Líquido'], dtype='float64')
+            resumo.index.name = dimensao
+            return resumo
+        somas = somar_movimentos(df, dimensao, [col, coluna_liquida(col)])
+        return pd.DataFrame({
+            'Vendas': somas[(col, MOVIMENTO_VENDA)],
+            'Devoluções': somas[(col, MOVIMENTO_DEVOLUCAO)],
+            'Líquido': somas[coluna_liquida(col)].sum(axis=1),
+        }).fillna(0)
+
+def obter_dados_sessao():
+    """Handle de dados da sessão, criado pela página inicial (None se os dados ainda não foram carregados)"""
+    return st.session_state.get('dados_sessao')
 
 def obter_dados_filtrados():
     """
@@ -955,8 +1485,9 @@ def obter_dados_filtrados():
     Returns:
         tuple: (df_vendas_filtrado, df_devolucoes_filtrado)
     """
-    # Os dados já vêm filtrados do session_state (aplicados em app.py)
-    df_vendas = st.session_state.get('df_vendas', pd.DataFrame())
-    df_devolucoes = st.session_state.get('df_devolucoes', pd.DataFrame())
+    # As visões são montadas a partir do handle da sessão (criado na página inicial)
+    dados = obter_dados_sessao()
+    if dados is None:
+        return pd.DataFrame(), pd.DataFrame()
     
-    return df_vendas, df_devolucoes
\ No newline at end of file
+    return dados.vendas(), dados.devolucoes()
\ No newline at end of file